@@ -349,6 +349,10 @@ if hasattr(bpy.types, "AddonPreferences"):
             description=_("Maximum tolerance for adaptive sliders [0.001-100] %"))
         adaptive_stepsize = FloatProperty(name = _("Correction Stepsize %"), min = 0.001, max = 100, default = 20,
             description=_("Stepsize for corrections [0.001-100] %"))
+        use_incremental_sliders = BoolProperty(default=True, name=_("Incremental Sliders"),
+            description=_("When a single slider changes, only update the bones and vertices affected by this slider.\nDisable to always recalculate the entire Avatar"))
+        use_vectorized_sliders = BoolProperty(default=True, name=_("Vectorized Sliders"),
+            description=_("Calculate the slider deformation of Custom Meshes with array operations (fast).\nDisable to use the per vertex calculation (slow, only for reference)"))
 
         verbose  = BoolProperty(default=True, name=_("Display additional Help"),
             description=_("Enable display of help links in Panel headers"))
@@ -572,6 +576,8 @@ if hasattr(bpy.types, "AddonPreferences"):
             col.prop(self,"adaptive_tolerance",  slider=True, toggle=False)
             col.prop(self,"adaptive_iterations", slider=True, toggle=False)
             col.prop(self,"adaptive_stepsize",   slider=True, toggle=False)
+            col.prop(self,"use_vectorized_sliders")
+            col.prop(self,"use_incremental_sliders")
 
             box = split.box()
             col=box.column(align=True)
@@ -3139,15 +3145,22 @@ Note: The .anim format is the SL internal format.'''
 
                     return start, end, fps
 
-                for action in [action for action in bpy.data.actions if action.AnimProps.select]:
-                    armobj.animation_data.action = action
-                    fr = action.frame_range
-                    s, e, f = get_frinfo(action, armobj.AnimProps.selected_actions, scn)
-                    scn.frame_start = s
-                    scn.frame_end = e
-                    scn.render.fps = f
-                    path = "%s/%s.%s" % (filepath,action.name, mode) if armobj.AnimProps.selected_actions else filepath
-                    animation.exportAnimation(action, path, mode)
+                with animation.AnimationExportPipeline() as pipeline:
+                    for action in [action for action in bpy.data.actions if action.AnimProps.select]:
+                        armobj.animation_data.action = action
+                        fr = action.frame_range
+                        s, e, f = get_frinfo(action, armobj.AnimProps.selected_actions, scn)
+                        scn.frame_start = s
+                        scn.frame_end = e
+                        scn.render.fps = f
+                        path = "%s/%s.%s" % (filepath,action.name, mode) if armobj.AnimProps.selected_actions else filepath
+                        pipeline.submit(action, path, mode)
+
+                report = pipeline.report()
+                for line in report:
+                    log.info("Exported %s" % line)
+                if armobj.AnimProps.selected_actions:
+                    self.report({'INFO'}, _("Exported %d actions (see log for details)") % len(report))
 
             else:
                 log.info("NLA Export to %s" % filepath)
@@ -3476,8 +3489,10 @@ class PanelMotionTransfer(bpy.types.Panel):
             col.prop(prop, "simplificationMethod", text='')
             if prop.simplificationMethod == 'loweslocal':
                 col.prop(prop, "lowesLocalTol")
+                col.prop(prop, "lowesPerChannel")
             elif prop.simplificationMethod == 'lowesglobal':
                 col.prop(prop, "lowesGlobalTol")
+                col.prop(prop, "lowesPerChannel")
 
             col = layout.column()
             col.separator()
@@ -3940,6 +3955,8 @@ class MocapProp(bpy.types.PropertyGroup):
     simplificationMethod = EnumProperty(items=simplificationitems, name=_('Method'), default='none')
     lowesLocalTol = FloatProperty(default=0.02, name=_("Tol"))
     lowesGlobalTol = FloatProperty(default=0.1, name=_("Tol"))
+    lowesPerChannel = BoolProperty(default=False, name=_("Per Channel"),
+        description="Bound the error of every single channel by Tol instead of the distance of the whole curve point")
     seamlessRotFrames = IntProperty(default=0, name=_("Rot frames"), min=0,
         description="Blend range to make seamles rotation")
     seamlessLocFrames = IntProperty(default=0, name=_("Loc frames"), min=0,
@@ -4810,9 +4827,24 @@ def BLinitialisation():
     bpy.app.handlers.scene_update_post.append(check_for_system_mesh_edit)
     bpy.app.handlers.scene_update_post.append(weights.edit_object_change_handler)
     bpy.app.handlers.scene_update_post.append(rig.fix_linebones_on_update)
+    bpy.app.handlers.scene_update_post.append(pannels.update_mesh_info_on_update)
+    bpy.app.handlers.scene_update_post.append(shape.update_weight_maps_on_update)
 
     bpy.app.handlers.load_post.append(fix_bone_layers_on_load)
     bpy.app.handlers.load_post.append(fix_karaage_data_on_load)
+    bpy.app.handlers.load_post.append(rig.reset_rest_pose_caches)
+    bpy.app.handlers.load_post.append(pannels.reset_mesh_info_cache)
+    bpy.app.handlers.load_post.append(util.reset_object_caches)
+    bpy.app.handlers.undo_post.append(rig.reset_rest_pose_caches)
+    bpy.app.handlers.redo_post.append(rig.reset_rest_pose_caches)
+    bpy.app.handlers.undo_post.append(util.reset_object_caches)
+    bpy.app.handlers.redo_post.append(util.reset_object_caches)
+    bpy.app.handlers.load_post.append(shape.reset_weight_maps)
+    bpy.app.handlers.undo_post.append(shape.reset_weight_maps)
+    bpy.app.handlers.redo_post.append(shape.reset_weight_maps)
+    bpy.app.handlers.load_post.append(shape.reset_slider_contributions)
+    bpy.app.handlers.undo_post.append(shape.reset_slider_contributions)
+    bpy.app.handlers.redo_post.append(shape.reset_slider_contributions)
     bpy.app.handlers.frame_change_post.append(shape.update_on_framechange)
 
 def vgroup_items(self, context):
@@ -4965,8 +4997,23 @@ def unregister():
         bpy.app.handlers.scene_update_post.remove(rig.sync_timeline_action)
         bpy.app.handlers.scene_update_post.remove(rig.check_dirty_armature_on_update)
         bpy.app.handlers.scene_update_post.remove(rig.fix_linebones_on_update)
+        bpy.app.handlers.scene_update_post.remove(pannels.update_mesh_info_on_update)
+        bpy.app.handlers.scene_update_post.remove(shape.update_weight_maps_on_update)
         bpy.app.handlers.load_post.remove(fix_bone_layers_on_load)
         bpy.app.handlers.load_post.remove(fix_karaage_data_on_load)
+        bpy.app.handlers.load_post.remove(rig.reset_rest_pose_caches)
+        bpy.app.handlers.load_post.remove(pannels.reset_mesh_info_cache)
+        bpy.app.handlers.load_post.remove(util.reset_object_caches)
+        bpy.app.handlers.undo_post.remove(rig.reset_rest_pose_caches)
+        bpy.app.handlers.redo_post.remove(rig.reset_rest_pose_caches)
+        bpy.app.handlers.undo_post.remove(util.reset_object_caches)
+        bpy.app.handlers.redo_post.remove(util.reset_object_caches)
+        bpy.app.handlers.load_post.remove(shape.reset_weight_maps)
+        bpy.app.handlers.undo_post.remove(shape.reset_weight_maps)
+        bpy.app.handlers.redo_post.remove(shape.reset_weight_maps)
+        bpy.app.handlers.load_post.remove(shape.reset_slider_contributions)
+        bpy.app.handlers.undo_post.remove(shape.reset_slider_contributions)
+        bpy.app.handlers.redo_post.remove(shape.reset_slider_contributions)
         bpy.app.handlers.frame_change_post.remove(shape.update_on_framechange)
 
         bpy.types.INFO_MT_file_export.remove(sl_skeleton_func_export)
@@ -37,8 +37,10 @@ from bpy.props import *
 from struct import pack, unpack, calcsize
 from mathutils import Matrix, Vector, Euler
 
-import re, os, logging, gettext
+import re, os, io, logging, gettext, time
+import numpy as np
 from math import *
+from concurrent.futures import ThreadPoolExecutor
 from .const import *
 from . import create, data, rig, shape, util, context_util
 from .context_util import set_context
@@ -143,6 +145,106 @@ def F32_to_U16(inputF, lower, upper):
 
     return int(floor(inputF))
 
+def F32_to_U16_array(values, lower, upper):
+    '''
+    Vectorized F32_to_U16()
+    '''
+    values = np.clip(values, lower, upper) - lower
+    if upper!=lower:
+        values = values / (upper - lower)
+    return np.floor(values * 65535).astype(np.uint16)
+
+def matrices_to_quaternions(M):
+    '''
+    Vectorized Matrix.to_quaternion() for an array of 3x3
+    or 4x4 matrices. Follows Blender's mat3_to_quat(), including
+    its choice of the quaternion sign. Returns (w,x,y,z) rows.
+    '''
+    M = np.array(M[...,:3,:3], dtype=np.float64)
+    M /= np.linalg.norm(M, axis=-2)[...,np.newaxis,:]
+    m00, m01, m02 = M[...,0,0], M[...,0,1], M[...,0,2]
+    m10, m11, m12 = M[...,1,0], M[...,1,1], M[...,1,2]
+    m20, m21, m22 = M[...,2,0], M[...,2,1], M[...,2,2]
+
+    q  = np.empty(M.shape[:-2]+(4,))
+    tr = 0.25 * (1.0 + m00 + m11 + m22)
+    use_w = tr > 1e-4
+    use_x = ~use_w & (m00 > m11) & (m00 > m22)
+    use_y = ~use_w & ~use_x & (m11 > m22)
+    use_z = ~use_w & ~use_x & ~use_y
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.sqrt(tr)
+        s4 = 1.0 / (4.0 * s)
+        q[use_w] = np.stack((s, (m21-m12)*s4, (m02-m20)*s4, (m10-m01)*s4), axis=-1)[use_w]
+
+        s = 2.0 * np.sqrt(1.0 + m00 - m11 - m22)
+        q[use_x] = np.stack(((m21-m12)/s, 0.25*s, (m01+m10)/s, (m02+m20)/s), axis=-1)[use_x]
+
+        s = 2.0 * np.sqrt(1.0 + m11 - m00 - m22)
+        q[use_y] = np.stack(((m02-m20)/s, (m01+m10)/s, 0.25*s, (m12+m21)/s), axis=-1)[use_y]
+
+        s = 2.0 * np.sqrt(1.0 + m22 - m00 - m11)
+        q[use_z] = np.stack(((m10-m01)/s, (m02+m20)/s, (m12+m21)/s, 0.25*s), axis=-1)[use_z]
+
+    q /= np.linalg.norm(q, axis=-1)[...,np.newaxis]
+    return q
+
+class VisualTransforms:
+    '''
+    The visual matrices (see visualmatrix) of a set of bones,
+    sampled over a sequence of frames. matrices[i] holds the
+    contiguous (frames,4,4) array of the bone bones[i]
+    '''
+
+    def __init__(self, frames, bones, matrices):
+        self.frames   = np.asarray(frames)
+        self.bones    = list(bones)
+        self.index    = {name:i for i, name in enumerate(self.bones)}
+        self.matrices = matrices
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, bonename):
+        return bonename in self.index
+
+    def get(self, bonename):
+        i = self.index.get(bonename)
+        return None if i is None else self.matrices[i]
+
+    def subset(self, frames):
+        '''
+        Return the transforms of the given frames only
+        '''
+        keep = np.in1d(self.frames, list(frames))
+        return VisualTransforms(self.frames[keep], self.bones, self.matrices[:,keep])
+
+    def frame_transforms(self, frame):
+        '''
+        Return the transforms of one frame as {bonename:Matrix}
+        '''
+        j = int(np.flatnonzero(self.frames == frame)[0])
+        return {name:Matrix(self.matrices[i,j].tolist()) for i, name in enumerate(self.bones)}
+
+def visualmatrix_constants(use_bind_pose, dbone):
+    '''
+    Return the frame independent parts A and CI of the
+    visual matrix of a bone as arrays, such that
+    visualmatrix = A * parent.matrix.inverted() * pbone.matrix * CI
+    '''
+    if use_bind_pose:
+        M = Matrix(dbone['mat0']).copy() # bone pose matrix in objects frame
+        MP = Matrix(dbone.parent['mat0']).copy() if dbone.parent else Matrix()
+
+    else:
+        M = dbone.matrix_local.copy() # bone data matrix in objects frame
+        MP = dbone.parent.matrix_local.copy() if dbone.parent else Matrix()
+
+    C = M.to_3x3().to_4x4()
+    A = C * M.inverted() * MP
+    return np.array(A), np.array(C.inverted())
+
 def visualmatrix(context, armobj, dbone, pbone):
     '''
         return a local delta transformation matrix that captures the visual
@@ -177,35 +279,32 @@ def visualmatrix(context, armobj, dbone, pbone):
 
     return visual_matrix
 
-def dot(v1,v2):
+def distancesToLine(P, A, B):
     '''
-    return the dot product between v1 and v2
+    Calculate Euclidean distances from all points in P to line A-B
+    in any number of dimensions
     '''
-   
-    ans=0
-    for a in map(lambda x,y:x*y, v1,v2):
-        ans+=a
-    return ans
 
-def distanceToLine(P,A,B):
-    '''
-    Calculate Euclidean distance from P to line A-B in any number of dimensions
-    '''
+    AP = A - P
+    AB = A - B
 
-    P = tuple(P)
-    A = tuple(A)
-    B = tuple(B)
+    ABAP = AP.dot(AB)
+    ABAB = AB.dot(AB)
+    APAP = np.einsum('ij,ij->i', AP, AP)
 
-    AP = [v for v in map(lambda x,y:x-y, A,P)] 
-    AB = [v for v in map(lambda x,y:x-y, A,B)] 
+    return np.sqrt(np.abs(APAP - ABAP**2/ABAB))
 
-    ABAP = dot(AB,AP)
-    ABAB = dot(AB,AB)
-    APAP = dot(AP,AP)
+def channelErrors(P, A, B):
+    '''
+    Calculate for all points in P the largest deviation of any channel
+    from the linear interpolation between A and B. The first column
+    is the frame and is used as interpolation parameter.
+    '''
 
-    d = sqrt(abs(APAP-ABAP**2/ABAB))
+    t = (P[:,0] - A[0]) / (B[0] - A[0])
+    L = A[1:] + t[:,np.newaxis] * (B[1:] - A[1:])
 
-    return d
+    return np.abs(P[:,1:] - L).max(axis=1)
 
 def update_sync_influence(context, val, symmetry):
     pbones = context.object.pose.bones
@@ -713,6 +812,132 @@ def drives_other(dependencies, master, slave):
     driven_bones = drivers[master.name]
     return slave.name in driven_bones
 
+FCURVE_BONE_CHANNEL = re.compile(r'"([\w\. ]+)".+\.(rotation|location|scale)')
+
+BONE_INDEXES = {}
+
+def bone_index_signature(arm):
+    '''
+    Summary of everything a BoneIndex depends on:
+    the bones of the armature and the targets of their constraints
+    '''
+
+    constraints = []
+    for pbone in arm.pose.bones:
+        for c in pbone.constraints:
+            target = getattr(c, 'target', None)
+            constraints.append((pbone.name, c.name, target.name if target else None, getattr(c, 'subtarget', None)))
+    return arm.data.as_pointer(), tuple(arm.data.bones.keys()), tuple(constraints)
+
+class BoneIndex:
+    '''
+    Precompiled lookup of the bones which are affected by the F-curves
+    of an armature: the bone and channel of a data_path, the bones depending
+    on it through constraints, and the bones of IK limbs and hands.
+    '''
+
+    def __init__(self, arm, signature):
+        self.signature = signature
+        self.bones = set(arm.data.bones.keys())
+        self.children = {dbone.name:[child.name for child in dbone.children] for dbone in arm.data.bones}
+        self.dependencies = init_dependencies(arm)
+        self.channels = {}
+        self.limbs = {}
+        self.fingers = {}
+
+    def channel(self, data_path):
+        '''
+        Return (rots, loc, slaves, ignored) for an F-curve data_path:
+        rots    : bones which get a rotation channel
+        loc     : bone which gets a location channel when translations are exported
+        slaves  : bones which get a rotation channel otherwise
+        ignored : name of a referenced bone which is missing in the rig
+        or None when the F-curve does not animate a bone.
+        '''
+
+        try:
+            return self.channels[data_path]
+        except KeyError:
+            entry = self.channels[data_path] = self.compile_channel(data_path)
+            return entry
+
+    def compile_channel(self, data_path):
+        mo = FCURVE_BONE_CHANNEL.search(data_path)
+        if mo is None:
+            return None
+
+        bonename = mo.group(1)
+        keytype = mo.group(2)
+
+        if bonename in ['Origin']:
+            return None
+        elif bonename in ['COG', 'PelvisInv']:
+
+            bonename = 'Pelvis'
+        elif bonename == 'EyeTarget' and keytype=='location':
+            return ("mEyeLeft", "mEyeRight"), None, (), None
+        elif bonename == 'FaceEyeAltTarget' and keytype=='location':
+            return ("mFaceEyeAltLeft", "mFaceEyeAltRight"), None, (), None
+
+        if "m"+bonename in self.bones:
+
+            bonename = "m"+bonename
+        elif not bonename in self.bones:
+            return (), None, (), bonename
+
+        if keytype=='rotation':
+            return (bonename,), None, (), None
+
+        slaves = get_slaves(self.dependencies, bonename) or {}
+        slaves = ["m" + slave if "m"+slave in self.bones else slave for slave in slaves.keys()]
+        slaves = tuple(bn for bn in slaves if bn[0] == 'm')
+        loc = bonename if keytype=='location' else None
+        return (), loc, slaves, None
+
+    def limb(self, ikbone):
+        '''
+        Return the FK bones of the limb controlled by ikbone
+        '''
+
+        try:
+            return self.limbs[ikbone]
+        except KeyError:
+            limbset = get_limb_from_ikbone(ikbone)
+            names = [key for key in limbset if not key.startswith('ik')] if limbset else None
+            self.limbs[ikbone] = names
+            return names
+
+    def regular_children(self, bonename):
+        '''
+        Return the chain of single regular children below bonename
+        '''
+
+        try:
+            return self.fingers[bonename]
+        except KeyError:
+            chain = []
+            name = bonename
+            while True:
+                childset = [c for c in self.children.get(name, []) if c[0] != 'a' and not c.startswith('ik')]
+                if len(childset) != 1:
+                    break
+                name = childset[0]
+                chain.append(name)
+            self.fingers[bonename] = chain
+            return chain
+
+def get_bone_index(arm):
+    '''
+    Return the BoneIndex of arm. The index is rebuilt only
+    when the bones or the bone constraints have changed.
+    '''
+
+    signature = bone_index_signature(arm)
+    index = BONE_INDEXES.get(arm.name)
+    if index is None or index.signature != signature:
+        index = BONE_INDEXES[arm.name] = BoneIndex(arm, signature)
+    return index
+
 def get_props_from_action(armobj, action):
     props  = action.AnimProps if action else armobj.AnimProps
     return props
@@ -730,6 +955,16 @@ def get_props_from_context(context):
     return get_props_from_obj(obj)
 
 def exportAnimation(action, filepath, mode):
+    ANIM = sampleAnimation(action, filepath, mode)
+    return encodeAnimation(filepath, ANIM)
+
+def sampleAnimation(action, filepath, mode):
+    '''
+    Collect everything the export of the active armature's animation
+    needs from the scene. The returned ANIM dict is self contained
+    (it holds no references to Blender data), so encodeAnimation can
+    run while the scene is already changed again.
+    '''
 
     logging.debug("="*50)
     logging.debug(_("Export for %s animation"), mode)
@@ -828,40 +1063,135 @@ def exportAnimation(action, filepath, mode):
     ANIM['LOCS'] = LOCS
     ANIM['BONE0'] = BONE0
 
-    FRAMED = collectVisualTransforms(obj, context, ROTS, LOCS)
-
+    ANIM['mode'] = mode
+    ANIM['FRAMED'] = collectVisualTransforms(obj, context, ROTS, LOCS)
+    ANIM['BONES'], ANIM['CBONES'] = collectBoneInfo(obj, context, ROTS, LOCS)
+    ANIM['armature_name'] = arm.name
     if mode == 'anim':
+        ANIM['fixed_frames'] = get_fixed_frames(arm, ANIM['FRAMED'])
+        ANIM['export_names'] = get_anim_export_names(arm, ANIM['BONES'])
+    else:
+        ANIM['BVH_HIERARCHY'] = get_bvh_hierarchy(arm, LOCS)
+
+    return ANIM
+
+def get_anim_export_names(arm, BONES):
+    '''
+    Return the name of the rig bone which carries the animation
+    of each bone in BONES ('mName' when the rig has a deform bone
+    for the bone Name)
+    '''
+
+    dbones = arm.data.bones
+    return {bname: 'm'+bname if 'm'+bname in dbones else bname for bname in BONES}
 
-        log.info("Simplify animation for armature %s..." % (arm.name))
-        FRAMED = simplifyCollectedTransforms(arm, FRAMED, ROTS, LOCS)
+def get_bvh_hierarchy(arm, LOCS):
+    '''
+    Return the text of the BVH joint hierarchy of arm
+    and the names of the exported bones in hierarchy order
+    '''
+
+    buff = io.StringIO()
+    hierarchy = ['mPelvis'] 
+    for child in arm.data.bones['mPelvis'].children:
+        if get_bvh_name(child):
+            hierarchy.extend(bvh_hierarchy_recursive(buff, child, LOCS, 1))
+    return buff.getvalue(), hierarchy
+
+def encodeAnimation(filepath, ANIM):
+    '''
+    Simplify and write the animation sampled by sampleAnimation.
+    Only uses the plain data in ANIM, hence it can run in a worker thread.
+    Returns the number of sampled frames and of written frames.
+    '''
+
+    FRAMED = ANIM['FRAMED']
+    sampled = len(FRAMED)
+
+    if ANIM['mode'] == 'anim':
+
+        log.info("Simplify animation for armature %s..." % (ANIM['armature_name']))
+        FRAMED = simplifyCollectedTransforms(None, FRAMED, ANIM['ROTS'], ANIM['LOCS'], fixed_frames=ANIM['fixed_frames'])
         ANIM['FRAMED'] = FRAMED
-        ANIM['BONES'], ANIM['CBONES'] = collectBoneInfo(obj, context, ROTS, LOCS) 
         log.info("Export to ANIM")
-        exportAnim(arm, filepath, ANIM)
+        exportAnim(filepath, ANIM)
 
     else:
 
-        ANIM['FRAMED'] = FRAMED
-        ANIM['BONES'], ANIM['CBONES'] = collectBoneInfo(obj, context, ROTS, LOCS)         
         log.info("Export to BVH")
-        exportBVH(arm, filepath, ANIM)
+        exportBVH(filepath, ANIM)
 
-def collectBones(obj, context, with_translation):
+    return sampled, len(FRAMED)
 
-    def get_regular_children_of(dbone):
-        limbset = []
-        while len(dbone.children) > 0:
-            childset = [b for b in dbone.children if b.name[0] != 'a' and not b.name.startswith('ik')]
-            if len(childset) == 1:
-                dbone = childset[0]
-                limbset.append(dbone.name)
-        return limbset
-
-    def get_bone_names_of_limb(ikbone):
-        limbset = get_limb_from_ikbone(ikbone)
-        if not limbset:
-            return None
-        return [key for key in limbset if not key.startswith('ik')]
+class AnimationExportPipeline:
+    '''
+    Bulk export of animations. The caller samples the actions one by one
+    in the main thread (see submit) while a pool of worker threads
+    simplifies, quantizes and writes the sampled data.
+    Use as context manager; on exit all pending exports are finished.
+    '''
+
+    def __init__(self, workers=ANIM_EXPORT_WORKERS):
+        self.workers = workers
+        self.pool = None
+        self.pending = []
+        self.results = []
+
+    def __enter__(self):
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            while self.pending:
+                self.collect()
+        finally:
+            self.pool.shutdown(wait=True)
+        return False
+
+    def submit(self, action, filepath, mode):
+        '''
+        Sample action (must be the active action of the active armature)
+        and queue it for encoding. Blocks when too many sampled
+        animations are waiting, to keep the memory use bounded.
+        '''
+
+        while len(self.pending) >= 2*self.workers:
+            self.collect()
+
+        t0 = time.time()
+        ANIM = sampleAnimation(action, filepath, mode)
+        sample_time = time.time() - t0
+
+        future = self.pool.submit(self.encode, filepath, ANIM)
+        self.pending.append((action.name, filepath, sample_time, future))
+
+    @staticmethod
+    def encode(filepath, ANIM):
+        t0 = time.time()
+        sampled, written = encodeAnimation(filepath, ANIM)
+        return sampled, written, time.time() - t0
+
+    def collect(self):
+        name, filepath, sample_time, future = self.pending.pop(0)
+        sampled, written, encode_time = future.result()
+        self.results.append({'action':name, 'filepath':filepath,
+                             'sample_time':sample_time, 'encode_time':encode_time,
+                             'sampled':sampled, 'written':written})
+
+    def report(self):
+        '''
+        Return one report line per exported action
+        '''
+
+        lines = []
+        for r in self.results:
+            reduction = (1 - r['written']/r['sampled'])*100 if r['sampled'] else 0
+            lines.append("%s: sampled %.2f sec, encoded %.2f sec, frames %d -> %d (%.1f%% reduction)" %
+                        (r['action'], r['sample_time'], r['encode_time'], r['sampled'], r['written'], reduction))
+        return lines
+
+def collectBones(obj, context, with_translation):
 
     def add_bone_data(ROTS, LOCS, BONE0, obj, bonenames, use_bind_pose):
         for bonename in bonenames:
@@ -916,6 +1246,7 @@ def collectBones(obj, context, with_translation):
     BONE0 = {} # this will hold scale0 rot0 etc
 
     logging.debug(_("Collecting bones..."))
+    index = get_bone_index(util.get_armature(obj))
 
     solo = False
     if obj.animation_data.use_nla and len(nla_tracks)>0:
@@ -940,7 +1271,7 @@ def collectBones(obj, context, with_translation):
                     continue
 
                 if strip.action is not None:
-                    R, L = collectActionBones(obj, strip.action, with_translation)
+                    R, L = collectActionBones(obj, strip.action, with_translation, index=index)
                     ROTS = ROTS.union(R)
                     LOCS = LOCS.union(L)
 
@@ -948,7 +1279,7 @@ def collectBones(obj, context, with_translation):
 
     if action is not None and not solo: 
         logging.debug(_("    grabbing animated bones from Action '%s'"), action.name)
-        R, L = collectActionBones(obj, action, with_translation)
+        R, L = collectActionBones(obj, action, with_translation, index=index)
         ROTS = ROTS.union(R)
         LOCS = LOCS.union(L)
 
@@ -964,180 +1295,155 @@ def collectBones(obj, context, with_translation):
 
             if bonename in ALL_IK_BONES:
                 log.debug("Find limb affected by %s" % (bonename) )
-                limb_names = get_bone_names_of_limb(bonename)
+                limb_names = index.limb(bonename)
                 if limb_names and len(limb_names) > 0:
                     log.info("Add    Limb: %s (for IK %s)" % (limb_names, bonename))
                     add_bone_data(ROTS, LOCS, BONE0, obj, limb_names, use_bind_pose)
 
             if bonename[0:5] == "mHand":
 
-                limb_names = get_regular_children_of(dbone)
+                limb_names = index.regular_children(bonename)
                 if limb_names and len(limb_names) > 0:
                     log.info("Add fingers: %s ( for root: %s)" % (limb_names, bonename))
                     add_bone_data(ROTS, LOCS, BONE0, obj, limb_names, use_bind_pose)
 
     return ROTS, LOCS, BONE0
 
-def collectActionBones(obj, action, with_translation):
+def collectActionBones(obj, action, with_translation, index=None):
 
     ROTS = set()
     LOCS = set()
 
-    arm = util.get_armature(obj)
+    if index is None:
+        index = get_bone_index(util.get_armature(obj))
     props = action.AnimProps
-    dependencies = init_dependencies(arm)
     ignored_bones = set()
 
     for fc in action.fcurves:
 
         if fc.mute:
-
-            logging.debug(_("    skipping muted channel: %s"), fc.data_path)
             continue
 
-        mo = re.search('"([\w\. ]+)".+\.(rotation|location|scale)', fc.data_path)
-        if mo is None:
-
+        entry = index.channel(fc.data_path)
+        if entry is None:
             continue
 
-        bonename = mo.group(1)
-        keytype = mo.group(2)
-        
-        if bonename in ['Origin']:
-            continue
-        elif bonename in ['COG', 'PelvisInv']:
-
-            bonename = 'Pelvis'
-        elif bonename == 'EyeTarget' and keytype=='location':
-
-            ROTS.add("mEyeLeft")
-            ROTS.add("mEyeRight")
-            log.debug("2: Add ROT for mEyeLeft/Righ")
-            continue
-        elif bonename == 'FaceEyeAltTarget' and keytype=='location':
+        rots, loc, slaves, ignored = entry
+        if ignored:
+            ignored_bones.add(ignored)
+        elif loc and ( props.Translations or loc == 'mPelvis'):
 
-            ROTS.add("mFaceEyeAltLeft")
-            ROTS.add("mFaceEyeAltRight")
-            log.debug("2: Add ROT for mFaceEyeAltLeft/Righ")
-            continue
-
-        if "m"+bonename in obj.data.bones:
-
-            bonename = "m"+bonename
-        elif not bonename in obj.data.bones:
-            ignored_bones.add(bonename)
-            continue
-
-        if keytype=='rotation':
-            ROTS.add(bonename)
-            log.debug("3: Add ROT for %s" % bonename)
-        elif keytype=='location' and ( props.Translations or bonename == 'mPelvis'):
-
-            LOCS.add(bonename)
-            log.debug("3: Add LOC for %s" % bonename)
+            LOCS.add(loc)
         else:
-            slaves = get_slaves(dependencies, bonename)
-            if slaves:
-                for slave in slaves.keys():
-                    bn = "m" + slave if "m"+slave in obj.data.bones else slave
-
-                    if bn[0] == 'm':
-                        ROTS.add(bn)
-                        log.debug("4: Add ROT for %s" % bn)
+            ROTS.update(rots)
+            ROTS.update(slaves)
 
     if len(ignored_bones) > 0:
         log.warning("%d Bones refered in fcurves but missing in rig:" % (len(ignored_bones)))
         for name in ignored_bones:
             log.warning("- %s" % name)
 
-    log.warning("Collected %d ROTS, %d LOCS" % (len(ROTS), len(LOCS)) )
+    log.debug("Collected %d ROTS, %d LOCS" % (len(ROTS), len(LOCS)) )
     return ROTS, LOCS
 
 def collectVisualTransforms(obj, context, ROTS, LOCS):
 
-    ALL = {}
-
-    BONES = set().union(ROTS).union(LOCS)
-   
     scn   = context.scene
     arm   = util.get_armature(obj)
-    props = get_props_from_arm(arm)
 
     frame_start = scn.frame_start
     frame_end = scn.frame_end
     logging.debug(_("Collecting visual transformations from frames %d-%d ..."), frame_start, frame_end)
 
-    frame_original = scn.frame_current
+    bones  = sorted(set().union(ROTS).union(LOCS))
+    pbones = arm.pose.bones
+    dbones = arm.data.bones
+    frames = np.arange(frame_start, frame_end+1)
 
-    for frame in range(frame_start, frame_end+1):
+    #
+    # Sample the pose matrices of the bones and their parents into
+    # one array. The last slot stays the identity for bones without parent
+    #
+    sampled = []
+    slots   = {}
+    for name in bones:
+        pbone = pbones[name]
+        for pb in (pbone, pbone.parent):
+            if pb and pb.name not in slots:
+                slots[pb.name] = len(sampled)
+                sampled.append(pb)
 
-        ALL[frame] = {}
+    bone_slots   = [slots[name] for name in bones]
+    parent_slots = [slots[pbones[name].parent.name] if pbones[name].parent else len(sampled) for name in bones]
 
-        bpy.context.scene.frame_set(frame)
+    P = np.empty((len(sampled)+1, len(frames), 4, 4), dtype=np.float32)
+    P[-1] = np.identity(4)
 
-        for bonename in BONES:
-            pbone = arm.pose.bones[bonename]
-            dbone = arm.data.bones[bonename]
-
-            matrix = visualmatrix(context, arm, dbone, pbone)
-            ALL[frame][bonename] = matrix
+    frame_original = scn.frame_current
+    for j, frame in enumerate(frames.tolist()):
+        bpy.context.scene.frame_set(frame)
+        for i, pbone in enumerate(sampled):
+            P[i,j] = pbone.matrix
 
     context.scene.frame_set(frame_original)
 
-    return ALL
+    use_bind_pose = util.use_sliders(context) and arm.RigProps.rig_use_bind_pose
+    matrices = np.empty((len(bones), len(frames), 4, 4))
+    for i, name in enumerate(bones):
+        A, CI = visualmatrix_constants(use_bind_pose, dbones[name])
+        PPI = np.linalg.inv(P[parent_slots[i]].astype(np.float64))
+        matrices[i] = A @ PPI @ P[bone_slots[i]] @ CI
 
-def simplifyCollectedTransforms(arm, ALL, ROTS, LOCS, tol=0.02):
+    return VisualTransforms(frames, bones, matrices)
 
-    logging.debug(_("Simplifying bone curves (Lowes global method, tol=%f) ..."), tol)
+def get_fixed_frames(arm, ALL):
+    '''
+    Return the frames of ALL which must survive the simplification
+    (loop points and frames marked with a 'fix' timeline marker)
+    '''
 
-    curve = []
+    props = get_props_from_arm(arm)
+    allframes = set(ALL.frames.tolist())
+    fixed = set()
 
-    frames = list(ALL.keys())
-    frames.sort()
+    if props.Loop:
+        if props.Loop_In in allframes:
+            fixed.add(props.Loop_In)
+        if props.Loop_Out in allframes:
+            fixed.add(props.Loop_Out)
 
-    for frame in frames:
-        point = [frame]
+    for marker in bpy.context.scene.timeline_markers:
+        if marker.name == 'fix' and marker.frame in allframes:
+            logging.debug("Keeping fixed frame %d", marker.frame)
+            fixed.add(marker.frame)
 
-        for bone in ROTS:
-            matrix = ALL[frame][bone]
-            q = matrix.to_quaternion()
-            point.extend(list(q))
+    return fixed
 
-        for bone in LOCS:
-            matrix = ALL[frame][bone]
+def simplifyCollectedTransforms(arm, ALL, ROTS, LOCS, tol=0.02, per_channel=False, fixed_frames=None):
 
-            l = 2*matrix.to_translation()
-            point.extend(list(l))
+    logging.debug(_("Simplifying bone curves (Lowes global method, tol=%f) ..."), tol)
 
-        curve.append(point)
+    channels = [ALL.frames[:,np.newaxis]]
+    for bone in ROTS:
+        channels.append(matrices_to_quaternions(ALL.get(bone)))
 
-    sframes = simplifyLowes(curve, 0, len(curve)-1, set(), tol=tol)
+    for bone in LOCS:
+        channels.append(2*ALL.get(bone)[:,:3,3])
 
-    props = get_props_from_arm(arm)
-    allframes = ALL.keys()
+    curve = np.hstack(channels)
 
-    if props.Loop:
-        if props.Loop_In in allframes:
-            sframes.add(props.Loop_In)
-        if props.Loop_Out in allframes:
-            sframes.add(props.Loop_Out)
+    sframes = simplifyCurve(curve, tol=tol, per_channel=per_channel)
 
-    for marker in bpy.context.scene.timeline_markers:
-        if marker.name == 'fix' and marker.frame in allframes:
-            logging.debug("Keeping fixed frame %d", marker.frame)
-            sframes.add(marker.frame) 
+    if fixed_frames is None:
+        fixed_frames = get_fixed_frames(arm, ALL)
+    sframes.update(fixed_frames)
 
     Ni=len(curve)
     Nf=len(sframes)
 
     logging.debug(_("    keyframe simplification: %d -> %d (%.1f%% reduction)")%(Ni, Nf, round((1-Nf/Ni)*100) ) )
 
-    SIMP = {}
-
-    for frame in sframes:
-        SIMP[frame] = ALL[frame]
-
-    return SIMP
+    return ALL.subset(sframes)
 
 def collectBoneInfo(armobj, context, ROTS, LOCS):
 
@@ -1206,24 +1512,21 @@ def collectBoneInfo(armobj, context, ROTS, LOCS):
 
     return BONES, CBONES
 
-def exportAnim(armobj, animationfile, ANIM):
+def exportAnim(animationfile, ANIM):
 
-    def get_export_bone_set(armobj, ANIM):
+    def get_export_bone_set(ANIM):
         export_bones = {}
         for B in ANIM["BONES"].values():
             bname = B["name"]
-            export_name = 'm'+bname if 'm'+bname in armobj.data.bones else bname
+            export_name = ANIM['export_names'][bname]
 
             if export_name in export_bones.keys():
                 log.warning("%s already exported using data from %s" % (bname, export_name))
                 continue
 
-            BDATA = {}
-            for f in ANIM["FRAMED"]:
-                if bname in ANIM["FRAMED"][f]:
-                    BDATA[f] = ANIM["FRAMED"][f][bname]
+            BDATA = ANIM["FRAMED"].get(bname)
 
-            if len(BDATA) == 0:
+            if BDATA is None or len(BDATA) == 0:
                 log.warning("%s has no animation data" % (bname))
                 continue
 
@@ -1243,7 +1546,7 @@ def exportAnim(armobj, animationfile, ANIM):
     loop_in_point = (ANIM["loop_in_frame"]-ANIM["frame_start"])/float(ANIM["fps"])
     loop_out_point = (ANIM["loop_out_frame"]-ANIM["frame_start"])/float(ANIM["fps"])
 
-    export_bones = get_export_bone_set(armobj, ANIM)
+    export_bones = get_export_bone_set(ANIM)
     other_bones = ANIM["CBONES"].keys()
     
     data = pack("ffiffii",
@@ -1275,12 +1578,16 @@ def exportAnim(armobj, animationfile, ANIM):
     log.info("| fps           %4d" % ANIM["fps"] )
     log.info("+-----------------------------------------------------------------")
 
+    frames = ANIM["FRAMED"].frames
+    times  = F32_to_U16_array((frames-ANIM["frame_start"])/float(ANIM["fps"]), 0, duration)
+    ts     = ANIM['armature_scale'] if ANIM.get('apply_scale', False) else (1,1,1)
+
     for ename, bdata in export_bones.items():
         B = bdata[0]
         BDATA = bdata[1]
         bname = B["name"]
-        frames = list(BDATA.keys())
-        frames.sort()
+        keys  = np.empty((len(frames), 4), dtype=np.uint16)
+        keys[:,0] = times
 
         data = pack("%dsB"%len(ename), bytes(ename,'utf8') , 0)
         buff.write(data)
@@ -1298,39 +1605,22 @@ def exportAnim(armobj, animationfile, ANIM):
             has_data = True
             log.debug("Export ROT data of Bone %s" % (ename) )
 
-            data = pack("i", len(BDATA))
-            buff.write(data)
-
-            for f in frames:
+            #
 
-                #
-                
-                matrix = BDATA[f].copy()
+            try:
+                r0 = ANIM['BONE0'][bname]['rot0']
+                rot0 = (r0[0], r0[1], r0[2])
+                euler = Euler(rot0,'ZYX')
+            except:
+                log.warning("%s.rot0 seems broken. use (0,0,0)" % (bname) )
+                euler = Euler((0,0,0),'ZYX')
 
-                t = (f-ANIM["frame_start"])/float(ANIM["fps"])
-                time = F32_to_U16(float(t), 0, duration)
-                data = pack("H",time)
-                buff.write(data)
+            R = np.array(euler.to_matrix().to_4x4()) # this is RxRyRz
+            q = matrices_to_quaternions(np.array(Rz90I) @ BDATA @ (R @ np.array(Rz90)))
+            keys[:,1:] = F32_to_U16_array(q[:,1:], -1, 1)
 
-                euler = None
-                try:
-                    r0 = ANIM['BONE0'][bname]['rot0']
-                    rot0 = (r0[0], r0[1], r0[2])
-                    euler = Euler(rot0,'ZYX')
-                except:
-                    log.warning("%s.rot0 seems broken. use (0,0,0)" % (bname) )
-                    euler = Euler((0,0,0),'ZYX')
-
-                M3    = euler.to_matrix()
-                R     = M3.to_4x4() # this is RxRyRz
-                q     = ( Rz90I*matrix*R*Rz90 ).to_quaternion().normalized()
-
-                x = F32_to_U16(q.x, -1, 1)
-                y = F32_to_U16(q.y, -1, 1)
-                z = F32_to_U16(q.z, -1, 1)
-                data = pack("HHH", x, y, z)
-
-                buff.write(data)
+            buff.write(pack("i", len(BDATA)))
+            buff.write(keys.tobytes())
 
         else:
 
@@ -1341,51 +1631,33 @@ def exportAnim(armobj, animationfile, ANIM):
             has_data = True
             log.debug("Export LOC data of Bone %s" % (ename) )
 
-            data = pack("i", len(BDATA))
-            buff.write(data)
+            abone  = ANIM['BONE0'][bname]
+            try:
+                rot0   = abone['rot0'] if 'rot0' in abone else Vector((0,0,0))
+                psx0, psy0, psz0 = abone['pscale0'] if 'pscale0' in abone else Vector((1,1,1))
+                psx,  psy,  psz  = abone['pscale']  if 'pscale' in abone else Vector((1,1,1))
+                L0     = Vector(abone['relhead']) if 'relhead' in abone else Vector((0,0,0))
+                offset = Vector(abone['offset'])  if 'offset' in abone else Vector((0,0,0))
+            except:
+                log.warning("Data corruption in bone [%s]" % (L0) )
+                raise
 
-            for f in frames:
-                matrix = BDATA[f].copy()
+            R = Euler(rot0,'ZYX').to_matrix().to_4x4() # this is RxRyRz
+            S = Matrix()
+            S[0][0] = ts[0]/(psx0+psx)
+            S[1][1] = ts[1]/(psy0+psy)
+            S[2][2] = ts[2]/(psz0+psz)
 
-                t = (f-ANIM["frame_start"])/float(ANIM["fps"])
-                time = F32_to_U16(float(t), 0, duration)
-                data = pack("H",time)
-                buff.write(data)
+            K = np.array(Rz90I*S*R)
+            L = BDATA[:,:3,3] + np.array(offset)
+            L = L @ K[:3,:3].T + K[:3,3]
 
-                abone  = ANIM['BONE0'][bname]
-                try:
-                    rot0   = abone['rot0'] if 'rot0' in abone else Vector((0,0,0))
-                    psx0, psy0, psz0 = abone['pscale0'] if 'pscale0' in abone else Vector((1,1,1))
-                    psx,  psy,  psz  = abone['pscale']  if 'pscale' in abone else Vector((1,1,1))
-                    L0     = Vector(abone['relhead']) if 'relhead' in abone else Vector((0,0,0))
-                    offset = Vector(abone['offset'])  if 'offset' in abone else Vector((0,0,0))
-                except:
-                    log.warning("Data corruption in bone [%s]" % (L0) )
-                    raise
+            #
 
-                R = Euler(rot0,'ZYX').to_matrix().to_4x4() # this is RxRyRz
-                S = Matrix()
-                if ANIM.get('apply_scale', False):
-                    ts = ANIM['armature_scale'] 
-                else:
-                    ts = (1,1,1)
-                S[0][0] = ts[0]/(psx0+psx)
-                S[1][1] = ts[1]/(psy0+psy)
-                S[2][2] = ts[2]/(psz0+psz)
-
-                L = matrix.to_translation()
-
-                L = Rz90.inverted()*S*R*(L+offset)   
-
-                #
-
-                x = F32_to_U16(L.x/LL_MAX_PELVIS_OFFSET, -1, 1)
-                y = F32_to_U16(L.y/LL_MAX_PELVIS_OFFSET, -1, 1)
-                z = F32_to_U16(L.z/LL_MAX_PELVIS_OFFSET, -1, 1)
+            keys[:,1:] = F32_to_U16_array(L/LL_MAX_PELVIS_OFFSET, -1, 1)
 
-                data = pack("HHH",x, y, z)
-
-                buff.write(data)
+            buff.write(pack("i", len(BDATA)))
+            buff.write(keys.tobytes())
 
         else:
 
@@ -1420,8 +1692,8 @@ def get_bvh_name(bone):
     else:
         return None
 
-def exportBVH(armobj, animationfile, ANIM):
-    dbones = armobj.data.bones
+def exportBVH(animationfile, ANIM):
+    joints, hierarchy = ANIM['BVH_HIERARCHY']
 
     buff = open(animationfile, "w")
 
@@ -1429,12 +1701,7 @@ def exportBVH(armobj, animationfile, ANIM):
     buff.write("ROOT hip\n{\n")
     buff.write("\tOFFSET 0.00 0.00 0.00\n")
     buff.write("\t" + ALL_CHANNELS + "\n")
-  
-    hierarchy = ['mPelvis'] 
-    for child in dbones['mPelvis'].children:
-        if get_bvh_name(child):
-            hierarchy.extend(bvh_hierarchy_recursive(buff, child, ANIM['LOCS'], 1))
-
+    buff.write(joints)
     buff.write("}\n")
 
     ref = ANIM["reference_frame"]
@@ -1457,7 +1724,7 @@ def exportBVH(armobj, animationfile, ANIM):
 
     if ref:
         logging.debug(_("Prepending reference frame"))
-        FBONES = FRAMED[ANIM['frame_start']]
+        FBONES = FRAMED.frame_transforms(ANIM['frame_start'])
         
         rotinfo=""
         for export_name in hierarchy:
@@ -1491,11 +1758,9 @@ def exportBVH(armobj, animationfile, ANIM):
             summary[export_name].append("\tref: %.3f %.3f %.3f"%(rot[0],rot[1],rot[2]))
         buff.write("\n")
     
-    frames = list(FRAMED.keys())
-    frames.sort()
-    for frame in frames:
+    for frame in FRAMED.frames.tolist():
 
-        FBONES = FRAMED[frame]
+        FBONES = FRAMED.frame_transforms(frame)
 
         rotinfo=""
         for export_name in hierarchy:
@@ -1781,7 +2046,7 @@ def transferMotion(source, target, translation, reference_frame, start_frame, en
                 point.extend(bone.frames[frame][1])
                 curve.append(point)
 
-            bone.sframes = simplifyLowes(curve, 0, len(curve)-1, set(),tol=prop.lowesLocalTol)
+            bone.sframes = simplifyCurve(curve, tol=prop.lowesLocalTol, per_channel=prop.lowesPerChannel)
 
             Ni+=len(curve)
             Nf+=len(bone.sframes)
@@ -1810,7 +2075,7 @@ def transferMotion(source, target, translation, reference_frame, start_frame, en
                     pass
             curve.append(point)
 
-        sframes = simplifyLowes(curve, 0, len(curve)-1, set(),tol=prop.lowesGlobalTol)
+        sframes = simplifyCurve(curve, tol=prop.lowesGlobalTol, per_channel=prop.lowesPerChannel)
         Ni+=len(curve)
         Nf+=len(sframes)
         for bone in translation:
@@ -1829,36 +2094,153 @@ def transferMotion(source, target, translation, reference_frame, start_frame, en
     util.progress_update(progress)
 
     log.warning("transferMotion: writing target rotations in range [%d - %d]" % (start_frame, end_frame) )
+    keys = solveBoneSpaceKeys(target, translation, start_frame, end_frame, reference_frame)
+
+    action = get_or_create_action(target)
+    fcurves = {(fc.data_path, fc.array_index):fc for fc in action.fcurves}
+    for bone in translation:
+        frames, quaternions, locations = keys[bone.target]
+        if len(frames) == 0:
+            continue
+
+        progress += len(frames)
+        util.progress_update(progress)
+
+        if locations is not None:
+            data_path = 'pose.bones["%s"].location' % bone.target
+            for index in range(3):
+                writeFCurveKeys(action, fcurves, data_path, index, bone.target, frames, locations[:,index])
+
+        data_path = 'pose.bones["%s"].rotation_quaternion' % bone.target
+        for index in range(4):
+            writeFCurveKeys(action, fcurves, data_path, index, bone.target, frames, quaternions[:,index])
+
+    bpy.context.scene.frame_set(start_frame)
+        
+    util.progress_end()
+
+def get_or_create_action(armobj):
+    if armobj.animation_data is None:
+        armobj.animation_data_create()
+    if armobj.animation_data.action is None:
+        armobj.animation_data.action = bpy.data.actions.new("%sAction" % armobj.name)
+    return armobj.animation_data.action
+
+def solveBoneSpaceKeys(target, translation, start_frame, end_frame, reference_frame):
+    '''
+    Convert the armature space transforms collected by transferMotion
+    into bone space keys, exactly as assigning the pose bone matrices
+    would do, but without a scene update per key.
+
+    Returns a dict {bone name: (frames, quaternions, locations)}.
+    The locations are None for bones which only get rotation keys.
+    '''
+
+    pbones = target.pose.bones
+    solved = {bone.target:bone for bone in translation}
+
+    rest = {}
+    basis = {}
+    posed = {}
+    def rest_rotation(name):
+        R = rest.get(name)
+        if R is None:
+            R = rest[name] = pbones[name].bone.matrix_local.to_3x3()
+        return R
+
+    def relative_rest(pbone):
+        dbone = pbone.bone
+        if dbone.parent and dbone.use_inherit_rotation:
+            return pose_rotation(dbone.parent.name) * rest_rotation(dbone.parent.name).inverted() * rest_rotation(pbone.name)
+        return rest_rotation(pbone.name)
+
+    def pose_rotation(name):
+        R = posed.get(name)
+        if R is None:
+            bone = solved.get(name)
+            if bone is not None:
+                R = bone.frames[frame][1].to_matrix()
+            else:
+                B = basis.get(name)
+                if B is None:
+                    B = basis[name] = pbones[name].matrix_basis.to_3x3()
+                R = relative_rest(pbones[name]) * B
+            posed[name] = R
+        return R
+
+    keys = {}
+    for bone in translation:
+        keys[bone.target] = ([], [], [] if bone.target=="COG" else None)
+
     for frame in range(start_frame, end_frame+1):
 
         if frame == reference_frame:
 
             continue
-        
-        progress += 1
-        util.progress_update(progress)
+
+        posed.clear()
         for bone in translation:
-            
             if frame not in bone.sframes:
                 continue
 
-            b2 = target.pose.bones[bone.target]
-            
-            loc, rot = bone.frames[frame] 
-            
-            if bone.target=="COG":
+            pbone = pbones[bone.target]
+            loc, rot = bone.frames[frame]
+            M = relative_rest(pbone)
+            frames, quaternions, locations = keys[bone.target]
+
+            frames.append(frame)
+            quaternions.append((M.inverted() * rot.to_matrix()).to_quaternion())
+
+            if locations is not None:
+                dbone = pbone.bone
+                M = dbone.matrix_local
+                if dbone.parent:
+                    P = pose_rotation(dbone.parent.name).to_4x4()
+                    P.translation = pbones[dbone.parent.name].matrix.to_translation()
+                    M = P * dbone.parent.matrix_local.inverted() * M
+                locations.append(M.inverted() * loc)
+
+    for name, (frames, quaternions, locations) in keys.items():
+        keys[name] = (
+            np.array(frames, dtype=np.float64),
+            np.array(quaternions, dtype=np.float64).reshape(-1,4),
+            None if locations is None else np.array(locations, dtype=np.float64).reshape(-1,3)
+        )
 
-                b2.matrix = Matrix.Translation(loc)
-                b2.keyframe_insert(data_path="location", index=-1, frame=frame)
+    return keys
 
-            b2.matrix = rot.to_matrix().to_4x4()
-            b2.keyframe_insert(data_path="rotation_quaternion", index=-1, frame=frame)
+def writeFCurveKeys(action, fcurves, data_path, index, group, frames, values):
+    '''
+    Write the keys (frames, values) into an F-curve of action in one go.
+    Existing keys on the same frames are replaced, like keyframe_insert does.
+    '''
 
-            bpy.context.scene.update()
-            
-    bpy.context.scene.frame_set(start_frame)
-        
-    util.progress_end()
+    fcurve = fcurves.get((data_path, index))
+    if fcurve is None:
+        fcurve = fcurves[(data_path, index)] = action.fcurves.new(data_path, index, group)
+
+    points = fcurve.keyframe_points
+    count = len(points)
+    old = {}
+    for attr in ("co", "handle_left", "handle_right"):
+        old[attr] = np.empty(2*count, dtype=np.float32)
+        points.foreach_get(attr, old[attr])
+        old[attr] = old[attr].reshape(-1,2)
+
+    slot = {f:i for i,f in enumerate(old["co"][:,0].tolist())}
+    replace = np.array([f in slot for f in frames.tolist()], dtype=bool)
+    for f, v in zip(frames[replace].tolist(), values[replace].tolist()):
+        old["co"][slot[f],1] = v
+
+    added = np.empty((np.count_nonzero(~replace), 2), dtype=np.float32)
+    added[:,0] = frames[~replace]
+    added[:,1] = values[~replace]
+
+    points.add(len(added))
+    points.foreach_set("co", np.vstack([old["co"], added]).reshape(-1))
+    points.foreach_set("handle_left", np.vstack([old["handle_left"], added]).reshape(-1))
+    points.foreach_set("handle_right", np.vstack([old["handle_right"], added]).reshape(-1))
+    fcurve.update()
 
 class BoneTarget:
     
@@ -1867,38 +2249,52 @@ class BoneTarget:
         for key,value in keys.items():
             setattr(self,key,value) 
 
-def simplifyLowes(curve, i,f, simplified, tol=.1):
+def simplifyCurve(curve, tol=.1, per_channel=False):
+    '''
+    Douglas-Peucker simplification of a sampled curve.
+    curve is a sequence of points [frame, v1, v2, ...], sorted by frame.
+    Returns the set of frames which must be kept.
+
+    per_channel=False: a point is dropped when its Euclidean distance
+                       to the line between the surrounding kept points
+                       is at most tol.
+    per_channel=True : a point is dropped when none of its channels
+                       differs by more than tol from the linear
+                       interpolation between the surrounding kept points.
+    '''
 
-    #
+    C = np.asarray(curve, dtype=np.float64)
+    if C.ndim != 2 or len(C) == 0:
+        return set()
 
-    pl1 = curve[i]
-    pl2 = curve[f]
-    
-    simplified.add(pl1[0])
-    simplified.add(pl2[0])
-    
-    maxd = 0
-    maxi = 0
-
-    for ii in range(i+1,f):
-        p = curve[ii]
-        d = distanceToLine(p,pl1,pl2)
-        if d > maxd:
-            maxd = d
-            maxi = ii
-            
-    if maxd > tol:
-        
-        if maxi==f-1:
-            simplified.add(curve[maxi][0])
-        else:
-            simplified = simplifyLowes(curve, maxi, f, simplified, tol=tol)
+    n = len(C)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
 
-        if maxi==i+1:
-            simplified.add(curve[maxi][0])
-        else:
-            simplified = simplifyLowes(curve, i, maxi, simplified, tol=tol)
+    measure = channelErrors if per_channel else distancesToLine
+    stack = [(0, n-1)]
+    while stack:
+        i, f = stack.pop()
+        if f - i < 2:
+            continue
+
+        d = measure(C[i+1:f], C[i], C[f])
+        k = int(np.argmax(d))
+        if d[k] > tol:
+            maxi = i + 1 + k
+            keep[maxi] = True
+            stack.append((i, maxi))
+            stack.append((maxi, f))
+
+    return {curve[k][0] for k in np.flatnonzero(keep).tolist()}
+
+def simplifyLowes(curve, i,f, simplified, tol=.1):
+    '''
+    Add the frames of curve[i:f+1] which are kept by simplifyCurve
+    to simplified
+    '''
 
+    simplified.update(simplifyCurve(curve[i:f+1], tol=tol))
     return simplified
 
 def makeSeamless(bone, loc_frames, rot_frames):
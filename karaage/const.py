@@ -47,6 +47,7 @@ MIN_PRIORITY = -1
 NULL_BONE_PRIORITY = -2
 
 LL_MAX_PELVIS_OFFSET = 5.0
+ANIM_EXPORT_WORKERS = 4 # encoder threads of the bulk animation export
 
 BLtoBVH = Matrix.Rotation(-pi/2, 4, 'X')
 
@@ -81,6 +82,7 @@ CONFIG_DIR     = os.path.join(os.path.dirname(__file__), 'config')
 ICONS_DIR      = os.path.join(os.path.dirname(__file__), 'icons')
 
 USER_PRESETS   = os.path.join(bpy.utils.user_resource('SCRIPTS'), 'presets/karaage')
+CACHE_DIR      = os.path.join(bpy.utils.user_resource('DATAFILES'), 'karaage', 'cache')
 RIG_PRESET_DIR = os.path.join(USER_PRESETS, "rigs")
 DATAFILESDIR   = os.path.join(os.path.dirname(os.path.abspath(__file__)),'lib')
 ASSETS         = os.path.join(DATAFILESDIR,'assets.blend')
@@ -946,6 +948,8 @@ def get_export_bonename(groups, group, target_system):
     
 
 MAX_EXPORT_BONES = 110
+COLLADA_CHUNK_SIZE = 65536 # values per formatted chunk in streamed Collada arrays
+COLLADA_EXPORT_WORKERS = 4 # encoder processes of the Collada export
 
 UI_SIMPLE   = 0
 UI_STANDARD = 1
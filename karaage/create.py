@@ -36,6 +36,7 @@ import os, logging, gettext
 from math import pi, sin, cos, radians
 
 import bpy
+import numpy as np
 from bpy.props import *
 from mathutils import Vector, Matrix
 from . import const, rig, data, shape, weights, util, bl_info
@@ -740,10 +741,11 @@ def createCustomShapes():
 
 def createMesh(context, name, llm_mesh):
 
-    verts = [llm_mesh['baseCoords'][i] for i in llm_mesh['vertLookup']]
-    faces = llm_mesh['faces'] # a list of face 3-tuples
-    vt = llm_mesh['texCoords'] # vertex (x,y) coords
-    normals = llm_mesh['baseNormals']
+    vert_lookup = llm_mesh['vertLookup']
+    verts   = llm_mesh['baseCoords'][vert_lookup]
+    normals = llm_mesh['baseNormals'][vert_lookup]
+    faces   = llm_mesh['faces'] # a (n,3) array of face vertex indices
+    vt      = llm_mesh['texCoords'] # vertex (x,y) coords
     if "noseams" in llm_mesh:
         noseams    = llm_mesh['noseams']
         extraseams = llm_mesh['extraseams']
@@ -753,10 +755,7 @@ def createMesh(context, name, llm_mesh):
         extraseams = []
         extrapins  = []
 
-    meshFaces = []
-    for f in faces:
-        fv = [data.getVertexIndex(llm_mesh, v) for v in f]
-        meshFaces.append(fv)
+    meshFaces = data.getVertexIndices(llm_mesh, faces)[0]
     
     bpy.ops.object.select_all(action="DESELECT")
 
@@ -772,65 +771,50 @@ def createMesh(context, name, llm_mesh):
     except:
         pass
 
-    mesh.from_pydata(verts, [], meshFaces)
-    mesh.update(calc_edges=True)
-
-    for e in mesh.edges:
-        if not e.index in noseams:
-            a, b = e.vertices
-            if e.index in extraseams \
-               or ( llm_mesh['vertLookup'][a] in llm_mesh['vertexRemap'].values() and \
-                    llm_mesh['vertLookup'][b] in llm_mesh['vertexRemap'].values()) :
-                e.use_seam = True
-
+    #
+    # Same construction as Mesh.from_pydata(), but fed from
+    # flat arrays, so that the edge order (noseams, extraseams)
+    # does not change
+    #
+    face_count = len(meshFaces)
+    mesh.vertices.add(len(verts))
+    mesh.loops.add(3*face_count)
+    mesh.polygons.add(face_count)
+    mesh.vertices.foreach_set("co", verts.astype(np.float32).ravel())
+    mesh.polygons.foreach_set("loop_total", np.full(face_count, 3, dtype=np.int32))
+    mesh.polygons.foreach_set("loop_start", np.arange(0, 3*face_count, 3, dtype=np.int32))
+    mesh.polygons.foreach_set("vertices", meshFaces.astype(np.int32).ravel())
     mesh.update(calc_edges=True)
-    bpy.context.scene.update()
-
-    bpy.ops.object.mode_set(mode='EDIT')
-    oselect_modes = util.set_mesh_select_mode((True,True,False))
-
-    try:
-        bpy.ops.mesh.select_non_manifold(extend=False, use_wire=False, use_boundary=True, use_multi_face=False, use_non_contiguous=False, use_verts=False)
-    except:
-        bpy.ops.mesh.select_non_manifold(extend=False)
 
-    bpy.ops.mesh.mark_seam(clear=False)
-    bpy.ops.mesh.select_all(action='DESELECT')
-    util.set_mesh_select_mode(oselect_modes)
-
-    for v, normal in enumerate(normals):
-        if v not in llm_mesh['vertexRemap']:
-            mesh.vertices[data.getVertexIndex(llm_mesh, v)].normal = normal
-
-    bpy.ops.mesh.select_all(action='DESELECT')
-    util.ensure_mode_is("OBJECT")
-
-    bpy.ops.object.shade_smooth()
+    #
+    # Seams: all boundary edges, plus the extra seams and the edges
+    # between two remap targets (unless listed in noseams)
+    #
+    edge_count = len(mesh.edges)
+    edge_verts = np.empty(2*edge_count, dtype=np.int32)
+    mesh.edges.foreach_get("vertices", edge_verts)
+    loop_edges = np.empty(3*face_count, dtype=np.int32)
+    mesh.loops.foreach_get("edge_index", loop_edges)
+
+    boundary  = np.bincount(loop_edges, minlength=edge_count) == 1
+    is_target = np.zeros(len(llm_mesh['baseCoords']), dtype=bool)
+    is_target[list(llm_mesh['vertexRemapTargets'])] = True
+    seams = is_target[vert_lookup[edge_verts]].reshape(-1,2).all(axis=1)
+    seams[[i for i in extraseams if 0 <= i < edge_count]] = True
+    seams[[i for i in noseams if 0 <= i < edge_count]] = False
+    seams |= boundary
+    mesh.edges.foreach_set("use_seam", seams.tolist())
+
+    mesh.vertices.foreach_set("normal", normals.astype(np.float32).ravel())
+    mesh.polygons.foreach_set("use_smooth", [True]*face_count)
+    mesh.update()
 
     uv_layer_name="SLMap"
     uv = mesh.uv_textures.new(name=uv_layer_name)
 
-    problemFaces = [
-        ('upperBodyMesh',199),
-        ('headMesh',1464),
-        ('headMesh',1465),
-        ('skirtMesh',200),
-        ('skirtMesh',211),
-        ('skirtMesh',217),
-        ('eyeBallRightMesh',173),
-        ('eyeBallLeftMesh',173),
-        ('eyelashMesh',4),
-        ('hairMesh',351),
-        ]
-
     index    = mesh.uv_textures.keys().index(uv.name)
     uvloops  = mesh.uv_layers[index].data
-    loops    = mesh.loops
-    polygons = mesh.polygons
-    for i, face in enumerate(faces):
-        for j in range(3):
-            loop = polygons[i].loop_indices[j]
-            uvloops[loop].uv = vt[face[j]]
+    uvloops.foreach_set("uv", vt[faces].astype(np.float32).ravel())
                     
     obj.shape_key_add("Basis")
     obj.data.update()
@@ -847,12 +831,14 @@ def createShapekey(obj, pid, morph, mesh):
     key.slider_max = morph['value_max']
     key.value      = morph['value_default']
     
-    for v in morph['vertices']:
+    co = np.empty(3*len(key.data), dtype=np.float32)
+    key.data.foreach_get("co", co)
+    co = co.reshape(-1,3)
 
-        if v['vertexIndex'] in mesh['vertexRemap']:
-            continue
-        i = data.getVertexIndex(mesh, v['vertexIndex'])
-        key.data[i].co = Vector(mesh['baseCoords'][v['vertexIndex']]) + Vector(v['coord'])
+    coords = mesh['baseCoords'][morph['vertexIndices']] + morph['coords']
+    indices, kept = data.getVertexIndices(mesh, morph['vertexIndices'])
+    co[indices[kept]] = coords[kept]
+    key.data.foreach_set("co", co.ravel())
 
 def createMeshGroups(obj, mesh):
 
@@ -860,11 +846,9 @@ def createMeshGroups(obj, mesh):
         group = obj.vertex_groups.new(joint)
 
     name = mesh['name']
-    for ii in range(len( mesh['weights'] )):
-        if ii in mesh['vertexRemap']:
-            continue
-        i = data.getVertexIndex(mesh, ii)
-        b,w = mesh['weights'][ii]
+    indices, kept = data.getVertexIndices(mesh, np.arange(len(mesh['weightIndices'])))
+    weights = zip(indices[kept].tolist(), mesh['weightIndices'][kept].tolist(), mesh['weightValues'][kept].tolist())
+    for i, b, w in weights:
         b1, b2 = data.WEIGHTSMAP[name][b]
         obj.vertex_groups[b1].add([i], 1.0-w, 'REPLACE')
         if b2 is not None and w!=0:
@@ -33,17 +33,76 @@
 # ##### END GPL LICENSE BLOCK #####
 
 
-import bpy, os, logging
+import bpy, os, logging, hashlib, pickle, glob
 import  xml.etree.ElementTree as et
-from struct import unpack
+from struct import unpack_from
+import numpy as np
 from math import radians
 from mathutils import Euler, Vector
-from . import util, const
+from . import util, const, bl_info
 from .util import Bone, Skeleton, V,  sym, s2b, s2bo
 from .const import *
 
 log = logging.getLogger('karaage.data')
 
+DATA_CACHE_VERSION = 2
+file_hashes = {}
+
+def get_file_hash(filepath):
+    '''
+    Return the sha1 of a file (remembered per file path and modification time)
+    '''
+    mtime = os.path.getmtime(filepath)
+    cached = file_hashes.get(filepath)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(filepath, 'rb') as stream:
+        digest = hashlib.sha1(stream.read()).hexdigest()
+    file_hashes[filepath] = (mtime, digest)
+    return digest
+
+def load_cached(kind, sources, key, builder):
+    '''
+    Return the data created by builder() from the persistent cache.
+    The cache entry is identified by kind, key, the Karaage version
+    and the content of the source files. When no valid entry exists,
+    the data is built and stored in the cache.
+    '''
+    try:
+        digest = hashlib.sha1()
+        digest.update(repr((DATA_CACHE_VERSION, bl_info['version'], kind, key)).encode('utf-8'))
+        for source in sources:
+            digest.update(get_file_hash(source).encode('utf-8'))
+        path = os.path.join(CACHE_DIR, "%s_%s.pickle" % (kind, digest.hexdigest()))
+    except (OSError, TypeError) as e:
+        log.warning("load_cached: Can not identify cache entry for %s (%s)" % (kind, e) )
+        return builder()
+
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as stream:
+                result = pickle.load(stream)
+            log.debug("load_cached: Loaded %s from cache %s" % (kind, path) )
+            return result
+        except Exception as e:
+            log.warning("load_cached: Discard unreadable cache %s (%s)" % (path, e) )
+
+    result = builder()
+
+    try:
+        if not os.path.exists(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as stream:
+            pickle.dump(result, stream, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        log.debug("load_cached: Stored %s in cache %s" % (kind, path) )
+    except Exception as e:
+        log.warning("load_cached: Can not store %s in cache %s (%s)" % (kind, path, e) )
+
+    return result
+
 WEIGHTSMAP = {
     'hairMesh':[('mNeck','mHead'), ('mHead', None)],
     'headMesh':[('mNeck','mHead'), ('mHead', None)],
@@ -123,27 +182,75 @@ def get_deform_bones(obj, exclude_volumes=False, exclude_eyes=False):
     return bone_set
     
 def getVertexIndex(mesh, vertex):
-    if vertex in mesh['vertexRemap']:
-        vi = mesh['vertexRemap'][vertex]
-    else:
-        vi = vertex
-    return(mesh['vertLookup'].index(vi))
+    return int(mesh['vertexIndexMap'][vertex])
+
+def getVertexIndices(mesh, vertices):
+    '''
+    Map llm vertex indices to the vertex indices of the created mesh.
+    Returns the mapped indices and a mask which is False for
+    the vertices that are remapped onto another vertex.
+    '''
+    vertices = np.asarray(vertices)
+    indices  = mesh['vertexIndexMap'][vertices]
+    return indices, mesh['vertLookup'][indices] == vertices
+
+LLM_CACHE = {}
+
+LLM_MORPH_VERTEX = np.dtype([
+    ('vertexIndex', '<u4'),
+    ('coord',       '<f4', 3),
+    ('normal',      '<f4', 3),
+    ('binormal',    '<f4', 3),
+    ('texCoord',    '<f4', 2)])
+
+def s2b_array(p):
+    '''
+    Convert an (n,3) array of SL coordinates to Blender coordinates (see s2b)
+    '''
+    return np.column_stack((p[:,1], -p[:,0], p[:,2]))
 
 def loadLLM(name, filename):
     '''
     load and parse binary mesh file (llm)
+    The parsed mesh is cached per file path and modification time.
+    All vertex data is returned as read only numpy arrays.
     '''
 
-    stream = open( filename, 'rb' )
+    mtime  = os.path.getmtime(filename)
+    key    = (name, filename)
+    cached = LLM_CACHE.get(key)
+    if cached and cached[0] == mtime:
+        log.debug("loadLLM: Reuse parsed mesh %s from %s" % (name, filename) )
+        return copy_llm(cached[1])
+
+    with open( filename, 'rb' ) as stream:
+        buffer = stream.read()
+
+    offset = 0
+    def read(dtype, count=1):
+        nonlocal offset
+        dtype = np.dtype(dtype)
+        count = int(count)
+        result = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+        offset += dtype.itemsize * count
+        return result
+
+    def read_name(length=64):
+        nonlocal offset
+        result = buffer[offset:offset+length].decode('utf-8').split("\x00")[0]
+        offset += length
+        return result
+
     llm = {}
-    llm['header'] = stream.read(24).decode('utf-8').split( "\x00" )[0]
-    hasWeights = unpack( "B", stream.read(1) )[0]
-    hasDetailTexCoords = unpack( "B", stream.read(1) )[0]
-    llm['position'] = unpack( "<3f", stream.read(12) )
-    llm['rotationAngles'] = unpack( "<3f", stream.read(12) )
-    llm['rotationOrder'] = unpack( "B", stream.read(1) )[0]
-    llm['scale'] = unpack( "<3f", stream.read(12) )
-    numVertices = unpack( "<H", stream.read(2) )[0]
+    llm['header'] = read_name(24)
+    hasWeights, hasDetailTexCoords = unpack_from( "BB", buffer, offset)
+    offset += 2
+    llm['position'] = unpack_from( "<3f", buffer, offset)
+    llm['rotationAngles'] = unpack_from( "<3f", buffer, offset+12)
+    llm['rotationOrder'] = unpack_from( "B", buffer, offset+24)[0]
+    llm['scale'] = unpack_from( "<3f", buffer, offset+25)
+    numVertices = unpack_from( "<H", buffer, offset+37)[0]
+    offset += 39
 
     EYE_SCALE = 1
 
@@ -159,28 +266,15 @@ def loadLLM(name, filename):
 
     else:
         shift = (0,0,0)    
-    
-    llm['baseCoords'] = []
-    for i in range(numVertices):
-        co = unpack("<3f", stream.read(12)) 
-        llm['baseCoords'].append(s2b((co[0]*scale[0]+shift[0], co[1]*scale[1]+shift[1], co[2]*scale[2]+shift[2])))
-        
-    llm['baseNormals'] = []
-    for i in range(numVertices):
-        llm['baseNormals'].append( s2b(unpack( "<3f", stream.read(12) )))
-        
-    llm['baseBinormals'] = []
-    for i in range(numVertices):
-        llm['baseBinormals'].append( s2b(unpack( "<3f", stream.read(12) )))
-    
-    llm['texCoords'] = []
-    for i in range(numVertices):
-        llm['texCoords'].append( unpack( "<2f", stream.read(8) ))
+
+    co = read("<f4", 3*numVertices).reshape(-1,3).astype(np.float64)
+    llm['baseCoords']    = s2b_array(co*scale + shift)
+    llm['baseNormals']   = s2b_array(read("<f4", 3*numVertices).reshape(-1,3).astype(np.float64))
+    llm['baseBinormals'] = s2b_array(read("<f4", 3*numVertices).reshape(-1,3).astype(np.float64))
+    llm['texCoords']     = read("<f4", 2*numVertices).reshape(-1,2).astype(np.float64)
     
     if hasDetailTexCoords:
-        llm['detailTexCoords'] = []
-        for i in range(numVertices):
-            llm['detailTexCoords'].append( unpack( "<2f", stream.read(8) ))
+        llm['detailTexCoords'] = read("<f4", 2*numVertices).reshape(-1,2).astype(np.float64)
     
     #
 
@@ -188,26 +282,20 @@ def loadLLM(name, filename):
 
     #
     if hasWeights:
-        llm['weights'] = []
-        for i in range(numVertices):
-            raw = unpack( "<f", stream.read(4) )[0]
-            idx = int(raw)-1
-            iweight = raw-int(raw)
-            llm['weights'].append( (idx, iweight) )
+        raw = read("<f4", numVertices).astype(np.float64)
+        llm['weightIndices'] = raw.astype(np.int32) - 1
+        llm['weightValues']  = raw - raw.astype(np.int32)
             
     if name == "eyeBallLeftMesh" or name == "eyeBallRightMesh":
-        llm['weights'] = [(0,0.0)]*numVertices
+        llm['weightIndices'] = np.zeros(numVertices, dtype=np.int32)
+        llm['weightValues']  = np.zeros(numVertices, dtype=np.float64)
 
-    numFaces = unpack( "<H", stream.read(2) )[0]
-    llm['faces'] = []
-    for i in range(numFaces):
-        llm['faces'].append( unpack( "<3H", stream.read(6) ))
+    numFaces = int(read("<u2")[0])
+    llm['faces'] = read("<u2", 3*numFaces).reshape(-1,3).astype(np.int32)
     
     if hasWeights:
-        numSkinJoints = unpack( "<H", stream.read(2) )[0]
-        llm['skinJoints'] = []
-        for i in range(numSkinJoints):
-            llm['skinJoints'].append(stream.read(64).decode('utf-8').split("\x00")[0])
+        numSkinJoints = int(read("<u2")[0])
+        llm['skinJoints'] = [read_name() for i in range(numSkinJoints)]
         
     if name == "eyeBallLeftMesh":
         llm['skinJoints'] = ['mEyeLeft']
@@ -215,33 +303,63 @@ def loadLLM(name, filename):
         llm['skinJoints'] = ['mEyeRight']
 
     llm['morphsbyname'] = {}
-    n = stream.read(64).decode('utf-8').split("\x00")[0]
+    n = read_name()
     while n != "End Morphs":
-        morph = {'name':n}
-        numMorphVertices = unpack( "<L", stream.read(4) )[0]
-        morph['vertices'] = []
-        for i in range(numMorphVertices):
-            v = {}
-            v['vertexIndex'] = unpack( "<L", stream.read(4) )[0] # 0-indexed
-            v['coord'] = s2b(unpack( "<3f", stream.read(12) ))
-            v['normal'] = s2b(unpack( "<3f", stream.read(12) ))
-            v['binormal'] = s2b(unpack( "<3f", stream.read(12) ))
-            v['texCoord'] = unpack( "<2f", stream.read(8) )
-            morph['vertices'].append( v )
+        numMorphVertices = int(read("<u4")[0])
+        vertices = read(LLM_MORPH_VERTEX, numMorphVertices)
+        morph = {'name':n,
+                 'vertexIndices' : vertices['vertexIndex'].astype(np.int32), # 0-indexed
+                 'coords'        : s2b_array(vertices['coord'].astype(np.float64)),
+                 'normals'       : s2b_array(vertices['normal'].astype(np.float64)),
+                 'binormals'     : s2b_array(vertices['binormal'].astype(np.float64)),
+                 'texCoords'     : vertices['texCoord'].astype(np.float64)
+                }
         llm['morphsbyname'][n] = morph
-        n = stream.read(64).decode('utf-8').split("\x00")[0]
-        
-    numRemaps = unpack( "<l", stream.read(4) )[0]
-    llm['vertexRemap'] = {}
-    for i in range(numRemaps):
-        remap = unpack( "<2l", stream.read(8) )
-        llm['vertexRemap'][ remap[0] ] = remap[1]
-    stream.close()
+        n = read_name()
 
-    llm['vertLookup'] = [i for i in range(len(llm['baseCoords'])) \
-        if i  not in llm['vertexRemap']]
+    numRemaps = int(read("<i4")[0])
+    remaps = read("<i4", 2*numRemaps).reshape(-1,2)
+    llm['vertexRemap'] = dict(remaps.tolist())
 
-    return llm
+    keep = np.ones(numVertices, dtype=bool)
+    keep[remaps[:,0]] = False
+    lookup = np.flatnonzero(keep)
+    llm['vertLookup'] = lookup
+
+    #
+    # Inverse of vertLookup with the remapped vertices
+    # resolved to the index of their remap target
+    #
+    index_map = np.zeros(numVertices, dtype=np.int32)
+    index_map[lookup] = np.arange(len(lookup), dtype=np.int32)
+    index_map[remaps[:,0]] = index_map[remaps[:,1]]
+    llm['vertexIndexMap']     = index_map
+    llm['vertexRemapTargets'] = frozenset(remaps[:,1].tolist())
+
+    for val in llm.values():
+        if isinstance(val, np.ndarray):
+            val.setflags(write=False)
+    for morph in llm['morphsbyname'].values():
+        for val in morph.values():
+            if isinstance(val, np.ndarray):
+                val.setflags(write=False)
+
+    LLM_CACHE[key] = (mtime, llm)
+    return copy_llm(llm)
+
+def copy_llm(llm):
+    '''
+    Copy of a cached mesh. The read only arrays are shared, but
+    the morphs and all other containers are fresh copies, so the
+    caller can modify them (e.g. set the morph ranges from the lad file)
+    '''
+    result = {}
+    for key, val in llm.items():
+        if isinstance(val, (dict, list)):
+            val = val.copy()
+        result[key] = val
+    result['morphsbyname'] = {n:dict(morph) for n, morph in llm['morphsbyname'].items()}
+    return result
 
 def cleanId(nid, name):
 
@@ -255,6 +373,14 @@ def cleanId(nid, name):
     return clean_name+pid
 
 def loadDrivers(rigType=None, max_param_id=-1):
+    '''
+    Read in shape drivers from avatar_lad.xml (cached)
+    '''
+    ladfile = util.get_lad_file(rigType, "Load Drivers")
+    return load_cached("drivers", [ladfile], (rigType, max_param_id),
+                       lambda : parseDrivers(ladfile, max_param_id))
+
+def parseDrivers(ladfile, max_param_id=-1):
     '''
     Read in shape drivers from avatar_lad.xml
     '''
@@ -263,7 +389,7 @@ def loadDrivers(rigType=None, max_param_id=-1):
 
     #
 
-    ladxml = et.parse(util.get_lad_file(rigType, "Load Drivers"))
+    ladxml = et.parse(ladfile)
 
     DRIVERS = {}
     
@@ -512,12 +638,26 @@ def has_karaage_shapekeys(ob):
     return False
 
 def loadMeshes(rigType=None):
+    '''
+    Load the mesh details from avatar_lad.xml and the .llm files (cached)
+    '''
+    ladfile = util.get_lad_file(rigType, "Load meshes")
+    sources = [ladfile] + sorted(glob.glob(os.path.join(DATAFILESDIR, "*.llm")))
+    MESHES  = load_cached("meshes", sources, rigType, lambda : parseMeshes(ladfile))
+
+    for meshd in MESHES.values():
+        for pid, morph in meshd['morphs'].items():
+            SHAPEKEYS[pid]=morph
+
+    return MESHES
+
+def parseMeshes(ladfile):
     '''
     Load the mesh details from avatar_lad.xml and the .llm files
     '''
 
     MESHES = {}
-    ladxml = et.parse(util.get_lad_file(rigType, "Load meshes"))
+    ladxml = et.parse(ladfile)
 
     logging.info("Loading avatar data")
 
@@ -1329,67 +1469,73 @@ def add_boneset(rigType, jointtype, boneset):
     bonesets[key] = boneset
 
 def load_skeleton_data(filepath, rigType, jointtype):
-    from .util import V
 
     global bonesets
     boneset = get_boneset(rigType, jointtype)
     print("Create %s Avatar %s file %s" % (rigType, "reusing" if boneset else "using", filepath) )
 
     if not boneset:
+        ladfile = util.get_lad_file(rigType, "Load skeleton data")
+        boneset = load_cached("boneset", [filepath, ladfile], (rigType, jointtype),
+                              lambda : parse_skeleton_data(filepath, rigType, jointtype))
+        add_boneset(rigType, jointtype, boneset)
+        print("Loaded %s.%s Skeleton" % (rigType,jointtype))
 
-        skeletontree = et.parse(filepath)
-        root = skeletontree.getroot()
+    return boneset
 
-        blname = "Origin"
-        origin = Bone(blname,
-                      bvhname     = None,
-                      slname      = blname,
-                      reltail     = s2b(V(BONE_TAIL_LOCATIONS[blname])),
-                      bonelayers  = [B_LAYER_ORIGIN],
-                      shape="CustomShape_Origin",
-                      skeleton='basic', bonegroup='Origin', mandatory='false')
+def parse_skeleton_data(filepath, rigType, jointtype):
+    from .util import V
 
-        boneset = {"Origin": origin}
-        load_bone_hierarchy(root, origin, boneset, jointtype)
-            
-        boneset["mHipRight"].roll     = radians(-7.5)
-        boneset["mHipLeft"].roll      = radians( 7.5)
+    skeletontree = et.parse(filepath)
+    root = skeletontree.getroot()
 
-        create_ik_bones(boneset)
-        load_control_bones(boneset)
+    blname = "Origin"
+    origin = Bone(blname,
+                  bvhname     = None,
+                  slname      = blname,
+                  reltail     = s2b(V(BONE_TAIL_LOCATIONS[blname])),
+                  bonelayers  = [B_LAYER_ORIGIN],
+                  shape="CustomShape_Origin",
+                  skeleton='basic', bonegroup='Origin', mandatory='false')
 
-        create_face_rig(boneset)
+    boneset = {"Origin": origin}
+    load_bone_hierarchy(root, origin, boneset, jointtype)
         
-        cog         = boneset['COG']
-        mPelvis     = boneset['mPelvis']
+    boneset["mHipRight"].roll     = radians(-7.5)
+    boneset["mHipLeft"].roll      = radians( 7.5)
 
-        mEyeRight = boneset["mEyeRight"]
-        mEyeLeft  = boneset["mEyeLeft"]
-        
-        loc = 0.5*(mEyeRight.relhead+mEyeLeft.relhead)
-        EyeTarget = Bone("EyeTarget", relhead=V((loc.x, loc.y-2.0, loc.z)), reltail=V((0,0,0.1)), 
-                         bonelayers=[B_LAYER_EYE_TARGET], parent=boneset["Head"], shape="CustomShape_EyeTarget",
-                         skeleton='basic', bonegroup='Eye Target', mandatory='false')
-        boneset["EyeTarget"] = EyeTarget
-        FaceEyeTarget = Bone("FaceEyeAltTarget", relhead=V((loc.x, loc.y-2.0, loc.z)), reltail=V((0,0,0.1)), 
-                         bonelayers=[B_LAYER_EYE_ALT_TARGET], parent=boneset["Head"], shape="CustomShape_EyeTarget",
-                         skeleton='basic', bonegroup='Eye Alt Target', mandatory='false')
-        boneset["FaceEyeAltTarget"] = FaceEyeTarget
-
-        load_attachment_points(boneset, rigType)
-        connect_bone_chains(boneset)
-        set_bento_bone_layers(boneset)
-        #
-        add_boneset(rigType, jointtype, boneset)
-        print("Loaded %s.%s Skeleton" % (rigType,jointtype))
+    create_ik_bones(boneset)
+    load_control_bones(boneset)
 
-        for bone in boneset.values():
-            bone.b0head = bone.head(bind=True)
-            bone.b0tail = bone.tail()
-            b0dist = bone.head(bind=True)
-            if bone.parent:
-                b0dist -= bone.parent.head(bind=True)
-            bone.b0dist = Vector(b0dist).magnitude
+    create_face_rig(boneset)
+    
+    cog         = boneset['COG']
+    mPelvis     = boneset['mPelvis']
+
+    mEyeRight = boneset["mEyeRight"]
+    mEyeLeft  = boneset["mEyeLeft"]
+    
+    loc = 0.5*(mEyeRight.relhead+mEyeLeft.relhead)
+    EyeTarget = Bone("EyeTarget", relhead=V((loc.x, loc.y-2.0, loc.z)), reltail=V((0,0,0.1)), 
+                     bonelayers=[B_LAYER_EYE_TARGET], parent=boneset["Head"], shape="CustomShape_EyeTarget",
+                     skeleton='basic', bonegroup='Eye Target', mandatory='false')
+    boneset["EyeTarget"] = EyeTarget
+    FaceEyeTarget = Bone("FaceEyeAltTarget", relhead=V((loc.x, loc.y-2.0, loc.z)), reltail=V((0,0,0.1)), 
+                     bonelayers=[B_LAYER_EYE_ALT_TARGET], parent=boneset["Head"], shape="CustomShape_EyeTarget",
+                     skeleton='basic', bonegroup='Eye Alt Target', mandatory='false')
+    boneset["FaceEyeAltTarget"] = FaceEyeTarget
+
+    load_attachment_points(boneset, rigType)
+    connect_bone_chains(boneset)
+    set_bento_bone_layers(boneset)
+
+    for bone in boneset.values():
+        bone.b0head = bone.head(bind=True)
+        bone.b0tail = bone.tail()
+        b0dist = bone.head(bind=True)
+        if bone.parent:
+            b0dist -= bone.parent.head(bind=True)
+        bone.b0dist = Vector(b0dist).magnitude
 
     return boneset
 
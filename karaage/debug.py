@@ -196,4 +196,38 @@ def test_control_rig(context=None, magnitude=0.0000001):
             print("     cbone head : %s" % cbone.head)
             
     util.ensure_mode_is(omode)
-    context.scene.objects.active = active
\ No newline at end of file
+    context.scene.objects.active = active
+
+def test_custom_bones(context=None, init=False, magnitude=0.000001):
+    '''
+    Compare the loop and the batched deform of the custom mesh of
+    the active object. Returns True when all vertices match
+    '''
+
+    if not context: context = bpy.context
+    obj = context.object
+    arm = util.getArmature(obj)
+    if not (obj and arm and shape.has_shape_data(obj)):
+        print("test custom bones: Select a Custom Mesh with attached Sliders")
+        return False
+
+    from_shape = 'original' if init else 'neutral_shape'
+    bones = util.get_modify_bones(arm)
+    co, key = shape.get_shape_data(obj, from_shape)
+    groups, unweighted = shape.get_weight_groups(obj, bones)
+
+    co_loop    = shape.deform_custom_shape_loop(obj, arm, bones, co, groups, init)
+    co_batched = shape.deform_custom_shape_batched(obj, arm, bones, co, groups, init)
+
+    mismatch_counter = 0
+    for i in range(0, len(co_loop), 3):
+        d = Vector(co_loop[i:i+3]) - Vector(co_batched[i:i+3])
+        if d.magnitude > magnitude:
+            mismatch_counter += 1
+            print("test custom bones: mag:%f vert:%d loop:%s batched:%s" % (d.magnitude, i/3, co_loop[i:i+3], co_batched[i:i+3]))
+
+    if mismatch_counter == 0:
+        print("test custom bones: %d verts passed" % (len(co_loop)/3))
+    else:
+        print("test custom bones: found %d mismatches in %d tested verts" % (mismatch_counter, len(co_loop)/3))
+    return mismatch_counter == 0
@@ -36,11 +36,15 @@
 import bpy, bmesh, sys
 from mathutils import Vector, Matrix
 import  xml.etree.ElementTree as et
+from xml.sax.saxutils import escape
+import numpy as np
 import xmlrpc.client
 from bpy_extras.io_utils import ExportHelper
 from bpy.props import *
-import logging, gettext, os, time, re, shutil
+import logging, gettext, os, time, re, shutil, multiprocessing
 from math import pi, exp, degrees
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from . import bind, const, create, data, util, rig, shape, bl_info, weights
 from bpy.app.handlers import persistent
@@ -1526,31 +1530,16 @@ def findWeightProblemVertices(context, obj, use_sl_list=True, armature=None, fin
 
             report['status'].extend(('no_armature','unweighted'))
 
-    for v in obj.data.vertices:
-        deforming = 0
-        zero = 0  # :)
-        if len(v.groups) == 0:
-            report['unweighted'].append(v.index)
-        else:
-            for g in v.groups:
-                try:
-                    bonename = obj.vertex_groups[g.group].name
-                    if armature == None or (bonename in armature.data.bones and armature.data.bones[bonename].use_deform):
-                        deforming += 1 # count Number of deform bones for this vertex
-                        if g.weight == 0:
-                            zero += 1 # Count numberof zero weights for this vertex
-                except:
+    W = util.get_weight_matrix(obj)
+    deform = W.entry_mask(W.deform_mask(armature))
+    deforming = W.row_count(deform)
+    zero = W.row_count(deform & (W.weights == 0))
+    weighted = W.counts > 0
 
-                    pass
-                    
-            if deforming == 0:
-                report['unweighted'].append(v.index)
-            if deforming > max_weight:
-                report['too_many'].append(v.index)
-            if zero == deforming:
+    report['unweighted'].extend(np.flatnonzero(~weighted | (deforming == 0)).tolist())
+    report['too_many'].extend(np.flatnonzero(weighted & (deforming > max_weight)).tolist())
+    report['zero_weights'].extend(np.flatnonzero(weighted & (zero == deforming)).tolist())
 
-                report['zero_weights'].append(v.index)
-        
     if len(report['unweighted']) > 0:
         report['status'].append('unweighted')
     if len(report['zero_weights']) > 0:
@@ -1568,25 +1557,12 @@ def findUnweightedVertices(context, obj, use_sl_list=True, arm=None):
     if arm is None:
         return [v.index for v in obj.data.vertices], NO_ARMATURE 
     
-    unweighted = []
-    deform_bones = data.get_deform_bones(arm, exclude_volumes=False, exclude_eyes=False) if use_sl_list else []
-    
-    status = WEIGHTS_OK
-    for v in obj.data.vertices:
-        tot = 0.0
-        for g in v.groups:
-            bonename = obj.vertex_groups[g.group].name
-
-            if bonename in arm.data.bones and arm.data.bones[bonename].use_deform:
-                if use_sl_list:
-                    if bonename in deform_bones:
-                        tot += g.weight
-                else:
-                    tot += g.weight
+    deform_bones = data.get_deform_bones(arm, exclude_volumes=False, exclude_eyes=False) if use_sl_list else None
 
-        if tot==0:
-            unweighted.append(v.index)
-            status = MISSING_WEIGHTS
+    W = util.get_weight_matrix(obj)
+    tot = W.row_sum(W.entry_mask(W.deform_mask(arm, deform_bones)))
+    unweighted = np.flatnonzero(tot == 0).tolist()
+    status = MISSING_WEIGHTS if unweighted else WEIGHTS_OK
 
     return unweighted, status
 
@@ -3417,43 +3393,16 @@ def copyBoneWeights(operator, context, obj, weight_sources, clearTargetWeights,
     context.scene.update()
 
     logging.debug(_("Bone weight sources: %s"), repr([s[1].name for s in sources]))
+    prepared_sources = [(source.name, weights.WeightTransferSource(copy, source)) for copy, source in sources]
     for target in weighttargets:
 
-        M=target.matrix_world
-        clean_target_groups = []
+        transfer_sources = [ts for name, ts in prepared_sources if name != target.name]
+        vertex_indices = [v.index for v in target.data.vertices if v.select or not context.scene.MeshProp.copyWeightsSelected]
+        results = weights.get_transfer_weights(target, vertex_indices, transfer_sources, submeshInterpolation)
+        weights.write_transfer_weights(target, vertex_indices, results, clearTargetWeights)
 
-        nv = 0 # track number of vertices for reporting
-        fv = 0 # track number of verts which could not receive a weight
-        for vertex in target.data.vertices:
-
-            if context.scene.MeshProp.copyWeightsSelected and not vertex.select:
-                continue
-
-            vs = []
-
-            pt = M*vertex.co
-
-            for source in sources:
-
-                if source[1].name != target.name:
-
-                    d, gdata = weights.getWeights(source[0],source[1],pt, submeshInterpolation)
-                    vs.append((d,gdata))
-                
-            if len(vs) == 0:
-                fv += 1
-            else:
-                vmin = min(vs, key=lambda v: v[0])
-                for gn,w in vmin[1].items():
-                    if clearTargetWeights and gn in target.vertex_groups and gn not in clean_target_groups:
-                        target.vertex_groups.remove(target.vertex_groups[gn])
-
-                    if gn not in target.vertex_groups:
-                        target.vertex_groups.new(gn)
-                        clean_target_groups.append(gn)
-                    target.vertex_groups[gn].add([vertex.index], w, 'REPLACE')
-
-                nv+=1  
+        nv = len([vs for vs in results if vs is not None]) # track number of vertices for reporting
+        fv = len(results) - nv # track number of verts which could not receive a weight
 
         if nv > 0:
             operator.report({'INFO'},_("Copied bone weights to %d/%d vertices in %s")%(nv,len(target.data.vertices),target.name))
@@ -3691,113 +3640,112 @@ def create_libimages(root, base, mat_images, exportCopy, preferred_image_format,
     bpy.context.scene.render.image_settings.color_mode = original_color_mode
     return libimages
     
-def get_normal_index(n, normals, normalsd):
-    normal = (round(n.x,6), round(n.y,6), round(n.z,6)) 
-    try:
-        nidx = normalsd[normal]
-    except:
-        nidx = len(normals)
-        normals.append(normal)
-        normalsd[normal]=nidx
-    return nidx
-
 def create_polylists(mesh, welded_normals, progress):
-    current_time = time.time()
-    begin_time   = current_time
-    #
-
-    #
-
-    polygons = mesh.polygons
-    uvexists = len(mesh.uv_layers)>0
-    if uvexists:
-        uv_data = mesh.uv_layers.active.data
-
-    polylists= {}
-    normals  = []
-    normalsd = {}
-    uv_array = []
-    uvidx = 0
-    
-    last_mat_index = -1
-    vcount = []
-    ps     = []
-    lc     = 0    
-    
-    pcounter = 0
-    
-    for p in polygons:
-    
-        pcounter += 1
-        if pcounter % 1000 == 0:
-            util.progress_update(1, absolute=False)            
+    '''
+    Build the Collada polylists of the mesh, one per used material.
+    All per corner data is read in bulk and the normals are merged
+    by their values rounded to 6 digits. Normal indices follow the
+    first occurrence of a normal in polygon order.
+    Returns (polylists, normals, uv_array) where polylists maps the
+    material index to (vcount, p, loop count)
+    '''
 
-        mat_index = p.material_index
-        if mat_index != last_mat_index:
+    begin_time = time.time()
+    polygons   = mesh.polygons
+    loops      = mesh.loops
+    pcount     = len(polygons)
+    uvexists   = len(mesh.uv_layers)>0
+
+    if pcount == 0:
+        return {}, [], []
+
+    loop_start   = np.empty(pcount, dtype=np.int32)
+    loop_total   = np.empty(pcount, dtype=np.int32)
+    mat_indices  = np.empty(pcount, dtype=np.int32)
+    smooth       = np.empty(pcount, dtype=bool)
+    poly_normals = np.empty(3*pcount, dtype=np.float32)
+    polygons.foreach_get('loop_start', loop_start)
+    polygons.foreach_get('loop_total', loop_total)
+    polygons.foreach_get('material_index', mat_indices)
+    polygons.foreach_get('use_smooth', smooth)
+    polygons.foreach_get('normal', poly_normals)
+
+    loop_verts   = np.empty(len(loops), dtype=np.int32)
+    loop_normals = np.empty(3*len(loops), dtype=np.float32)
+    loops.foreach_get('vertex_index', loop_verts)
+    loops.foreach_get('normal', loop_normals)
 
-            if last_mat_index != -1:
+    #
 
-                polylists[last_mat_index]=(vcount, ps, lc)
+    #
+    corner_poly = np.repeat(np.arange(pcount), loop_total)
+    first       = np.cumsum(loop_total) - loop_total
+    corners     = loop_start[corner_poly] + np.arange(len(corner_poly)) - first[corner_poly]
+    verts       = loop_verts[corners]
+    smooth      = smooth[corner_poly]
+
+    normals = np.where(smooth[:,None],
+                       loop_normals.reshape(-1,3)[corners],
+                       poly_normals.reshape(-1,3)[corner_poly]).astype(np.float64)
+
+    if welded_normals:
+        keys   = np.fromiter(welded_normals.keys(), dtype=np.int64, count=len(welded_normals))
+        values = np.array([tuple(n) for n in welded_normals.values()], dtype=np.float32)
+        order  = np.argsort(keys)
+        keys   = keys[order]
+        values = values[order]
+        pos    = np.searchsorted(keys, verts).clip(max=len(keys)-1)
+        welded = smooth & (keys[pos] == verts)
+        normals[welded] = values[pos[welded]]
 
-            last_mat_index = mat_index
-            try:
-                vcount = polylists[mat_index][0]
-                ps     = polylists[mat_index][1]
-                lc     = polylists[mat_index][2]
+    #
 
-            except:
-                vcount = []
-                ps     = []
-                lc     = 0
-                polylists[mat_index]=(vcount, ps, lc)
-
-        vlen=len(p.vertices)
-        vcount.append(str(vlen))
-        lc += vlen
-        
-        if p.use_smooth:
-
-            fixcount = 0
-            for vidx,v in enumerate(p.vertices):
-                x=0
-                if welded_normals and v in welded_normals:
-                    n = welded_normals[v]
-                    fixcount +=1
-                else:
-                    n = mesh.loops[p.loop_indices[vidx]].normal
-                
-                nidx = get_normal_index(n, normals, normalsd)
-                if uvexists:
-                    ps.extend((str(v),str(nidx),str(uvidx)+" "))
-                    
-                    uv = uv_data[p.loop_indices[vidx]].uv
-                    uv_array.extend(("%g"%round(uv[0],6), "%g  "%round(uv[1],6)))
-                    uvidx +=1
-                else:
-                    ps.extend((str(v),str(nidx)+" "))
+    #
+    normals = np.round(normals, 6) + 0.0
+    sort_order = np.lexsort(normals.T[::-1])
+    ordered    = normals[sort_order]
+    is_first   = np.ones(len(sort_order), dtype=bool)
+    is_first[1:] = np.any(ordered[1:] != ordered[:-1], axis=1)
+    inverse    = np.empty(len(sort_order), dtype=np.int64)
+    inverse[sort_order] = np.cumsum(is_first) - 1
+    normals     = ordered[is_first]
+    first_index = sort_order[is_first]
+
+    order = np.argsort(first_index)
+    rank  = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    normals = normals[order]
+    nidx    = rank[inverse.reshape(-1)]
 
-        else:
+    if uvexists:
+        uv = np.empty(2*len(loops), dtype=np.float32)
+        mesh.uv_layers.active.data.foreach_get('uv', uv)
+        uv_array = uv.reshape(-1,2)[corners].reshape(-1)
+        ps = np.column_stack((verts, nidx, np.arange(len(corners))))
+    else:
+        uv_array = []
+        ps = np.column_stack((verts, nidx))
 
-            n = p.normal
-            nidx = get_normal_index(n, normals, normalsd)
-            
-            for vidx, v in enumerate(p.vertices):
-                if uvexists:
-                    ps.extend((str(v),str(nidx),str(uvidx)+" "))
-                    
-                    uv = uv_data[p.loop_indices[vidx]].uv
-                    
-                    uv_array.extend(("%g"%round(uv[0],6), "%g  "%round(uv[1],6)))
-                    uvidx +=1
-                else:
-                    ps.extend((str(v),str(nidx)+" "))
-                
-        ps.append("  ")
+    util.progress_update(pcount // 1000, absolute=False)
 
-    if last_mat_index != -1:
-        polylists[last_mat_index]=(vcount, ps, lc)
+    #
 
-    print("Created %d UV faces and %d polylists in %.0f milliseconds" % (uvidx, len(polylists), 1000*(time.time()-begin_time)))
+    #
+    corner_mats  = mat_indices[corner_poly]
+    poly_order   = np.argsort(mat_indices, kind='mergesort')
+    corner_order = np.argsort(corner_mats, kind='mergesort')
+    mats, poly_first, poly_counts = np.unique(mat_indices, return_index=True, return_counts=True)
+    corner_counts = np.bincount(np.searchsorted(mats, corner_mats), minlength=len(mats))
+    poly_begin    = np.cumsum(poly_counts) - poly_counts
+    corner_begin  = np.cumsum(corner_counts) - corner_counts
+
+    polylists = {}
+    for m in np.argsort(poly_first).tolist():
+        vcount = loop_total[poly_order[poly_begin[m]:poly_begin[m]+poly_counts[m]]]
+        p      = ps[corner_order[corner_begin[m]:corner_begin[m]+corner_counts[m]]].reshape(-1)
+        polylists[int(mats[m])] = (vcount, p, int(corner_counts[m]))
+
+    print("Created %d UV faces and %d polylists in %.0f milliseconds" % (len(uv_array)//2, len(polylists), 1000*(time.time()-begin_time)))
     return polylists, normals, uv_array
 
 def colladaKey(key):
@@ -3805,23 +3753,21 @@ def colladaKey(key):
     result = re.sub("[^\w-]","_",key)
     return result
 
-def add_material_list(tech, mesh, uv_count):
-    materials = mesh.data.materials
-    has_uv_layout = uv_count > 0
-    for material in materials:
-        if material is None:
+def add_material_list(tech, materials, uv_semantic):
+    for material_name in materials:
+        if material_name is None:
 
             continue
             
-        collada_material = colladaKey(material.name + "-material")
+        collada_material = colladaKey(material_name + "-material")
         inst = subx(tech, "instance_material", symbol=collada_material, target="#"+collada_material)
-        if has_uv_layout:
-            try:
-                semantic = mesh.data.uv_layers.active.name
-            except:
+        if uv_semantic:
+            subx(inst, "bind_vertex_input", semantic=uv_semantic, input_semantic="TEXCOORD", input_set="0")
 
-                semantic = mesh.data.uv_textures.active.name
-            subx(inst, "bind_vertex_input", semantic=semantic, input_semantic="TEXCOORD", input_set="0")
+def get_bind_joint_array(array, rcount):
+    indent = "\n          "
+    text = indent.join([" ".join(array[i:i + rcount]) for i in range(0, len(array), rcount)])
+    return indent + text + indent
 
 def attachment_name(bone_name):
     return bone_name[1:].replace(" ", "_")
@@ -3848,11 +3794,6 @@ def exportCollada(context,
                   with_joints
                   ):
 
-    def get_bind_joint_array(array, rcount):
-        indent = "\n          "
-        text = indent.join([" ".join(array[i:i + rcount]) for i in range(0, len(array), rcount)])
-        return indent + text + indent
-
     def get_export_bone_set(arm, sceneProps, target_system, dbones):
         export_bones = []
         for bone_name in dbones:
@@ -3955,7 +3896,6 @@ def exportCollada(context,
     #
     root = et.Element('COLLADA', attrib={'xmlns':'http://www.collada.org/2005/11/COLLADASchema', 'version':'1.4.1'})  
     root.tail = os.linesep
-    xml = et.ElementTree(root)
     
     asset = subx(root, 'asset')
 
@@ -4057,19 +3997,12 @@ def exportCollada(context,
     util.ensure_mode_is(omode, context=context)
     context.scene.objects.active=active
     
-    created_materials = {}
-
-    geometry_name = None
-    for index, obj_name in (enumerated_objects):
-        mesh = selected_objects[index]
-
-        progress += 100
-        util.progress_update(progress)
-
-        try:
-            assert ( obj_name == mesh.name )
-        except:
-            logging.error("Error in ordering the selection by object name.")
+    def extract_collada_mesh(mesh):
+        '''
+        Read all data needed for the Collada encoding of mesh
+        into plain values and arrays (see encode_collada_mesh).
+        Uses the Blender API, call from the main thread only.
+        '''
 
         mesh_data_copy = util.getMesh(
                               context, 
@@ -4082,129 +4015,14 @@ def exportCollada(context,
 
         logging.debug(_("Export mesh %s"), mesh.name)
 
-        geometry_name = mesh.name
-        mid = colladaKey(mesh.name)
-        geo = subx(libgeo, 'geometry', id=mid+'-mesh', name=geometry_name)
-        mx = subx(geo, 'mesh')
-
-        #
-
-        #
-
-        for midx, mat in enumerate(mesh.data.materials):
-            if mat is None:
+        MESH = {'name'     : mesh.name,
+                'mid'      : colladaKey(mesh.name),
+                'vcount'   : len(mesh_data_copy.vertices),
+                'positions': util.get_vertex_array(mesh_data_copy.vertices).reshape(-1),
+                'materials': [mat.name if mat else None for mat in mesh.data.materials],
+                'max_faces': prefs.maxFacePerMaterial,
+                'warnings' : []}
 
-                continue
-                
-            material_name = colladaKey(mat.name)
-            
-            if created_materials.get(material_name) is not None:
-                continue
-            created_materials[material_name]=material_name
-            
-            effect_id     = material_name+"-effect"
-            material_id   = material_name+"-material"
-            
-            effect = subx(libeffects, "effect", id=effect_id)
-            prof = subx(effect, "profile_COMMON")
-            
-            images = get_images_for_material(mat_images, mat)
-            if len(images) > 0:
-                image=images[0]
-                if len(images) > 1:
-                    print("%d images assigned to material %s, take only %s" % (len(images), material_name, image.name))
-            else:
-                image = None
-                
-            if image is not None:
-                collada_name = colladaKey(image.name)
-
-                newparam = subx(prof, "newparam", sid=collada_name+'-surface')
-                surface = subx(newparam, "surface", type="2D")
-                initfrom = subx(surface, "init_from", text=collada_name)
-           
-                newparam = subx(prof, "newparam", sid=collada_name+'-sampler')
-                sampler2d = subx(newparam, "sampler2D")
-                source = subx(sampler2d, "source", text=collada_name+"-surface")
-            
-            tech = subx(prof, "technique", sid="common")
-            phong = subx(tech, "phong")
-            
-            wrap = subx(phong, "emission")
-            e = mat.emit
-            col = subx(wrap, "color", sid="emission", text="%g %g %g 1"%(e,e,e))
-           
-            wrap = subx(phong, "ambient")
-            col = subx(wrap, "color", sid="ambient", text="0 0 0 1")
-            
-            wrap = subx(phong, "diffuse")
-            if image is not None:
-                semantic = mesh.data.uv_layers.active.name
-                texture = subx(wrap, "texture", texture=collada_name+'-sampler', texcoord=semantic)
-            else:
-                i = mat.diffuse_intensity
-                c = ["%g"%(j*i) for j in mat.diffuse_color]
-
-                if mat.use_transparency:
-                    c.append("%g"%mat.alpha) 
-                else:
-                    c.append("1") 
-                col = subx(wrap, "color", sid="diffuse", text=" ".join(c))
-            
-            wrap = subx(phong, "specular")
-            i = mat.specular_intensity
-            c = ["%g"%(j*i) for j in mat.specular_color]
-            if mat.use_transparency:
-                c.append("%g"%mat.specular_alpha)
-            else:
-                c.append("1")
-            col = subx(wrap, "color", sid="specular", text=" ".join(c))
-            
-            wrap = subx(phong, "shininess")
-            col = subx(wrap, "float", sid="shininess", text="%g"%mat.specular_hardness)
-           
-            if mat.raytrace_mirror.use:
-                wrap = subx(phong, "reflective")
-                c = ["%g"%j for j in mat.mirror_color]
-                c.append("1")
-                col = subx(wrap, "color", sid="reflective", text=" ".join(c))
-                
-                wrap = subx(phong, "reflectivity")
-                col = subx(wrap, "float", sid="reflectivity", text="%g"%mat.raytrace_mirror.reflect_factor)
-            
-            if mat.use_transparency:
-                wrap = subx(phong, "transparency")
-                col = subx(wrap, "float", sid="transparency", text="%g"%mat.alpha)
-            
-            wrap = subx(phong, "index_of_refraction")
-            col = subx(wrap, "float", sid="index_of_refraction", text="1.0")
-            
-            material = subx(libmaterials, "material", id=material_id, name=mat.name)
-            subx(material, "instance_effect", url="#"+effect_id)
-            
-        #
-
-        #
-        
-        source = subx(mx, 'source', id=mid+'-mesh-positions') 
-        positions = []
-        for v in mesh_data_copy.vertices:
-            p = v.co
-            positions.append("%g"%round(p.x,6))
-            positions.append("%g"%round(p.y,6))
-            positions.append("%g  "%round(p.z,6))          
-            
-        pos = subx(source, 'float_array', id=mid+'-mesh-positions-array', 
-                   count=str(len(positions)))
-        pos.text = " ".join(positions)
-        
-        tech = subx(source, 'technique_common')
-        accessor = subx(tech, 'accessor', source='#'+mid+'-mesh-positions-array',
-                            stride='3', count=str(int(len(positions)/3)))
-        subx(accessor, 'param', name='X', type='float') 
-        subx(accessor, 'param', name='Y', type='float') 
-        subx(accessor, 'param', name='Z', type='float') 
-    
         welded_normals = None
         if adjusted_normals and mesh.name in adjusted_normals:
             welded_normals = adjusted_normals[mesh.name]
@@ -4216,92 +4034,19 @@ def exportCollada(context,
             log.warning("Export: This Blender release does not support Custom Normals.")
 
         polylists, normals, uv_array = create_polylists(mesh_data_copy, welded_normals, progress)
-        
-        #
-
-        #
-        
-        normals_array = []        
-        for n in normals:
-            normals_array.append("%g"%n[0])
-            normals_array.append("%g"%n[1])
-            normals_array.append("%g  "%n[2])
-                        
-        source = subx(mx, 'source', id=mid+'-mesh-normals') 
-        pos = subx(source, 'float_array', id=mid+'-mesh-normals-array',
-                            count=str(len(normals_array))) 
-        pos.text = " ".join(normals_array)
-            
-        tech = subx(source, 'technique_common')
-        accessor = subx(tech, 'accessor', source='#'+mid+'-mesh-normals-array',
-                            stride='3', count=str(int(len(normals_array)/3)))
-        subx(accessor, 'param', name='X', type='float') 
-        subx(accessor, 'param', name='Y', type='float') 
-        subx(accessor, 'param', name='Z', type='float') 
-            
-        #
-
-        #
+        MESH['polylists'] = polylists
+        MESH['normals']   = normals
+        MESH['uv_array']  = uv_array
 
+        uv_semantic = None
         if len(uv_array) > 0:
-            source = subx(mx, 'source', id=mid+'-mesh-map-0') 
-            pos = subx(source, 'float_array', id=mid+'-mesh-map-0-array',
-                                count=str(len(uv_array))) 
-            pos.text = " ".join(uv_array)
-                
-            tech = subx(source, 'technique_common')
-            accessor = subx(tech, 'accessor', source='#'+mid+'-mesh-map-0-array',
-                                stride='2', count=str(int(len(uv_array)/2)))
-            subx(accessor, 'param', name='S', type='float') 
-            subx(accessor, 'param', name='T', type='float') 
-        
-        #
-
-        #
-        vert = subx(mx, 'vertices', id=mid+'-mesh-vertices')
-        subx(vert, 'input', semantic='POSITION', source='#'+mid+'-mesh-positions')
-
-        for mat_index in polylists:
-            vcount = polylists[mat_index][0]
-            ps     = polylists[mat_index][1]
-            lc     = polylists[mat_index][2]
             try:
-                material = mesh.data.materials[mat_index]
-                collada_material = colladaKey(material.name+"-material")
+                uv_semantic = mesh.data.uv_layers.active.name
             except:
-                material = None
-            
-            face_count = util.get_tri_count(len(vcount), lc)
-            if material is not None:
-                mat_name = material.name
-                polylist = subx(mx, 'polylist', count=str(face_count), material=collada_material)
-            else:
-                mat_name = "Default Material"
-                polylist = subx(mx, 'polylist', count=str(face_count))
-
-            prefs=util.getAddonPreferences()
-            if 0 < prefs.maxFacePerMaterial < face_count:
-                msg = "%s : High Tricount %d in material face [%s]" % (mesh.name, face_count, mat_name)
-                complexity_warnings.append(msg)
-                print("Warning: %s" % msg )
-                
-            subx(polylist, 'input', source='#'+mid+'-mesh-vertices', 
-                                    semantic='VERTEX', offset='0') 
-            subx(polylist, 'input', source='#'+mid+'-mesh-normals', 
-                                    semantic='NORMAL', offset='1') 
-
-            if len(uv_array) > 0:
-                subx(polylist, 'input', source='#'+mid+'-mesh-map-0', 
-                                        semantic='TEXCOORD', offset='2', set='0') 
-            subx(polylist, 'vcount', text=' '.join(vcount))
-            subx(polylist, 'p', text=' '.join(ps))
-           
-        extra = subx(geo, 'extra')
-        tech = subx(extra, 'technique', profile='MAYA')
-        subx(tech, 'double_sided', text='1')
-           
-        node = subx(visual_scene, 'node', id=mid, name=mid, type='NODE')
-        
+
+                uv_semantic = mesh.data.uv_textures.active.name
+        MESH['uv_semantic'] = uv_semantic
+
         #
 
         #
@@ -4309,24 +4054,9 @@ def exportCollada(context,
         arm = util.getArmature(mesh)
         if arm is not None:
             context.scene.objects.active=arm
-            aid = colladaKey(arm.name)
-            controler = subx(libcon, 'controller', name=aid, id=aid+"_"+mid+'-skin')
-            skin = subx(controler, 'skin', source='#'+mid+'-mesh')  
-            
-            #
-
-            #
-
             bsm = rig.calculate_bind_shape_matrix(arm, mesh, with_rot=with_rot)
-            bsm = " ".join(["%g"%round(bsm[ii][jj],6) for ii in range(4) for jj in range(4)]) 
-            subx(skin, 'bind_shape_matrix', text=bsm)
-            
-            #
 
-            #
-            source = subx(skin, 'source', id=aid+"_"+mid+"-skin-joints") 
             dbones = [g.name for g in mesh.vertex_groups]# if sceneProps.collada_only_weighted else arm.data.bones.keys()
-            
             export_bones = get_export_bone_set(arm, sceneProps, target_system, dbones)
 
             renamed_groups = []
@@ -4336,185 +4066,184 @@ def exportCollada(context,
                     renamed_groups.append(fname)
                 else:
                     renamed_groups.append(bone_name)
-            
+
             if len(export_bones) > MAX_EXPORT_BONES and sceneProps.use_export_limits:
                     msg = "The Mesh %s uses %d Bones while SL limit is %d Bones per Mesh." % (mesh.name, len(export_bones), MAX_EXPORT_BONES)
-                    complexity_warnings.append(msg)
-            
-            subx(source, 'Name_array', id=aid+"_"+mid+'-skin-joints-array',
-                                    count=str(len(export_bones)), 
-                                    text = get_bind_joint_array(renamed_groups, 10))
-            tech = subx(source, 'technique_common')
-            accessor = subx(tech, 'accessor', 
-                                source='#'+aid+'_'+mid+'-skin-joints-array',
-                                stride='1',
-                                count=str(len(export_bones)))
-            subx(accessor, 'param', name='JOINT', type='name') 
-            
-            #
+                    MESH['warnings'].append(msg)
 
-            #
-            source = subx(skin, 'source', id=aid+"_"+mid+"-skin-bind_poses") 
-            poses = []
+            bind_poses = []
             rig.reset_cache(arm)
-            counter = 0
             ohide = arm.hide
             arm.hide=False
             omode = util.ensure_mode_is('POSE', context=context)
             log_export.debug("Export inverse bind pose matrix (use bind pose)")
 
             for bone_name in export_bones:
-                counter += 1
                 dbone = arm.data.bones[bone_name]
                 Minv = rig.calculate_inverse_bind_matrix(arm, dbone, applyScale, with_sl_rot=with_rot, use_bind_pose=use_bind_pose)
-                mat  = rig.matrixToStringArray(Minv, 6)
-                if not (counter % 10):
-                    mat[-1] = mat[-1]+"\n\n\n"
-                poses.extend(mat)
+                bind_poses.append([tuple(row) for row in Minv])
             util.ensure_mode_is(omode, context=context)
             arm.hide = ohide
 
-            subx(source, 'float_array', id=aid+"_"+mid+'-skin-bind_poses-array',
-                                        count=str(len(poses)),
-                                        text = "\n"+" ".join(poses))
-            tech = subx(source, 'technique_common')
-            accessor = subx(tech, 'accessor', 
-                                source='#'+aid+'_'+mid+'-skin-bind_poses-array',
-                                stride='16',
-                                count=str(int(len(poses)/16)))
-            subx(accessor, 'param', name='TRANSFORM', type='float4x4') 
-                
-            #
-
-            #
-            ws = []
-            vcount = []
-            vs = []
-            source = subx(skin, 'source', id=aid+"_"+mid+"-skin-weights")
-            truncated_vcount = 0
-            zero_weight_count = 0
-            vcounter = 0            
-            for v in mesh_data_copy.vertices:
-                vcounter += 1
-                if vcounter % 1000 == 0:
-                    progress += 1
-                    util.progress_update(progress)         
-            
-                weights = []
-                for g in v.groups:
+            W = util.WeightMatrix(mesh, mesh_data_copy)
+            ws, vcount, vs, truncated, zero_weight_count = get_skin_weights(W, mesh, arm, export_bones, target_system, max_weight_per_vertex)
 
-                    bonename = const.get_export_bonename(mesh.vertex_groups, g.group, target_system)
-                    if bonename and bonename in arm.data.bones:
-                        b = arm.data.bones[bonename]
-                        if b.use_deform:
+            truncated_vcount = len(truncated)
+            for count in truncated[:10]:
+                logging.warn(_("found vertex with %d deform weights in %s. Truncating to %d."%(count, mesh.name, max_weight_per_vertex)))
 
-                            gidx = export_bones.index(bonename)
-                            weights.append([g.weight, gidx])
-                            
-                weights.sort(key=lambda x: x[0], reverse=True)
-                
-                if max_weight_per_vertex > 0 and len(weights)>max_weight_per_vertex:
-                    if truncated_vcount < 10:
-                        logging.warn(_("found vertex with %d deform weights in %s. Truncating to %d."%(len(weights), mesh.name, max_weight_per_vertex)))
-                    weights = weights[:max_weight_per_vertex]
-                    truncated_vcount += 1 
-                
-                tot = 0
-                for w,g in weights:
-                    tot+=w
-                if tot > 0:
-                    for wg in weights:
-                        wg[0]=wg[0]/float(tot)
-                else:
-                    zero_weight_count += 1                    
-                    
-                for weight,group in weights:
-                    widx = len(ws)
-                    ws.append("%g"%weight)
-                    vs.append(str(group)) 
-                    vs.append(str(widx)+" ")
-                vs.append(" ")
-                vcount.append(str(len(weights)))
-                
             if zero_weight_count > 0:
                logging.warn(_("Found %d zero weighted vertices in %s"%(zero_weight_count, mesh.name)))
                
             if truncated_vcount > 10:
                logging.warn(_("Truncated %d more Vertices to a weight count of 4 in %s"%(truncated_vcount - 10, mesh.name)))
-                
-            subx(source, 'float_array', id=aid+"_"+mid+'-skin-weights-array',
-                                        count=str(len(ws)),
-                                        text = " ".join(ws))
-            tech = subx(source, 'technique_common')
-            accessor = subx(tech, 'accessor', 
-                                source='#'+aid+'_'+mid+'-skin-weights-array',
-                                stride='1',
-                                count=str(len(ws)))
-            subx(accessor, 'param', name='WEIGHT', type='float') 
-            joints = subx(skin, 'joints')
-            subx(joints, 'input', semantic='JOINT', source='#'+aid+'_'+mid+'-skin-joints')
-            subx(joints, 'input', semantic='INV_BIND_MATRIX', 
-                                source='#'+aid+'_'+mid+'-skin-bind_poses')
-            vweights = subx(skin, 'vertex_weights', count=str(len(vcount)))
-            subx(vweights, 'input', semantic='JOINT',
-                                    source='#'+aid+'_'+mid+'-skin-joints',
-                                    offset='0') 
-            subx(vweights, 'input', semantic='WEIGHT',
-                                    source='#'+aid+'_'+mid+'-skin-weights',
-                                    offset='1') 
-            subx(vweights, 'vcount', text=" ".join(vcount))
-            subx(vweights, 'v', text=" ".join(vs))
-            
-            #
 
-            #
-            subx(node, 'translate', sid='location', text='0 0 0')   
-            subx(node, 'rotate', sid='rotationZ', text='0 0 1 0')   
-            subx(node, 'rotate', sid='rotationY', text='0 1 0 0')   
-            subx(node, 'rotate', sid='rotationX', text='1 0 0 0')   
-            subx(node, 'scale', sid='scale', text='1 1 1')   
-   
-            con = subx(node, 'instance_controller', url='#'+aid+'_'+mid+'-skin')   
-            
             if arm in armatures:
                 rootnames = arm_roots.get(arm.name,None)
                 if rootnames:
-                    for rootname in rootnames:
-                        subx(con, 'skeleton', text= "#%s" % rootname) 
+                    skeletons = ["#%s" % rootname for rootname in rootnames]
                 else:
-                    subx(con, 'skeleton', text='#mPelvis')
-
+                    skeletons = ['#mPelvis']
             else:
 
-                subx(con, 'skeleton', text='#Origin') 
-                
-            if len(mesh.data.materials) > 0:
-                bind = subx(con, "bind_material")
-                tech = subx(bind, "technique_common")
-                add_material_list(tech, mesh, len(uv_array) )
+                skeletons = ['#Origin']
 
+            MESH['skin'] = {'aid'              : colladaKey(arm.name),
+                            'bind_shape_matrix': [bsm[ii][jj] for ii in range(4) for jj in range(4)],
+                            'joints'           : renamed_groups,
+                            'bind_poses'       : bind_poses,
+                            'weights'          : ws,
+                            'vcount'           : vcount,
+                            'v'                : vs,
+                            'skeletons'        : skeletons}
         else:
+            MESH['skin']         = None
+            MESH['location']     = tuple(mesh.location)
+            MESH['matrix_world'] = [tuple(v) for v in mesh.matrix_world]
+            MESH['apply_mesh_rotscale'] = apply_mesh_rotscale
 
-            loc = '%g %g %g'%tuple(mesh.location)
-            subx(node, 'translate', sid='location', text=loc)
+        bpy.data.meshes.remove(mesh_data_copy)
+        return MESH
 
-            if apply_mesh_rotscale:
-                subx(node, 'rotate', sid='rotationZ', text='0 0 1 0')
-                subx(node, 'rotate', sid='rotationY', text='0 1 0 0')
-                subx(node, 'rotate', sid='rotationX', text='1 0 0 0')
-                subx(node, 'scale', sid='scale', text='1 1 1')
-            else:
-                mat = ["%f %f %f %f"% (v[0], v[1], v[2], v[3]) for v in mesh.matrix_world]
-                subx(node, 'matrix', sid='transform', text=" ".join(mat))
+    created_materials = {}
+    prefs = util.getAddonPreferences()
 
-            con = subx(node, 'instance_geometry', url='#'+mid+'-mesh')   
+    with ColladaExportPipeline(libgeo, libcon, visual_scene, complexity_warnings) as pipeline:
+        for index, obj_name in (enumerated_objects):
+            mesh = selected_objects[index]
 
-            if len(mesh.data.materials) > 0:
-                bind = subx(con, "bind_material")
-                tech = subx(bind, "technique_common")
-                add_material_list(tech, mesh, len(uv_array) )
+            progress += 100
+            util.progress_update(progress)
 
-        bpy.data.meshes.remove(mesh_data_copy)
+            try:
+                assert ( obj_name == mesh.name )
+            except:
+                logging.error("Error in ordering the selection by object name.")
+
+            #
+
+            #
+
+            for midx, mat in enumerate(mesh.data.materials):
+                if mat is None:
+
+                    continue
+            
+                material_name = colladaKey(mat.name)
+        
+                if created_materials.get(material_name) is not None:
+                    continue
+                created_materials[material_name]=material_name
+        
+                effect_id     = material_name+"-effect"
+                material_id   = material_name+"-material"
+        
+                effect = subx(libeffects, "effect", id=effect_id)
+                prof = subx(effect, "profile_COMMON")
+        
+                images = get_images_for_material(mat_images, mat)
+                if len(images) > 0:
+                    image=images[0]
+                    if len(images) > 1:
+                        print("%d images assigned to material %s, take only %s" % (len(images), material_name, image.name))
+                else:
+                    image = None
+            
+                if image is not None:
+                    collada_name = colladaKey(image.name)
+
+                    newparam = subx(prof, "newparam", sid=collada_name+'-surface')
+                    surface = subx(newparam, "surface", type="2D")
+                    initfrom = subx(surface, "init_from", text=collada_name)
+       
+                    newparam = subx(prof, "newparam", sid=collada_name+'-sampler')
+                    sampler2d = subx(newparam, "sampler2D")
+                    source = subx(sampler2d, "source", text=collada_name+"-surface")
+        
+                tech = subx(prof, "technique", sid="common")
+                phong = subx(tech, "phong")
+        
+                wrap = subx(phong, "emission")
+                e = mat.emit
+                col = subx(wrap, "color", sid="emission", text="%g %g %g 1"%(e,e,e))
+       
+                wrap = subx(phong, "ambient")
+                col = subx(wrap, "color", sid="ambient", text="0 0 0 1")
+        
+                wrap = subx(phong, "diffuse")
+                if image is not None:
+                    semantic = mesh.data.uv_layers.active.name
+                    texture = subx(wrap, "texture", texture=collada_name+'-sampler', texcoord=semantic)
+                else:
+                    i = mat.diffuse_intensity
+                    c = ["%g"%(j*i) for j in mat.diffuse_color]
+
+                    if mat.use_transparency:
+                        c.append("%g"%mat.alpha) 
+                    else:
+                        c.append("1") 
+                    col = subx(wrap, "color", sid="diffuse", text=" ".join(c))
+        
+                wrap = subx(phong, "specular")
+                i = mat.specular_intensity
+                c = ["%g"%(j*i) for j in mat.specular_color]
+                if mat.use_transparency:
+                    c.append("%g"%mat.specular_alpha)
+                else:
+                    c.append("1")
+                col = subx(wrap, "color", sid="specular", text=" ".join(c))
+        
+                wrap = subx(phong, "shininess")
+                col = subx(wrap, "float", sid="shininess", text="%g"%mat.specular_hardness)
+       
+                if mat.raytrace_mirror.use:
+                    wrap = subx(phong, "reflective")
+                    c = ["%g"%j for j in mat.mirror_color]
+                    c.append("1")
+                    col = subx(wrap, "color", sid="reflective", text=" ".join(c))
+            
+                    wrap = subx(phong, "reflectivity")
+                    col = subx(wrap, "float", sid="reflectivity", text="%g"%mat.raytrace_mirror.reflect_factor)
+        
+                if mat.use_transparency:
+                    wrap = subx(phong, "transparency")
+                    col = subx(wrap, "float", sid="transparency", text="%g"%mat.alpha)
+        
+                wrap = subx(phong, "index_of_refraction")
+                col = subx(wrap, "float", sid="index_of_refraction", text="1.0")
+        
+                material = subx(libmaterials, "material", id=material_id, name=mat.name)
+                subx(material, "instance_effect", url="#"+effect_id)
+
+            t0 = time.time()
+            MESH = extract_collada_mesh(mesh)
+            if MESH['skin']:
+                progress += int(MESH['vcount']/1000)
+                util.progress_update(progress)
+            pipeline.submit(MESH, time.time() - t0)
+
+    for line in pipeline.report():
+        log_export.info("Exported mesh %s" % line)
 
     scene = subx(root, 'scene')
     subx(scene, 'instance_visual_scene', url='#Scene')
@@ -4523,7 +4252,7 @@ def exportCollada(context,
 
     status = False
     try:
-        xml.write(path, xml_declaration=True, encoding="utf-8")
+        write_collada(root, path)
         logging.info(_("Exported to: %s"), path)
         status = True
     except Exception as e:
@@ -4537,6 +4266,474 @@ def exportCollada(context,
         
     return status, len(enumerated_objects), complexity_warnings
 
+class ColladaArray:
+    '''
+    Text content of a large Collada array element (float_array, p, v, ...)
+    The values are kept unformatted until write_collada() streams
+    them into the file chunk by chunk.
+    '''
+
+    def __init__(self, values, fmt="%g", precision=None):
+        self.values    = values
+        self.fmt       = fmt
+        self.precision = precision
+        self.count     = len(values)
+        self.encoded   = None
+
+    def __len__(self):
+        return self.count
+
+    def encode(self):
+        '''
+        Format the values now (in a worker process of the Collada
+        export). The formatted text replaces the values, chunks()
+        then returns it.
+        '''
+        self.encoded = list(self.format_chunks())
+        self.values  = None
+
+    def chunks(self, size=COLLADA_CHUNK_SIZE):
+        if self.encoded is not None:
+            return iter(self.encoded)
+        return self.format_chunks(size)
+
+    def format_chunks(self, size=COLLADA_CHUNK_SIZE):
+        fmt = self.fmt
+        precision = self.precision
+        for start in range(0, len(self.values), size):
+            part = self.values[start:start+size]
+            if hasattr(part, 'tolist'):
+                part = part.tolist()
+            if precision is not None:
+                part = [round(v, precision) for v in part]
+            text = " ".join([fmt]*len(part)) % tuple(part)
+            yield text if start == 0 else " " + text
+
+def encode_collada_mesh(MESH):
+    '''
+    Create the Collada geometry, controller (None for meshes
+    without armature) and node elements from the data extracted
+    by exportCollada. Does not use the Blender API. The arrays
+    are formatted later, when write_collada() streams them.
+    Returns (geometry, controller, node, complexity warnings)
+    '''
+
+    mid       = MESH['mid']
+    uv_array  = MESH['uv_array']
+    materials = MESH['materials']
+    warnings  = []
+
+    geo = et.Element('geometry', attrib={'id':mid+'-mesh', 'name':MESH['name']})
+    mx = subx(geo, 'mesh')
+
+    #
+
+    #
+
+    source = subx(mx, 'source', id=mid+'-mesh-positions') 
+    positions = ColladaArray(MESH['positions'], precision=6)
+        
+    pos = subx(source, 'float_array', id=mid+'-mesh-positions-array', 
+               count=str(len(positions)))
+    pos.text = positions
+    
+    tech = subx(source, 'technique_common')
+    accessor = subx(tech, 'accessor', source='#'+mid+'-mesh-positions-array',
+                        stride='3', count=str(int(len(positions)/3)))
+    subx(accessor, 'param', name='X', type='float') 
+    subx(accessor, 'param', name='Y', type='float') 
+    subx(accessor, 'param', name='Z', type='float') 
+
+    #
+
+    #
+
+    normals_array = ColladaArray(np.array(MESH['normals'], dtype=np.float64).reshape(-1))
+                    
+    source = subx(mx, 'source', id=mid+'-mesh-normals') 
+    pos = subx(source, 'float_array', id=mid+'-mesh-normals-array',
+                        count=str(len(normals_array))) 
+    pos.text = normals_array
+        
+    tech = subx(source, 'technique_common')
+    accessor = subx(tech, 'accessor', source='#'+mid+'-mesh-normals-array',
+                        stride='3', count=str(int(len(normals_array)/3)))
+    subx(accessor, 'param', name='X', type='float') 
+    subx(accessor, 'param', name='Y', type='float') 
+    subx(accessor, 'param', name='Z', type='float') 
+        
+    #
+
+    #
+
+    if len(uv_array) > 0:
+        source = subx(mx, 'source', id=mid+'-mesh-map-0') 
+        pos = subx(source, 'float_array', id=mid+'-mesh-map-0-array',
+                            count=str(len(uv_array))) 
+        pos.text = ColladaArray(uv_array, precision=6)
+            
+        tech = subx(source, 'technique_common')
+        accessor = subx(tech, 'accessor', source='#'+mid+'-mesh-map-0-array',
+                            stride='2', count=str(int(len(uv_array)/2)))
+        subx(accessor, 'param', name='S', type='float') 
+        subx(accessor, 'param', name='T', type='float') 
+    
+    #
+
+    #
+    vert = subx(mx, 'vertices', id=mid+'-mesh-vertices')
+    subx(vert, 'input', semantic='POSITION', source='#'+mid+'-mesh-positions')
+
+    polylists = MESH['polylists']
+    for mat_index in polylists:
+        vcount = polylists[mat_index][0]
+        ps     = polylists[mat_index][1]
+        lc     = polylists[mat_index][2]
+        mat_name = materials[mat_index] if mat_index < len(materials) else None
+        
+        face_count = util.get_tri_count(len(vcount), lc)
+        if mat_name is not None:
+            collada_material = colladaKey(mat_name+"-material")
+            polylist = subx(mx, 'polylist', count=str(face_count), material=collada_material)
+        else:
+            mat_name = "Default Material"
+            polylist = subx(mx, 'polylist', count=str(face_count))
+
+        if 0 < MESH['max_faces'] < face_count:
+            msg = "%s : High Tricount %d in material face [%s]" % (MESH['name'], face_count, mat_name)
+            warnings.append(msg)
+            print("Warning: %s" % msg )
+            
+        subx(polylist, 'input', source='#'+mid+'-mesh-vertices', 
+                                semantic='VERTEX', offset='0') 
+        subx(polylist, 'input', source='#'+mid+'-mesh-normals', 
+                                semantic='NORMAL', offset='1') 
+
+        if len(uv_array) > 0:
+            subx(polylist, 'input', source='#'+mid+'-mesh-map-0', 
+                                    semantic='TEXCOORD', offset='2', set='0') 
+        subx(polylist, 'vcount', text=ColladaArray(vcount, fmt="%d"))
+        subx(polylist, 'p', text=ColladaArray(ps, fmt="%d"))
+       
+    extra = subx(geo, 'extra')
+    tech = subx(extra, 'technique', profile='MAYA')
+    subx(tech, 'double_sided', text='1')
+       
+    node = et.Element('node', attrib={'id':mid, 'name':mid, 'type':'NODE'})
+    controler = None
+    skin = MESH['skin']
+
+    #
+
+    #
+
+    if skin is not None:
+        aid = skin['aid']
+        controler = et.Element('controller', attrib={'name':aid, 'id':aid+"_"+mid+'-skin'})
+        skinx = subx(controler, 'skin', source='#'+mid+'-mesh')  
+
+        bsm = " ".join(["%g"%round(v,6) for v in skin['bind_shape_matrix']]) 
+        subx(skinx, 'bind_shape_matrix', text=bsm)
+        
+        #
+
+        #
+        joints = skin['joints']
+        source = subx(skinx, 'source', id=aid+"_"+mid+"-skin-joints") 
+        subx(source, 'Name_array', id=aid+"_"+mid+'-skin-joints-array',
+                                count=str(len(joints)), 
+                                text = get_bind_joint_array(joints, 10))
+        tech = subx(source, 'technique_common')
+        accessor = subx(tech, 'accessor', 
+                            source='#'+aid+'_'+mid+'-skin-joints-array',
+                            stride='1',
+                            count=str(len(joints)))
+        subx(accessor, 'param', name='JOINT', type='name') 
+        
+        #
+
+        #
+        source = subx(skinx, 'source', id=aid+"_"+mid+"-skin-bind_poses") 
+        poses = []
+        for counter, Minv in enumerate(skin['bind_poses'], 1):
+            mat  = rig.matrixToStringArray(Minv, 6)
+            if not (counter % 10):
+                mat[-1] = mat[-1]+"\n\n\n"
+            poses.extend(mat)
+
+        subx(source, 'float_array', id=aid+"_"+mid+'-skin-bind_poses-array',
+                                    count=str(len(poses)),
+                                    text = "\n"+" ".join(poses))
+        tech = subx(source, 'technique_common')
+        accessor = subx(tech, 'accessor', 
+                            source='#'+aid+'_'+mid+'-skin-bind_poses-array',
+                            stride='16',
+                            count=str(int(len(poses)/16)))
+        subx(accessor, 'param', name='TRANSFORM', type='float4x4') 
+            
+        #
+
+        #
+        ws = skin['weights']
+        source = subx(skinx, 'source', id=aid+"_"+mid+"-skin-weights")
+        subx(source, 'float_array', id=aid+"_"+mid+'-skin-weights-array',
+                                    count=str(len(ws)),
+                                    text = ColladaArray(ws))
+        tech = subx(source, 'technique_common')
+        accessor = subx(tech, 'accessor', 
+                            source='#'+aid+'_'+mid+'-skin-weights-array',
+                            stride='1',
+                            count=str(len(ws)))
+        subx(accessor, 'param', name='WEIGHT', type='float') 
+        jointsx = subx(skinx, 'joints')
+        subx(jointsx, 'input', semantic='JOINT', source='#'+aid+'_'+mid+'-skin-joints')
+        subx(jointsx, 'input', semantic='INV_BIND_MATRIX', 
+                            source='#'+aid+'_'+mid+'-skin-bind_poses')
+        vweights = subx(skinx, 'vertex_weights', count=str(len(skin['vcount'])))
+        subx(vweights, 'input', semantic='JOINT',
+                                source='#'+aid+'_'+mid+'-skin-joints',
+                                offset='0') 
+        subx(vweights, 'input', semantic='WEIGHT',
+                                source='#'+aid+'_'+mid+'-skin-weights',
+                                offset='1') 
+        subx(vweights, 'vcount', text=ColladaArray(skin['vcount'], fmt="%d"))
+        subx(vweights, 'v', text=ColladaArray(skin['v'], fmt="%d"))
+        
+        #
+
+        #
+        subx(node, 'translate', sid='location', text='0 0 0')   
+        subx(node, 'rotate', sid='rotationZ', text='0 0 1 0')   
+        subx(node, 'rotate', sid='rotationY', text='0 1 0 0')   
+        subx(node, 'rotate', sid='rotationX', text='1 0 0 0')   
+        subx(node, 'scale', sid='scale', text='1 1 1')   
+
+        con = subx(node, 'instance_controller', url='#'+aid+'_'+mid+'-skin')   
+        for skeleton in skin['skeletons']:
+            subx(con, 'skeleton', text=skeleton) 
+
+    else:
+
+        loc = '%g %g %g'%MESH['location']
+        subx(node, 'translate', sid='location', text=loc)
+
+        if MESH['apply_mesh_rotscale']:
+            subx(node, 'rotate', sid='rotationZ', text='0 0 1 0')
+            subx(node, 'rotate', sid='rotationY', text='0 1 0 0')
+            subx(node, 'rotate', sid='rotationX', text='1 0 0 0')
+            subx(node, 'scale', sid='scale', text='1 1 1')
+        else:
+            mat = ["%f %f %f %f"% (v[0], v[1], v[2], v[3]) for v in MESH['matrix_world']]
+            subx(node, 'matrix', sid='transform', text=" ".join(mat))
+
+        con = subx(node, 'instance_geometry', url='#'+mid+'-mesh')   
+
+    if len(materials) > 0:
+        bind = subx(con, "bind_material")
+        tech = subx(bind, "technique_common")
+        add_material_list(tech, materials, MESH['uv_semantic'])
+
+    return geo, controler, node, warnings + MESH['warnings']
+
+def encode_collada_mesh_formatted(MESH):
+    '''
+    Worker process entry of the ColladaExportPipeline. Like
+    encode_collada_mesh, but the arrays are formatted right away.
+    Returns (fragments, encode time)
+    '''
+
+    t0 = time.time()
+    fragments = encode_collada_mesh(MESH)
+    for fragment in fragments[:3]:
+        if fragment is None:
+            continue
+        for elem in fragment.iter():
+            if isinstance(elem.text, ColladaArray):
+                elem.text.encode()
+    return fragments, time.time() - t0
+
+class ColladaExportPipeline:
+    '''
+    Encoding of the exported meshes. The caller extracts the mesh data
+    in the main thread (see submit) while a pool of worker processes
+    builds the Collada elements and formats their arrays (see
+    encode_collada_mesh_formatted). The elements are added to the
+    document in the order of submission, so the output does not depend
+    on the scheduling.
+    The pool needs forked processes (Blender can not be spawned as a
+    plain Python interpreter). Where this is not available, or the pool
+    breaks, the meshes are encoded in the main thread and their arrays
+    are formatted when the file is written.
+    Use as context manager; on exit all pending meshes are added.
+    '''
+
+    def __init__(self, libgeo, libcon, visual_scene, warnings, workers=COLLADA_EXPORT_WORKERS):
+        self.libgeo = libgeo
+        self.libcon = libcon
+        self.visual_scene = visual_scene
+        self.warnings = warnings
+        self.workers = workers
+        self.pool = None
+        self.pending = []
+        self.results = []
+
+    def __enter__(self):
+        if self.workers > 1 and multiprocessing.get_start_method() == 'fork':
+            try:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            except (OSError, NotImplementedError) as e:
+                log_export.warning("Can not start the Collada encoder processes: %s" % e)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            while self.pending:
+                self.collect()
+        finally:
+            self.shutdown()
+        return False
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+    def stop_pool(self, reason):
+        if self.pool is not None:
+            log_export.warning("Collada encoder processes failed, encode in the main thread: %s" % reason)
+            self.shutdown()
+
+    def submit(self, MESH, extract_time):
+        '''
+        Queue the extracted mesh data for encoding. Blocks when too many
+        meshes are waiting, to keep the memory use bounded.
+        '''
+
+        while len(self.pending) >= 2*self.workers:
+            self.collect()
+
+        future = None
+        if self.pool is not None:
+            try:
+                future = self.pool.submit(encode_collada_mesh_formatted, MESH)
+            except (BrokenProcessPool, RuntimeError) as e:
+                self.stop_pool(e)
+        self.pending.append((MESH, extract_time, future))
+
+    def collect(self):
+        MESH, extract_time, future = self.pending.pop(0)
+        result = None
+        if future is not None:
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                self.stop_pool(e)
+        if result is None:
+            t0 = time.time()
+            result = encode_collada_mesh(MESH), time.time() - t0
+
+        (geo, controler, node, warnings), encode_time = result
+        self.libgeo.append(geo)
+        if controler is not None:
+            self.libcon.append(controler)
+        self.visual_scene.append(node)
+        self.warnings.extend(warnings)
+        self.results.append({'mesh':MESH['name'], 'extract_time':extract_time, 'encode_time':encode_time})
+
+    def report(self):
+        '''
+        Return one report line per exported mesh
+        '''
+
+        return ["%s: extracted %.2f sec, encoded %.2f sec" %
+                (r['mesh'], r['extract_time'], r['encode_time']) for r in self.results]
+
+def get_skin_weights(W, mesh, arm, export_bones, target_system, max_weight_per_vertex):
+    '''
+    Encode the weights of the WeightMatrix W for the Collada skin.
+    Per vertex the deforming weights are sorted by decreasing weight,
+    truncated to max_weight_per_vertex (when > 0) and normalized.
+    Returns (weights, vcount, v, deform weight counts of the truncated
+    vertices, number of vertices without weight)
+    '''
+
+    bones = arm.data.bones
+    joints = np.full(len(W.group_names)+1, -1, dtype=np.int32)
+    for group in np.unique(W.groups).tolist():
+        if group >= len(W.group_names):
+            continue
+        bonename = const.get_export_bonename(mesh.vertex_groups, group, target_system)
+        if bonename and bonename in bones and bones[bonename].use_deform:
+            joints[group] = export_bones.index(bonename)
+
+    gidx = joints[np.minimum(W.groups, len(W.group_names))]
+    valid = gidx > -1
+    rows = W.rows[valid]
+    weights = W.weights[valid].astype(np.float64)
+    gidx = gidx[valid]
+
+    order = np.lexsort((-weights, rows))
+    rows, weights, gidx = rows[order], weights[order], gidx[order]
+
+    counts = np.bincount(rows, minlength=W.vcount)
+    truncated = []
+    if max_weight_per_vertex > 0:
+        truncated = counts[counts > max_weight_per_vertex].tolist()
+        rank = np.arange(len(rows)) - (np.cumsum(counts) - counts)[rows]
+        keep = rank < max_weight_per_vertex
+        rows, weights, gidx = rows[keep], weights[keep], gidx[keep]
+
+    tot = np.bincount(rows, weights=weights, minlength=W.vcount)
+    positive = tot > 0
+    normalize = positive[rows]
+    weights[normalize] /= tot[rows[normalize]]
+
+    vcount = np.bincount(rows, minlength=W.vcount)
+    vs = np.empty(2*len(weights), dtype=np.int64)
+    vs[0::2] = gidx
+    vs[1::2] = np.arange(len(weights))
+
+    return weights, vcount, vs, truncated, int(np.count_nonzero(~positive))
+
+XML_ATTRIBUTE_ENTITIES = {'"':"&quot;", "\n":"&#10;", "\t":"&#09;"}
+XML_SORTED_ATTRIBUTES  = sys.version_info < (3, 8) # Same attribute order as ElementTree.write()
+
+def write_collada(root, path):
+    '''
+    Write the Collada document to path. The output is the same
+    as from ElementTree.write(), but ColladaArray texts are
+    formatted and written in chunks instead of being joined
+    into one string per array.
+    '''
+    with open(path, "w", encoding="utf-8", errors="xmlcharrefreplace") as file:
+        file.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        write_element(file.write, root)
+
+def write_element(write, elem):
+    write("<" + elem.tag)
+    items = elem.items()
+    if XML_SORTED_ATTRIBUTES:
+        items = sorted(items)
+    for key, value in items:
+        write(' %s="%s"' % (key, escape(value, XML_ATTRIBUTE_ENTITIES)))
+
+    text = elem.text
+    if text or len(elem):
+        write(">")
+        if isinstance(text, ColladaArray):
+            for chunk in text.chunks():
+                write(chunk)
+        elif text:
+            write(escape(text))
+        for e in elem:
+            write_element(write, e)
+        write("</" + elem.tag + ">")
+    else:
+        write(" />")
+
+    if elem.tail:
+        write(escape(elem.tail))
+
 def subx(parent, tag, **attrib):
 
     attrib2 = {}
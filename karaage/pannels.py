@@ -35,6 +35,8 @@
 import bpy, bmesh, sys
 import logging, gettext, os, time, re, shutil
 import addon_utils
+import numpy as np
+from bpy.app.handlers import persistent
 
 from . import animation, const, copyrig, create, data, mesh, messages, rig, shape, util, weights
 from .const import *
@@ -1482,71 +1484,169 @@ class ArmatureInfo(bpy.types.Panel):
             row.label(text="", icon="FILE_TICK")
             row.label("%d Animated Bones" % bone_count)
             
-MIN_MESH_INFO_DELAY = 0.5
+MIN_MESH_INFO_DELAY = 0.5  # Minimal age of mesh info before it is recalculated
+MAX_MESH_INFO_TIME  = 0.05 # Time budget per scene update for recalculating mesh info
 MIN_SIZE  = 2
 
-nvertices = 0
-nvnormals = 0
-nfaces    = 0
-nmat      = 0
-ntris     = 0
-nuvs      = 0
+#
+# Mesh Info statistics are cached per object and mesh datablock.
+# The panel only requests and reads them. The meshes are evaluated
+# in update_mesh_info_on_update() whenever the update counter of
+# a requested object has changed (see is_updated, is_updated_data)
+#
+mesh_info_cache     = {}    # key -> (revision, timestamp, MeshInfo)
+mesh_info_revisions = {}    # key -> update counter
+mesh_info_requests  = set() # Names of the objects displayed in the panel
+mesh_info_totals    = (None, None) # (signature, MeshInfoTotals) of the displayed objects
 
-maxtris   = 0
+def mesh_info_key(ob):
+    return (ob.name, ob.data.as_pointer())
 
-radius     = 0
-nvc_lowest = 0
-nvc_low    = 0
-nvc_mid    = 0
-nvc_high   = 0
+class MeshInfo:
+    '''
+    Statistics of one evaluated mesh object
+    '''
 
-nwc_effective = []
-nwc_discarded = []
+    def __init__(self, scene, meshobj):
+        me = meshobj.to_mesh(scene, True, 'PREVIEW')
+        try:
+            polygon_count = len(me.polygons)
+            loop_totals   = np.empty(polygon_count, dtype=np.int32)
+            smooth        = np.empty(polygon_count, dtype=bool)
+            me.polygons.foreach_get('loop_total', loop_totals)
+            me.polygons.foreach_get('use_smooth', smooth)
+
+            self.vertices = len(me.vertices)
+            self.faces    = polygon_count
+            self.normals  = max(int(loop_totals[~smooth].sum()), self.vertices)
+            self.uvs      = util.get_uv_vert_count(me) if me.uv_layers.active else None
+            self.tris     = util.get_tri_count(polygon_count, len(me.loops))
+        finally:
+            bpy.data.meshes.remove(me)
+
+        self.materials, warns = util.get_highest_materialcount([meshobj])
+        self.split_materials  = int(self.tris / 21844)
+        self.lods = util.get_approximate_lods(meshobj, self.vertices, self.normals, self.uvs or 0, self.tris)
+
+class MeshInfoTotals:
+    '''
+    Mesh Info statistics summed up over the displayed objects
+    '''
 
-last_object = None
-last_mode = None
-last_timestamp = time.time()
-no_uv_layers = 0
+    def __init__(self):
+        self.vertices     = 0
+        self.normals      = 0
+        self.faces        = 0
+        self.tris         = 0
+        self.uvs          = 0
+        self.maxtris      = 0
+        self.nmat         = 0
+        self.emat         = 0
+        self.vc_lowest    = 0
+        self.vc_low       = 0
+        self.vc_mid       = 0
+        self.vc_high      = 0
+        self.no_uv_layers = 0
+        self.pending      = 0
+
+    def add(self, info):
+        self.vertices += info.vertices
+        self.normals  += info.normals
+        self.faces    += info.faces
+        self.tris     += info.tris
+        if info.uvs is None:
+            self.no_uv_layers += 1
+        else:
+            self.uvs += info.uvs
 
-def init_mesh_info_panel(context):
+        if info.materials + info.split_materials > self.nmat:
+            self.nmat = info.materials
+            self.emat = info.split_materials
+        if info.tris > self.maxtris:
+            self.maxtris = info.tris
 
-    global last_object
-    global last_mode
-    global last_timestamp
+        radius, vc_lowest, vc_low, vc_mid, vc_high = info.lods
+        self.vc_lowest += vc_lowest
+        self.vc_low    += vc_low
+        self.vc_mid    += vc_mid
+        self.vc_high   += vc_high
 
-    ob = context.object
-    if ob == None or ob.type != 'MESH':
-        return False
-        
-    if context.object == last_object and context.mode == last_mode and time.time() - last_timestamp < MIN_MESH_INFO_DELAY:
-        return False
-        
-    global nvertices, nvnormals, nfaces, nmat, ntris, nuvs, no_uv_layers, maxtris, radius, nvc_lowest, nvc_low, nvc_mid, nvc_high
-
-    nvertices      = 0
-    nvnormals      = 0
-    nfaces         = 0
-    nmat           = 0
-    ntris          = 0
-    nuvs           = 0
-    no_uv_layers    = 0
-
-    maxtris        = 0
-
-    radius         = 0
-    nvc_lowest     = 0
-    nvc_low        = 0
-    nvc_mid        = 0
-    nvc_high       = 0
-    
-    nwc_effective = []
-    nwc_discarded = []
-    
-    last_object    = context.object
-    last_mode      = context.mode
-    last_timestamp = time.time()
+def get_mesh_info_totals(targets):
+    '''
+    Return the summed up statistics of the targets from the cache.
+    Targets without cached statistics are counted as pending and
+    get calculated by the next scene update.
+    '''
+    global mesh_info_requests, mesh_info_totals
+
+    mesh_info_requests = set(ob.name for ob in targets)
+    entries = [(mesh_info_key(ob), ob) for ob in targets]
+    signature = tuple((key, mesh_info_cache[key][1] if key in mesh_info_cache else None) for key, ob in entries)
+    if signature == mesh_info_totals[0]:
+        return mesh_info_totals[1]
+
+    totals = MeshInfoTotals()
+    for key, ob in entries:
+        entry = mesh_info_cache.get(key)
+        if entry:
+            totals.add(entry[2])
+        else:
+            totals.pending += 1
+
+    mesh_info_totals = (signature, totals)
+    return totals
+
+@persistent
+def update_mesh_info_on_update(scene):
+    if not mesh_info_requests:
+        return
+
+    stale = []
+    for name in list(mesh_info_requests):
+        ob = scene.objects.get(name)
+        if ob is None or ob.type != 'MESH':
+            mesh_info_requests.discard(name)
+            continue
+
+        key = mesh_info_key(ob)
+        revision = mesh_info_revisions.get(key, 0)
+        if ob.is_updated or ob.is_updated_data:
+            revision += 1
+            mesh_info_revisions[key] = revision
+
+        entry = mesh_info_cache.get(key)
+        if entry is None or entry[0] != revision:
+            stale.append((ob, key, revision, entry))
+
+    start = time.time()
+    updated = False
+    for ob, key, revision, entry in stale:
+        if entry and start - entry[1] < MIN_MESH_INFO_DELAY:
+            continue
 
-    return True
+        try:
+            mesh_info_cache[key] = (revision, time.time(), MeshInfo(scene, ob))
+            updated = True
+        except Exception as e:
+            log.warning("Can not calculate Mesh Info for %s (%s)" % (ob.name, e) )
+            mesh_info_requests.discard(ob.name)
+
+        if time.time() - start > MAX_MESH_INFO_TIME:
+            break
+
+    if updated:
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'VIEW_3D':
+                    area.tag_redraw()
+
+@persistent
+def reset_mesh_info_cache(dummy):
+    global mesh_info_totals
+    mesh_info_cache.clear()
+    mesh_info_revisions.clear()
+    mesh_info_requests.clear()
+    mesh_info_totals = (None, None)
 
 class PanelMeshInfo(bpy.types.Panel):
     bl_space_type  = 'VIEW_3D'
@@ -1583,91 +1683,35 @@ class PanelMeshInfo(bpy.types.Panel):
         targets          = currentSelection['targets']
         active           = currentSelection['active']
 
-        global no_uv_layers
-
         if len(targets) > 0:
-        
-            global nvertices
-            global nvnormals
-            global nfaces
-            global nmat
-            global emat
-            global ntris
-            global nuvs
-
-            global maxtris
-
-            global radius
-            global nvc_lowest
-            global nvc_low
-            global nvc_mid
-            global nvc_high
-            
-            global nwc_effective
-            global nwc_discarded
-
-            if init_mesh_info_panel(context):
-                nmat = 0
-                emat = 0
-                nwc_effective = []
-                nwc_discarded = []
-                no_uv_layers  = 0
-                
-                for meshobj in targets:
-                    arm = meshobj.find_armature()
-                    
-                    if arm and len(meshobj.vertex_groups) > 0 :
-                        weighted_bones = [v for v in meshobj.vertex_groups if v.name in arm.data.bones]
-                        for v in weighted_bones:
-                            wbl = "%s : %s" % (meshobj.name, v.name)
-                            if arm.data.bones[v.name].use_deform:
-                                nwc_effective.append(wbl)
-                            else:
-                                nwc_discarded.append(wbl)
-                    
-                    me = meshobj.to_mesh(scn, True, 'PREVIEW') 
-                    vertex_count = len(me.vertices)
-                    uv_count = None
-                    normals_count = 0
-
-                    faces    = len(me.polygons)
-                    loops    = len(me.loops)
-                    flat_face_normals   = [poly.loop_total for poly in me.polygons if not poly.use_smooth]
-                    smooth_face_normals = [poly.loop_total for poly in me.polygons if poly.use_smooth]
-                    normals_count =  max(sum(flat_face_normals),vertex_count)
-                    uv_active=me.uv_layers.active
-                    if uv_active:
-                        uv_count = util.get_uv_vert_count(me)
-
-                    nvnormals += normals_count 
-                    nfaces    += faces
-                    nvertices += vertex_count
-                    if uv_count is None:
-                        uv_count = 0
-                        no_uv_layers += 1
-                    else:
-                        nuvs      += uv_count
-                        
-                    tris = util.get_tri_count(faces, loops)
-                    if faces > 0:
-                        tris = int(((loops / faces) - 2) * faces + 0.5)
-
-                    ntris += tris;
-                    mat, warns = util.get_highest_materialcount([meshobj])
-                    mate = int(tris / 21844)
-                    if mat + mate  > nmat:
-                        nmat = mat
-                        emat = mate
-                    if tris > maxtris: maxtris = tris
-                    
-                    radius, vc_lowest, vc_low, vc_mid, vc_high = util.get_approximate_lods(meshobj, vertex_count, normals_count, uv_count, tris)
 
-                    nvc_lowest += vc_lowest
-                    nvc_low    += vc_low
-                    nvc_mid    += vc_mid
-                    nvc_high   += vc_high
-                    
-                    bpy.data.meshes.remove(me)
+            nwc_effective = []
+            nwc_discarded = []
+            for meshobj in targets:
+                arm = meshobj.find_armature()
+                
+                if arm and len(meshobj.vertex_groups) > 0 :
+                    weighted_bones = [v for v in meshobj.vertex_groups if v.name in arm.data.bones]
+                    for v in weighted_bones:
+                        wbl = "%s : %s" % (meshobj.name, v.name)
+                        if arm.data.bones[v.name].use_deform:
+                            nwc_effective.append(wbl)
+                        else:
+                            nwc_discarded.append(wbl)
+
+            totals       = get_mesh_info_totals(targets)
+            nvertices    = totals.vertices
+            nfaces       = totals.faces
+            ntris        = totals.tris
+            nuvs         = totals.uvs
+            nmat         = totals.nmat
+            emat         = totals.emat
+            maxtris      = totals.maxtris
+            no_uv_layers = totals.no_uv_layers
+            nvc_lowest   = totals.vc_lowest
+            nvc_low      = totals.vc_low
+            nvc_mid      = totals.vc_mid
+            nvc_high     = totals.vc_high
 
             meshsize_icon     = "FILE_TICK"
             high_tris         = False
@@ -1692,6 +1736,10 @@ class PanelMeshInfo(bpy.types.Panel):
                 row.label(_("Meshes:"))
                 row.label("%d"%len(targets))
 
+            if totals.pending > 0:
+                row = col.row(align=True)
+                row.label(_("Calculating %d %s ...") % (totals.pending, util.pluralize("Mesh", totals.pending)), icon='TIME')
+
             row = col.row(align=True)
             row.alignment='LEFT'
             op=row.operator("karaage.generic_info_operator", text=" Verts:", icon="BLANK1", emboss=False)
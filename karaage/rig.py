@@ -184,6 +184,7 @@ def reset_bone(armobj, bone, boneset):
     if 'fix_head' in bone: del bone['fix_head'] 
     if 'fix_tail' in bone: del bone['fix_tail']
     if 'cache' in bone: del bone['cache']
+    reset_cache(armobj, subset=[bone])
     
     if armobj.mode == 'EDIT':
         bone.head = head
@@ -2507,6 +2508,19 @@ def get_sl_bindmatrix(dbone):
     return M
 
 def get_floor_compensation(armobj, pos=None, tail=None, use_cache=False):
+    if use_cache:
+        dh, dt = get_rest_pose_cache(armobj).get_floor_compensation(armobj)
+    else:
+        dh, dt = calculate_floor_compensation(armobj, use_cache)
+
+    if pos:
+        pos = Vector(pos) - dh
+    if tail:
+        tail = Vector(tail) - dt
+
+    return pos, tail, dh, dt
+
+def calculate_floor_compensation(armobj, use_cache):
     toe = armobj.data.bones['mToeRight']
     bh,bt = get_custom_bindposition(armobj, toe, use_cache)
     rh,rt = get_custom_restposition(armobj, toe, use_cache)
@@ -2515,14 +2529,71 @@ def get_floor_compensation(armobj, pos=None, tail=None, use_cache=False):
     dt = bt-rt
     dh[0] = dh[1] = 0
     dt[0] = dt[1] = 0
+    return dh, dt
+
+class RestPoseCache:
+    '''
+    In-memory rest and bind positions of the bones of one armature.
+    Entries are calculated on first use. The calculation recurses
+    to the (cached) parent positions first, so every bone is
+    calculated only once per generation.
+    '''
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.positions  = {key:{} for key in REST_POSE_CALCULATORS}
+        self.floc       = None
+
+    def get(self, armobj, dbone, key):
+        table = self.positions[key]
+        val = table.get(dbone.name)
+        if val is None:
+            val = REST_POSE_CALCULATORS[key](armobj, dbone, True)
+            table[dbone.name] = val
+        return val[0].copy(), val[1].copy()
+
+    def get_floor_compensation(self, armobj):
+        if self.floc is None:
+            self.floc = calculate_floor_compensation(armobj, True)
+        return self.floc[0].copy(), self.floc[1].copy()
+
+    def invalidate(self, bone_names):
+        for table in self.positions.values():
+            for name in bone_names:
+                table.pop(name, None)
+        self.floc = None
+
+REST_POSE_CACHES      = {}
+REST_POSE_GENERATIONS = {}
+
+def rest_pose_cache_key(armobj):
+    return (armobj.name, armobj.data.name)
+
+def get_rest_pose_cache(armobj):
+    key = rest_pose_cache_key(armobj)
+    generation = REST_POSE_GENERATIONS.get(key, 0)
+    cache = REST_POSE_CACHES.get(key)
+    if cache is None or cache.generation != generation:
+        log_cache.debug("Create rest pose cache for %s (generation %d)" % (armobj.name, generation) )
+        cache = RestPoseCache(generation)
+        REST_POSE_CACHES[key] = cache
+    return cache
 
-    if pos:
-        pos = Vector(pos) - dh
-    if tail:
-        tail = Vector(tail) - dt
+@persistent
+def reset_rest_pose_caches(dummy):
+    REST_POSE_CACHES.clear()
+
+def get_rest_pose(armobj, dbone, key, use_cache, with_floc):
+    if use_cache:
+        pos, tail = get_rest_pose_cache(armobj).get(armobj, dbone, key)
+    else:
+        pos, tail = REST_POSE_CALCULATORS[key](armobj, dbone, False)
+
+    if with_floc:
+        pos, tail, dh, dt = get_floor_compensation(armobj, pos, tail, use_cache=use_cache)
+
+    return pos, tail
 
-    return pos, tail, dh, dt
-    
 def get_sl_restposition(armobj=None, dbone=None, use_cache=True, with_floc=False):
     if not armobj:
         armobj = bpy.context.object
@@ -2531,17 +2602,13 @@ def get_sl_restposition(armobj=None, dbone=None, use_cache=True, with_floc=False
 
     if dbone == None:
         return V0.copy(), V0.copy()
+    return get_rest_pose(armobj, dbone, 'slr', use_cache, with_floc)
+
+def calculate_sl_restposition(armobj, dbone, use_cache):
     parent  = get_parent_no_structure(dbone)
 
     bones = util.get_modify_bones(armobj)
 
-    if use_cache:
-        val = get_cache(dbone, 'slr')
-        if val:
-            if with_floc:
-                val[0], val[1], dh, dt = get_floor_compensation(armobj, val[0], val[1], use_cache=use_cache)        
-            return Vector(val[0]), Vector(val[1])
-
     if parent:
         pos, dummy = get_sl_restposition(armobj, parent, use_cache)
     else:
@@ -2558,12 +2625,6 @@ def get_sl_restposition(armobj=None, dbone=None, use_cache=True, with_floc=False
         tt = t.copy()
         pos += t
         t = -tt
-   
-    if use_cache:
-        set_cache(dbone, 'slr', [pos, t])
-
-    if with_floc:
-        pos, tail, dh, dt = get_floor_compensation(armobj, pos, tail, use_cache=use_cache)    
 
     return pos, t
 
@@ -2575,14 +2636,9 @@ def get_custom_restposition(armobj=None, dbone=None, use_cache=True, with_floc=F
 
     if dbone == None:
         return V0.copy(), V0.copy()
+    return get_rest_pose(armobj, dbone, 'cur', use_cache, with_floc)
 
-    if use_cache:
-        val = get_cache(dbone, 'cur')
-        if val:
-            if with_floc:
-                val[0], val[1], dh, dt = get_floor_compensation(armobj, val[0], val[1], use_cache=use_cache)        
-            return Vector(val[0]), Vector(val[1])
-
+def calculate_custom_restposition(armobj, dbone, use_cache):
     bones = util.get_modify_bones(armobj)
     master = get_master_bone(bones, dbone)
     parent = get_parent_no_structure(master)
@@ -2605,12 +2661,6 @@ def get_custom_restposition(armobj=None, dbone=None, use_cache=True, with_floc=F
         pos += tail
         tail = -tt
    
-    if use_cache:
-        set_cache(dbone, 'cur', [pos, tail])
-
-    if with_floc:
-        pos, tail, dh, dt = get_floor_compensation(armobj, pos, tail, use_cache=use_cache)    
-
     return pos, tail
 
 #
@@ -2627,14 +2677,9 @@ def get_sl_bindposition(armobj=None, dbone=None, use_cache=True, with_floc=False
 
     if dbone == None:
         return V0.copy(), V0.copy()
-        
-    if use_cache:
-        val = get_cache(dbone, 'slbr')
-        if val:
-            if with_floc:
-                val[0], val[1], dh, dt = get_floor_compensation(armobj, val[0], val[1], use_cache=use_cache)
-            return Vector(val[0]), Vector(val[1])
+    return get_rest_pose(armobj, dbone, 'slbr', use_cache, with_floc)
 
+def calculate_sl_bindposition(armobj, dbone, use_cache):
     bones = util.get_modify_bones(armobj)
     master = get_master_bone(bones, dbone)
     parent = get_parent_no_structure(master)
@@ -2662,12 +2707,6 @@ def get_sl_bindposition(armobj=None, dbone=None, use_cache=True, with_floc=False
         pos += tail
         tail = -tt
     
-    if use_cache:
-        set_cache(dbone, 'slbr', [pos, tail])
-
-    if with_floc:
-        pos, tail, dh, dt = get_floor_compensation(armobj, pos, tail, use_cache=use_cache)    
-
     return pos, tail
 
 def get_custom_bindposition(armobj=None, dbone=None, use_cache=True, with_floc=False):
@@ -2678,14 +2717,9 @@ def get_custom_bindposition(armobj=None, dbone=None, use_cache=True, with_floc=F
 
     if dbone == None:
         return V0.copy(), V0.copy()
-        
-    if use_cache:
-        val = get_cache(dbone, 'cubr')
-        if val:
-            if with_floc:
-                val[0], val[1], dh, dt = get_floor_compensation(armobj, val[0], val[1], use_cache=use_cache)        
-            return Vector(val[0]), Vector(val[1])
+    return get_rest_pose(armobj, dbone, 'cubr', use_cache, with_floc)
 
+def calculate_custom_bindposition(armobj, dbone, use_cache):
     bones = util.get_modify_bones(armobj)
     master = get_master_bone(bones, dbone)
     parent = get_parent_no_structure(master)
@@ -2730,37 +2764,29 @@ def get_custom_bindposition(armobj=None, dbone=None, use_cache=True, with_floc=F
         pos += tail
         tail = -tt
 
-    if use_cache:
-        set_cache(dbone, 'cubr', [pos, tail])
-
-    if with_floc:
-        pos, tail, dh, dt = get_floor_compensation(armobj, pos, tail, use_cache=use_cache)    
-
     return  pos, tail
 
-def get_cache(dbone, key):
-    cache = dbone.get('cache', None)
-    if not cache:
-        return None
-
-    val = cache.get(key, None)
-    return val
-
-def set_cache(dbone, key, val):
-    cache = dbone.get('cache', None)
-    if not cache:
-        cache = {}
-
-    cache[key] = val
-    dbone['cache'] = cache
+REST_POSE_CALCULATORS = {
+    'slr'  : calculate_sl_restposition,
+    'cur'  : calculate_custom_restposition,
+    'slbr' : calculate_sl_bindposition,
+    'cubr' : calculate_custom_bindposition
+}
 
 def reset_cache(armobj, subset=None, full=False):
     log_cache.debug("Reset Cache")
+    key = rest_pose_cache_key(armobj)
     if subset == None:
-        subset = util.get_modify_bones(armobj)
-    for dbone in subset:
-        util.remove_key(dbone, 'cache')
-        if full:
+        REST_POSE_GENERATIONS[key] = REST_POSE_GENERATIONS.get(key, 0) + 1
+        subset = util.get_modify_bones(armobj) if full else []
+    else:
+        cache = REST_POSE_CACHES.get(key)
+        if cache:
+            cache.invalidate([dbone.name for dbone in subset])
+
+    if full:
+        for dbone in subset:
+            util.remove_key(dbone, 'cache') # Cache of older Karaage versions
             util.remove_key(dbone, 'fix_head')
             util.remove_key(dbone, 'fix_tail')
 
@@ -37,6 +37,7 @@ import bpy
 from bpy.props import *
 import  xml.etree.ElementTree as et
 from mathutils import Vector, Matrix
+import numpy as np
 import time, logging, traceback, os, gettext
 from math import fabs, radians
 from bpy.app.handlers import persistent
@@ -447,6 +448,178 @@ class PrintSliderRelationship(bpy.types.Operator):
         html_driven_bones(context, "slider_info_wp", self.WP_HEADER, self.WP_FOOTER, self.WP_SECTION, self.WP_SECTIONELEMENT, self.WP_BR)
         return {'FINISHED'}
 
+IGNORED_DRIVEN_PIDS = [
+    'eyeball_size_679',
+    'eyeball_size_680',
+    'eyeball_size_681',
+    'eyeball_size_687',
+    'eyeball_size_688',
+    'eyeball_size_691',
+    'eyeball_size_694',
+    'eyeball_size_695',
+    ]
+
+UNSUPPORTED_DRIVEN_PIDS = [
+    "pants_length_shadow_915",
+    "pants_length_cloth_615",
+    "pants_length_cloth_1018",
+    "pants_length_cloth_1036",
+    "lower_clothes_shading_913",
+    "upper_clothes_shading_899"
+    ]
+
+SEX_ANY    = 0
+SEX_MALE   = 1
+SEX_FEMALE = 2
+
+def get_sex_code(sex):
+    return SEX_MALE if sex == 'male' else SEX_FEMALE if sex == 'female' else SEX_ANY
+
+class DriverGraph:
+    '''
+    The shape drivers compiled into a flat list of edges.
+    Each edge leads from a slider (target) to one mesh or bones driver,
+    either directly or via a driven key. The numeric edge properties
+    (value ranges, breakpoints, gender restrictions) are kept in arrays,
+    so that a set of slider values is evaluated in one pass.
+    '''
+
+    def __init__(self, DRIVERS):
+        rows    = []
+        drivers = []
+        slices  = OrderedDict()
+
+        for target, Ds in DRIVERS.items():
+            start = len(rows)
+            for D in Ds:
+                is_raw = D['pid'] == 'male_80'
+                dsex   = get_sex_code(D['sex'])
+                if D['type'] in ['mesh', 'bones']:
+                    rows.append((is_raw, False, D['value_min'], D['value_max'], dsex, 0, 0, 0, 0, SEX_ANY, 0, 1, SEX_ANY))
+                    drivers.append(D)
+                elif D['type'] == 'driven':
+                    for DR in D['driven']:
+                        dpid = DR['pid']
+                        if dpid in IGNORED_DRIVEN_PIDS:
+                            continue
+
+                        skip = SEX_ANY
+                        if dpid == 'muscular_torso_106':
+                            if D['pid'] == 'torso_muscles_649':
+                                skip = SEX_MALE
+                            elif D['pid'] == 'torso_muscles_678':
+                                skip = SEX_FEMALE
+
+                        D2s = DRIVERS.get(dpid)
+                        if D2s is None:
+                            if dpid not in UNSUPPORTED_DRIVEN_PIDS:
+                                logging.warn(_("Missing driver: %s"), dpid)
+                            continue
+
+                        for D2 in D2s:
+                            if D2['type'] not in ['mesh', 'bones']:
+                                logging.error(D2)
+                                raise Exception(_("Unknown shape driver %s")%D2['pid'])
+                            rows.append((is_raw, True, D['value_min'], D['value_max'], dsex,
+                                         DR['min1'], DR['max1'], DR['min2'], DR['max2'], skip,
+                                         D2['value_min'], D2['value_max'], get_sex_code(D2['sex'])))
+                            drivers.append(D2)
+                else:
+                    logging.error(D)
+                    raise Exception(_("Unknown shape driver %s")%D['pid'])
+
+            if len(rows) > start:
+                slices[target] = (start, len(rows))
+
+        table = np.array(rows, dtype=np.float64).reshape(-1,13)
+        table.setflags(write=False)
+
+        self.table   = table
+        self.drivers = tuple(drivers)
+        self.is_mesh = tuple(D['type'] == 'mesh' for D in drivers)
+        self.bones   = tuple(tuple(B['name'] for B in D['bones']) for D in drivers)
+        self.meshes  = tuple(D.get('mesh') for D in drivers)
+        self.slices  = slices
+
+    def has_target(self, target):
+        return target in self.slices
+
+    def evaluate_values(self, values, is_male):
+        '''
+        Calculate the driver values and percentages of all edges
+        which start at one of the targets in values {target: v100}
+        Returns the edge indices, the position of the edge's target
+        in values, the driver values and the percentages
+        '''
+        targets = [t for t in values if t in self.slices]
+        if len(targets) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0), np.zeros(0)
+
+        ranges = [self.slices[t] for t in targets]
+        counts = [e-s for s, e in ranges]
+        edges  = np.concatenate([np.arange(s, e, dtype=np.int32) for s, e in ranges])
+        owner  = np.repeat(np.arange(len(targets), dtype=np.int32), counts)
+        v100   = np.repeat([float(values[t]) for t in targets], counts)
+
+        T = self.table[edges]
+        is_raw, is_driven, dmin, dmax, dsex, min1, max1, min2, max2, skip, vmin, vmax, sex2 = T.T
+        is_raw    = is_raw    > 0
+        is_driven = is_driven > 0
+        gender    = SEX_MALE if is_male else SEX_FEMALE
+        opposite  = SEX_FEMALE if is_male else SEX_MALE
+
+        v = np.where(is_raw, v100, v100*(dmax-dmin)/100 + dmin)
+        v[dsex == opposite] = 0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rise = np.where(max1 != min1, (v - min1)/(max1 - min1), 1.0)
+            fall = np.where(min2 != max2, 1.0 - (v - max2)/(min2 - max2), 1.0)
+        vg = np.where(v < max1, rise, fall)
+        vg[(v >= max1) & (v <= max2)] = 1.0
+        vg[(v < min1) | (v > min2)]   = 0.0
+
+        v2 = vg*(vmax-vmin) + vmin
+        v2[sex2 == opposite] = 0
+
+        value   = np.where(is_driven, v2, v)
+        percent = np.where(is_driven, vg, v100/100)
+
+        keep = ~(is_driven & (skip == gender))
+        return edges[keep], owner[keep], value[keep], percent[keep]
+
+    def evaluate_targets(self, values, is_male):
+        '''
+        Batch evaluation of many sliders at once.
+        Returns {target: (meshchanges, bonechanges)} in the order of values
+        '''
+        edges, owner, value, percent = self.evaluate_values(values, is_male)
+        result  = OrderedDict((t, ([], [])) for t in values if t in self.slices)
+        changes = list(result.values())
+
+        for e, o, v, p in zip(edges.tolist(), owner.tolist(), value.tolist(), percent.tolist()):
+            meshchanges, bonechanges = changes[o]
+            D = self.drivers[e]
+            if self.is_mesh[e]:
+                meshchanges.append((D, v, p))
+                if len(self.bones[e]) > 0:
+                    bonechanges.append((D, v, p))
+            else:
+                bonechanges.append((D, v, p))
+
+        return result
+
+    def evaluate(self, values, is_male):
+        '''
+        Evaluate the sliders in values {target: v100}
+        Returns the combined mesh changes and bone changes
+        '''
+        meshchanges = []
+        bonechanges = []
+        for m, b in self.evaluate_targets(values, is_male).values():
+            meshchanges.extend(m)
+            bonechanges.extend(b)
+        return meshchanges, bonechanges
+
 def createShapeDrivers(DRIVERS):
     
     logging.info(_("Creating Shape UI"))
@@ -461,6 +634,7 @@ def createShapeDrivers(DRIVERS):
     ShapeDrivers.Sections = EnumProperty( items=sectionitems, name='Sections', default='Body' )    
     
     ShapeDrivers.DRIVERS = DRIVERS
+    ShapeDrivers.DRIVER_GRAPH = DriverGraph(DRIVERS)
     
     target = ShapeDrivers
     values = ShapeValues
@@ -515,47 +689,75 @@ def createMeshShapes(MESHES):
             for joint in mesh['skinJoints']:
                 WEIGHTS[joint] = {}
             
-            for vidx, (bi, w) in enumerate(mesh['weights']):
-                if vidx in mesh['vertexRemap']:
-                    continue
-                i = data.getVertexIndex(mesh, vidx)
+            indices, kept = data.getVertexIndices(mesh, np.arange(len(mesh['weightIndices'])))
+            weights = zip(indices[kept].tolist(), mesh['weightIndices'][kept].tolist(), mesh['weightValues'][kept].tolist())
+            for i, bi, w in weights:
                 b1, b2 = data.WEIGHTSMAP[meshname][bi]
                 WEIGHTS[b1][i] = 1-w
                 if b2 is not None:
                     WEIGHTS[b2][i] = w
-        MESH['weights'] = WEIGHTS
+
+        bone_names = [bname for bname, weights in WEIGHTS.items() if len(weights) > 0]
+        MESH['bones']   = bone_names
+        MESH['weights'] = pack_weights(WEIGHTS, bone_names)
 
         SHAPE_KEYS= {}
         for pid, morph in mesh['morphs'].items():
             util.progress_update(1, False)
 
-            DVS = {} 
-            for v in morph['vertices']:
-                ii = v['vertexIndex']
-                if ii in mesh['vertexRemap']:
-                    continue
-                dv = v['coord']
-                DVS[data.getVertexIndex(mesh, ii)] = dv
-
-            BONEGROUPS={}
-            dvset = set(DVS)
-            for bone, weights in WEIGHTS.items():
-                IWDVs = []
-                for vid in dvset.intersection(weights):
-                    IWDVs.append( (vid, WEIGHTS[bone][vid], DVS[vid]) )
-                BONEGROUPS[bone] = IWDVs
-
-            SHAPE_KEYS[pid] = BONEGROUPS
+            indices, kept = data.getVertexIndices(mesh, morph['vertexIndices'])
+            DVS = dict(zip(indices[kept].tolist(), morph['coords'][kept].tolist()))
+
+            SHAPE_KEYS[pid] = pack_shapekey(WEIGHTS, bone_names, DVS)
         MESH['shapekeys'] = SHAPE_KEYS
 
-        verts = [mesh['baseCoords'][i] for i in mesh['vertLookup']]
-        co = [item for sublist in verts for item in sublist]
-        MESH['co'] = co
+        MESH['co'] = mesh['baseCoords'][mesh['vertLookup']].reshape(-1,3)
 
         MESHSHAPES[meshname]=MESH
     
     ShapeDrivers.MESHSHAPES = MESHSHAPES
 
+def pack_weights(WEIGHTS, bone_names):
+    '''
+    Pack the per bone weight maps {bone: {vertex index: weight}}
+    into flat arrays (vertex indices, bone indices, weights)
+    '''
+    vids = []
+    bids = []
+    ws   = []
+    for bid, bname in enumerate(bone_names):
+        weights = WEIGHTS[bname]
+        vids.extend(weights.keys())
+        ws.extend(weights.values())
+        bids.extend([bid]*len(weights))
+
+    return (np.array(vids, dtype=np.int32),
+            np.array(bids, dtype=np.int32),
+            np.array(ws,   dtype=np.float64))
+
+def pack_shapekey(WEIGHTS, bone_names, DVS):
+    '''
+    Pack the weighted morph deltas of one shape key into flat arrays
+    (vertex indices, bone indices, weights, deltas)
+    '''
+    vids = []
+    bids = []
+    ws   = []
+    dvs  = []
+    dvset = set(DVS)
+    for bid, bname in enumerate(bone_names):
+        weights = WEIGHTS[bname]
+        for vid in dvset.intersection(weights):
+            vids.append(vid)
+            bids.append(bid)
+            ws.append(weights[vid])
+            dvs.append(DVS[vid])
+
+    return (np.array(vids, dtype=np.int32),
+            np.array(bids, dtype=np.int32),
+            np.array(ws,   dtype=np.float64),
+            np.array(dvs,  dtype=np.float64).reshape(-1,3))
+
 def initialize(rigType):
     log.debug("Loading Karaage Shape Interface for rigType %s" % (rigType))
     progress=100
@@ -1089,60 +1291,48 @@ def update_system_morphs(scene, armobj, meshobjs):
             continue
 
         MESH = meshobj.ShapeDrivers.MESHSHAPES[mname]
-
-        co = list(MESH['co']) 
-        dco = [0.0]*len(co)
-        mask = [0]*len(co)
+        bone_names = MESH['bones']
 
         ttic = time.time()
-        mesh_weights = MESH['weights'].items()
-        for bname, weights in mesh_weights:
+        bcount  = len(bone_names)
+        affines = np.zeros((bcount,4,4), dtype=np.float64)
+        deform  = np.zeros(bcount, dtype=bool)
+        scales  = np.ones((bcount,3), dtype=np.float64)
+        for bid, bname in enumerate(bone_names):
             dbone = bones[bname]
+            scales[bid] = util.get_bone_scale(dbone)
             if dbone.use_deform:
                 BoneLoc0, BoneLoc, MScale = get_binding_data(armobj, dbone, use_cache=True)
+                affines[bid] = Matrix.Translation(BoneLoc) * MScale * Matrix.Translation(-BoneLoc0)
+                deform[bid]  = True
 
-                for vi,w in weights.items():
+        co = MESH['co'].copy()
+        vids, bids, ws = MESH['weights']
+        sel  = deform[bids]
+        vids = vids[sel]
+        bids = bids[sel]
+        ws   = ws[sel]
 
-                    offset = 3*vi
-                    vertLocation   = Vector(co[offset:offset+3])
-                    targetLocation = MScale*(vertLocation - BoneLoc0) + BoneLoc
-                    L              = w * targetLocation
+        A   = affines[bids]
+        L   = np.einsum('kij,kj->ki', A[:,:3,:3], co[vids]) + A[:,:3,3]
+        dco = np.zeros_like(co)
+        np.add.at(dco, vids, L * ws[:,None])
+        co[vids] = dco[vids]
 
-                    dco[offset]   += L[0]
-                    dco[offset+1] += L[1]
-                    dco[offset+2] += L[2]
+        ttic = util.logtime(ttic, "update_system_morphs: modified %d weighted bones for %s)" % (np.count_nonzero(deform), meshobj.name), 4)
 
-                    mask[offset  ] = 1
-                    mask[offset+1] = 1
-                    mask[offset+2] = 1
-        ttic = util.logtime(ttic, "update_system_morphs: modified %d weighted bones for %s)" % (len(mesh_weights), meshobj.name), 4)
-        
-        for ii in range(len(dco)):
-            if mask[ii]:
-                co[ii] = dco[ii]
-
-        meshobj.data.shape_keys.key_blocks[0].data.foreach_set('co',co)
+        meshobj.data.shape_keys.key_blocks[0].data.foreach_set('co', co.astype(np.float32).ravel())
 
         shapekey_items = MESH['shapekeys'].items()
-        for pid, SK in shapekey_items:
-            sk_items = SK.items()
-            if len(sk_items) == 0:
+        for pid, (vids, bids, ws, dvs) in shapekey_items:
+            if len(vids) == 0:
                 continue
 
-            co2 = list(co)
-            for bname, IWDVs in sk_items:
-
-                if len(IWDVs) == 0:
-                    continue
-
-                scale = util.get_bone_scale(bones[bname])
-                for vi,w,dv in IWDVs:
-                    co2[3*vi]   += w*dv[0]*scale[0]
-                    co2[3*vi+1] += w*dv[1]*scale[1]
-                    co2[3*vi+2] += w*dv[2]*scale[2]
+            co2 = co.copy()
+            np.add.at(co2, vids, dvs * scales[bids] * ws[:,None])
 
             try:
-                meshobj.data.shape_keys.key_blocks[pid].data.foreach_set('co',co2)
+                meshobj.data.shape_keys.key_blocks[pid].data.foreach_set('co', co2.astype(np.float32).ravel())
             except:
                 logging.debug("Morph shape_key not found: pid %s" % pid)
 
@@ -1165,6 +1355,8 @@ def destroy_shape_info(context, armobj):
 
 def detachShapeSlider(obj, reset=True):
 
+    invalidate_weight_groups(obj)
+
     if 'bone_morph' in obj:
         del obj['bone_morph']    
     if 'neutral_shape' in obj:
@@ -1245,6 +1437,7 @@ def attachShapeSlider(context, arm, obj, init=True):
     prop   = context.scene.MeshProp
 
     createSliderShapeKeys(obj)
+    invalidate_weight_groups(obj)
     ensure_drivers_initialized(arm)
 
     arm_select = arm.select
@@ -1471,14 +1664,22 @@ def inner_updateShape(context, target, scene, refresh, init, custom_objects, wit
                 finally:
                     recurse_call = False
 
-        meshchanges, bonechanges = expandDrivers(armobj, targets)
+        dirty_bones = None
+        if refresh:
+            meshchanges, bonechanges = expand_all_drivers(armobj, targets)
+        else:
+            meshchanges, bonechanges = expandDrivers(armobj, targets)
 
         if not refresh and len(bonechanges)>0:
 
-            targets = []
-            for section, pids in SHAPEUI.items():
-                targets.extend(pids)
-            meshchanges, bonechanges = expandDrivers(armobj, targets)
+            if with_bone_check and not init:
+                dirty_bones = update_slider_contributions(armobj, target, bonechanges)
+
+            if dirty_bones is None:
+                targets = []
+                for section, pids in SHAPEUI.items():
+                    targets.extend(pids)
+                meshchanges, bonechanges = expand_all_drivers(armobj, targets)
 
         ava_objects = util.getKaraageChildSet(armobj, type='MESH', visible=True)
 
@@ -1488,18 +1689,27 @@ def inner_updateShape(context, target, scene, refresh, init, custom_objects, wit
             updateMeshKey(armobj, D, v, p, ava_objects)
             updateCustomMeshKey(armobj, D, v, p, custom_objects)
 
+        custom_dirty_bones = None
         if with_bone_check and len(bonechanges)>0:
 
-            for dbone in armobj.data.bones:
-                dbone['scale']  = (0.0, 0.0, 0.0)
-                dbone['offset'] = (0.0, 0.0, 0.0)
+            if dirty_bones is None:
+                for dbone in armobj.data.bones:
+                    dbone['scale']  = (0.0, 0.0, 0.0)
+                    dbone['offset'] = (0.0, 0.0, 0.0)
 
-            rig.reset_cache(armobj)
-    
-            for D,v,p in bonechanges:
-                if len(D['bones']) > 0:
+                rig.reset_cache(armobj)
+        
+                for D,v,p in bonechanges:
+                    if len(D['bones']) > 0:
 
-                    apply_sliders_to_rig(armobj.data.bones, D, v)
+                        apply_sliders_to_rig(armobj.data.bones, D, v)
+            else:
+                apply_slider_contributions(armobj, dirty_bones)
+                subtree = get_dirty_subtree(armobj, dirty_bones)
+                rig.reset_cache(armobj, subset=[armobj.data.bones[name] for name in subtree])
+                if 'mToeRight' not in subtree:
+                    custom_dirty_bones = subtree
+                log.debug("Incremental update of %d bones (%d bones invalidated)" % (len(dirty_bones), len(subtree)) )
 
             util.ensure_mode_is("EDIT")
             ttic = time.time()
@@ -1542,6 +1752,8 @@ def inner_updateShape(context, target, scene, refresh, init, custom_objects, wit
                 if dbone and 'p_offset' in dbone:
                     del dbone['p_offset']
 
+            remember_bone_props(armobj)
+
         for child in [ch for ch in custom_objects if ch.ObjectProp.slider_selector!='NONE']:
 
             ttic = time.time()
@@ -1559,11 +1771,152 @@ def inner_updateShape(context, target, scene, refresh, init, custom_objects, wit
                 log.warning("%s has no associated Armature, ignore" % (child.name) )
                 continue
 
-            update_custom_bones(child, arm, init)
+            update_custom_bones(child, arm, init, dirty_bones=custom_dirty_bones)
 
         setHands(armobj, scene=scene)
         util.set_operate_in_user_mode(oumode)
 
+slider_contributions = {}
+
+def get_slider_contributions(bonechanges):
+    '''
+    Sum up the bone scale and offset contributions of a list of bone changes
+    Returns a dict {bone name: (scale, offset)}
+    '''
+    contributions = {}
+    for D,v,p in bonechanges:
+        if v == 0:
+            continue
+        for B in D['bones']:
+            bname = B['name']
+            scale, offset = contributions.get(bname, (V0, V0))
+            contributions[bname] = (scale + Vector(B['scale'])*v, offset + Vector(B['offset'])*v)
+    return contributions
+
+def expand_all_drivers(armobj, targets):
+    '''
+    Expand all targets like expandDrivers() and remember the bone
+    contributions of each target for later incremental updates
+    '''
+    graph = armobj.ShapeDrivers.DRIVER_GRAPH
+    values = OrderedDict()
+    for target in targets:
+        if graph.has_target(target):
+            values[target] = getShapeValue(armobj, target)
+
+    meshchanges = []
+    bonechanges = []
+    pids = {}
+    for target, (m, b) in graph.evaluate_targets(values, is_male_shape(armobj)).items():
+        meshchanges.extend(m)
+        bonechanges.extend(b)
+        pids[target] = get_slider_contributions(b)
+
+    slider_contributions[armobj.name] = {'male':armobj.ShapeDrivers.male_80, 'pids':pids, 'signature':None}
+    return meshchanges, bonechanges
+
+def get_bone_props_signature(armobj):
+    '''
+    Checksum of the scale and offset properties of all bones
+    '''
+    return hash(tuple((b.name, tuple(b.get('scale', V0)), tuple(b.get('offset', V0))) for b in armobj.data.bones))
+
+def remember_bone_props(armobj):
+    '''
+    Remember the checksum of the bone properties after the sliders
+    have been applied to the rig. Any later change of the bone
+    properties outside of the slider update (copy rig, store joint
+    positions, bone reset, undo, ...) disables the incremental update
+    until the next full update.
+    '''
+    store = slider_contributions.get(armobj.name)
+    if store is not None:
+        store['signature'] = get_bone_props_signature(armobj)
+
+@persistent
+def reset_slider_contributions(dummy):
+    slider_contributions.clear()
+
+def update_slider_contributions(armobj, target, bonechanges):
+    '''
+    Replace the remembered bone contributions of target.
+    Returns the names of the bones which are affected by the change,
+    or None when no incremental update is possible
+    '''
+    pref = util.getAddonPreferences()
+    if not pref.use_incremental_sliders or target == 'male_80':
+        return None
+
+    store = slider_contributions.get(armobj.name)
+    if store is None or store['male'] != armobj.ShapeDrivers.male_80:
+        return None
+
+    if store['signature'] is None or store['signature'] != get_bone_props_signature(armobj):
+        log.debug("Bone properties of %s changed outside of the sliders, full update" % armobj.name)
+        return None
+
+    old = store['pids'].get(target, {})
+    new = get_slider_contributions(bonechanges)
+    store['pids'][target] = new
+
+    dirty_bones = set()
+    for bname in set(old).union(new):
+        if old.get(bname) != new.get(bname):
+            dirty_bones.add(bname)
+    return dirty_bones
+
+def apply_slider_contributions(armobj, bnames):
+    '''
+    Set scale and offset of the named bones to the sum of
+    all remembered slider contributions
+    '''
+    bones = armobj.data.bones
+    pids  = slider_contributions[armobj.name]['pids'].values()
+    for bname in bnames:
+        bone = bones.get(bname, None)
+        if not bone:
+            continue
+
+        scale  = V0.copy()
+        offset = V0.copy()
+        for contributions in pids:
+            c = contributions.get(bname)
+            if c:
+                scale  += c[0]
+                offset += c[1]
+
+        scale  = util.sanitize(scale)
+        offset = util.sanitize(offset)
+        bone['scale']  = scale
+        bone['offset'] = offset
+
+        if bname[0] == 'm':
+            bone = bones.get(bname[1:])
+            if bone:
+                bone['scale']  = scale
+                bone['offset'] = offset
+
+def get_dirty_subtree(armobj, bnames):
+    '''
+    Return the names of the bones whose rest and bind positions
+    depend on the named bones (the bones, their children and the
+    control bones which take their data from one of those bones)
+    '''
+    bones = armobj.data.bones
+    subtree = set()
+    for bname in bnames:
+        bone = rig.get_master_bone(bones, bones.get(bname, None))
+        if bone and bone.name not in subtree:
+            subtree.add(bone.name)
+            subtree.update([child.name for child in bone.children_recursive])
+
+    for bone in bones:
+        if bone.name not in subtree:
+            master = rig.get_master_bone(bones, bone)
+            if master.name in subtree:
+                subtree.add(bone.name)
+    return subtree
+
 def get_bones_from_groups(bones, vertex_groups):
     active_bones = []
     for group in vertex_groups:
@@ -1592,64 +1945,88 @@ def sort_bones_by_hierarhy(bones, active_bones):
 def has_shape_data(meshobj):
     return meshobj.get('neutral_shape', None) != None and meshobj.get('bone_morph', None) != None
 
+SHAPE_DATA_VERSION = 1
+SHAPE_DATA_HEADER  = 4 # int32 values: version, vertex count, edge count, polygon count
+
 def fast_get_verts(me):
     verts = me.vertices
-    co = [0.0]*3*len(verts)
+    co = np.empty(3*len(verts), dtype=np.float32)
     verts.foreach_get('co',co)
     return co
 
 def fast_set_verts(me, co):
     verts = me.vertices
     verts.foreach_set('co', co)
-    
+
+def get_topology_stamp(me, vcount=None):
+    return (len(me.vertices) if vcount is None else vcount, len(me.edges), len(me.polygons))
+
+def pack_shape_data(me, co):
+    '''
+    Pack the flat coordinate array co into the bytes stored in the
+    shape ID properties: a header with the topology stamp of the mesh
+    followed by the float32 coordinates
+    '''
+    co = np.asarray(co, dtype=np.float32).ravel()
+    header = np.array((SHAPE_DATA_VERSION,) + get_topology_stamp(me, len(co)//3), dtype=np.int32)
+    return header.tobytes() + co.tobytes()
+
+def unpack_shape_data(dta):
+    '''
+    Return (topology stamp, flat float32 coordinates) of a stored shape.
+    The coordinates are a read only view into dta. Shapes stored as float
+    lists by older versions have no stamp.
+    '''
+    if isinstance(dta, bytes):
+        header = np.frombuffer(dta, dtype=np.int32, count=SHAPE_DATA_HEADER)
+        if header[0] == SHAPE_DATA_VERSION:
+            return tuple(header[1:].tolist()), np.frombuffer(dta, dtype=np.float32, offset=4*SHAPE_DATA_HEADER)
+    return None, np.array(dta.to_list(), dtype=np.float32)
+
 def get_shape_data(child, key):
     updatelog.debug("get_shape_data: load from obj:%s shape:%s" % (child.name, key) )
     skey = str(key)
     dta = child.get(skey,None)
+    me = child.data
 
     if not dta:
 
         if "original" in child:
-            dta = child['original'].to_list()
-
-            updatelog.debug("get_shape_data: copied vertex array of length %d from obj:%s shape:original -> shape:%s" % (len(dta), child.name, key))
+            dta = child['original']
+            updatelog.debug("get_shape_data: copied vertex array from obj:%s shape:original -> shape:%s" % (child.name, key))
         else:
-            dta = fast_get_verts(child.data)
-
-            updatelog.debug("get_shape_data: initialized vertex array from %d vertices -> obj:%s shape:%s" % (len(dta), child.name, key))
+            dta = pack_shape_data(me, fast_get_verts(me))
+            updatelog.debug("get_shape_data: initialized vertex array from %d vertices -> obj:%s shape:%s" % (len(me.vertices), child.name, key))
 
         child[skey] = dta
-        return dta, key
-    else:
-        updatelog.debug("get_shape_data: initialized vertex array from dta of length %d -> obj:%s shape:%s" % (len(dta), child.name, key))
-
-    lvert = 3*len(child.data.vertices)
-    ldta  = len(dta)
-    dta = dta.to_list() # convert from idproperty to array
 
-    if lvert != ldta:
-        if  lvert > ldta:
-            lvert = int(lvert/3)
-            ldta  = int(ldta/3)
-            updatelog.warning("get_shape_data: %s:%s Adding Shape data on the fly for %d missing verts" % (child.name, skey, (lvert-ldta)) )
+    stamp, dta = unpack_shape_data(dta)
+    mesh_stamp = get_topology_stamp(me)
+    if stamp == mesh_stamp:
+        return dta, key
 
-            verts = child.data.vertices
-            for i in range(ldta, lvert):
-                co = verts[i].co.copy()
-                dta.extend([co[0], co[1], co[2]])
-            child[skey] = dta
+    lvert = mesh_stamp[0]
+    ldta  = int(len(dta)/3)
+    if lvert > ldta:
+        updatelog.warning("get_shape_data: %s:%s Adding Shape data on the fly for %d missing verts" % (child.name, skey, (lvert-ldta)) )
+        dta = np.concatenate((dta, fast_get_verts(me)[3*ldta:]))
+    elif lvert < ldta:
+        updatelog.warning("get_shape_data: %s:%s shape has %d verts, mesh has %d verts (please reset shape)" % (child.name, skey, ldta, lvert) )
+        return dta, key
+    elif stamp is not None:
+        updatelog.warning("get_shape_data: %s:%s mesh topology has changed (please reset shape if the mesh looks distorted)" % (child.name, skey) )
 
-        else:
-            updatelog.warning("get_shape_data: %s:%s shape has %d verts, mesh has %d verts (please reset shape)" % (child.name, skey, ldta, lvert) )
+    child[skey] = pack_shape_data(me, dta)
     updatelog.debug("get_shape_data: loaded shape %s:%s with %d verts %d dta" % (child.name, skey, lvert, len(dta)) )
     return dta, key
 
 def set_shape_data(child, key, co=None):
     log.debug("set_shape_data: for obj:%s - key%s" % (child.name, key) )
-    if co:
-        child[key] = co
+    if co is not None:
+        co = np.asarray(co, dtype=np.float32).ravel()
+        child[key] = pack_shape_data(child.data, co)
     else:
-        co = child[key][:]
+        stamp, co = unpack_shape_data(child[key])
     try:
         fast_set_verts(child.data, co)
     except:
@@ -1688,104 +2065,217 @@ def adjust_vertex_shifting(obj, co, from_data, zero_shape, to_data, tolerance, s
         update_custom_bones(obj, arm, adjust_shift=True)
     return shift_counter
 
-def update_custom_bones(child, arm, init=False, adjust_shift=None, all_verts=True):
-    util.progress_update(10, absolute=False)
+precompiled_maps = {}
 
-    #
+def weight_map_key(child):
+    return (child.name, child.data.name)
 
-    #
+def invalidate_weight_groups(child=None):
+    '''
+    Discard the precompiled weight map of child
+    or all precompiled weight maps when child is None
+    '''
+    util.invalidate_weight_matrix(child)
+    if child is None:
+        precompiled_maps.clear()
+    elif precompiled_maps.pop(weight_map_key(child), None):
+        updatelog.debug("invalidate_weight_groups: discarded precompiled map of %s" % child.name)
+
+WEIGHT_EDIT_OPERATORS = {'OBJECT_OT_DATA_TRANSFER',
+                         'OBJECT_OT_DATALAYOUT_TRANSFER',
+                         'OBJECT_OT_PARENT_SET',
+                         'OBJECT_OT_JOIN',
+                         'OBJECT_OT_CONVERT',
+                         'OBJECT_OT_MODIFIER_APPLY',
+                         'OBJECT_OT_EDITMODE_TOGGLE',
+                         'OBJECT_OT_MODE_SET'}
+WEIGHT_EDIT_KEYWORDS = ('WEIGHT', 'VERTEX_GROUP')
+last_operator = None
+
+def is_weight_edit_operator(op):
+    '''
+    True for operators which can change the vertex weights or the
+    vertex count of the selected objects: the WEIGHT_EDIT_OPERATORS
+    and all operators with WEIGHT or VERTEX_GROUP in their name
+    (this includes the Karaage weight tools)
+    '''
+    idname = op.bl_idname.upper()
+    return idname in WEIGHT_EDIT_OPERATORS or any(k in idname for k in WEIGHT_EDIT_KEYWORDS)
 
-    unweightedvertices = False
+def get_weight_edited_objects(scene):
+    '''
+    Return the names of the objects whose weights may have been
+    edited since the last call: the selected objects after a weight
+    editing operator and the active object while it is edited in
+    edit mode or weight paint mode.
+    Slider changes and pose or transform updates do not count.
+    '''
+    global last_operator
+
+    context = bpy.context
+    edited = set()
+
+    operators = context.window_manager.operators
+    if len(operators) > 0:
+        op = operators[-1]
+        pointer = op.as_pointer()
+        if pointer != last_operator:
+            last_operator = pointer
+            if is_weight_edit_operator(op):
+                updatelog.debug("get_weight_edited_objects: weights changed by %s" % op.bl_idname)
+                edited.update([ob.name for ob in scene.objects if ob.select])
+                if scene.objects.active:
+                    edited.add(scene.objects.active.name)
 
-    MMeshWorld  = child.matrix_local
-    MMeshWorldI = MMeshWorld.inverted()
+    obj = context.object
+    if obj and obj.type=="MESH" and obj.is_updated_data and context.mode in ["EDIT_MESH", "PAINT_WEIGHT"]:
+        edited.add(obj.name)
 
-    if init:
-       from_shape = 'original'
-       to_shape   = 'neutral_shape'
+    return edited
 
-    else:
-       from_shape = 'neutral_shape'
-       to_shape   = 'bone_morph'
+@persistent
+def update_weight_maps_on_update(scene):
+    '''
+    Discard the precompiled weight maps and weight matrices of the
+    objects whose weights have been edited (see get_weight_edited_objects)
+    and the maps of objects which have been removed from the scene
+    '''
+    for name in get_weight_edited_objects(scene):
+        ob = scene.objects.get(name)
+        if ob:
+            invalidate_weight_groups(ob)
 
-    bones = util.get_modify_bones(arm)
-       
-    co, from_shape = get_shape_data(child, from_shape)
-    if co == None:
-        updatelog.warning("update_custom_bones: Mesh object %s has no mesh shape data (ignore)" % (child.name) )
-        return
-    if len(co)/3 < len(child.data.vertices):
-        updatelog.error("update_custom_bones: shape %s:%s of length %d < vertlen: %d"
-                       % (child.name,from_shape, len(co)/3, len(child.data.vertices)) )
-    updatelog.debug("update_custom_bones: use shape %s:%s of length %d"
-                       % (child.name,from_shape, len(co)/3) )
-    dco  = [0.0]*len(co)
-    mask = [0]*len(co)
+    for key in [key for key in precompiled_maps if key[0] not in scene.objects]:
+        del precompiled_maps[key]
 
-    updatelog.debug("update_custom_bones: collect weight groups...")
-    groups = None #precompiled_maps.get(child.name, None)
-    if not groups:
-        groups = {}
-        for i,group in enumerate(child.vertex_groups):
-            if group.name in bones and bones[group.name].use_deform:
-                groups[i] = (group.name, [])
-
-        for i,v in enumerate(child.data.vertices):
-            if all_verts or v.select:
-                totw = 0
-                vgroups = [] # will contain only valid deforming bone groups 
-                for g in v.groups:
-                    if g.group in groups:
-                        vgroups.append((g.group,g.weight))
-                        totw += g.weight
-
-                if totw == 0:
-
-                    unweightedvertices = True
-                    continue
+@persistent
+def reset_weight_maps(dummy):
+    precompiled_maps.clear()
 
-                for g,w in vgroups:
-                    groups[g][1].append((i, w/totw))
+def get_weight_groups(child, bones, all_verts=True):
+    '''
+    Collect the normalized weights of all deforming bone groups of child.
+    Returns a dict {bone name: (vertex indices, weights)} and a flag which
+    tells if unweighted vertices have been found.
 
-        for key, values in groups.items():
-            if len(values) == 0:
-                del groups[key]
+    The weight map of all vertices is cached in precompiled_maps until
+    the vertex groups, the deforming bones or the vertex count change,
+    or until the map gets invalidated by invalidate_weight_groups()
+    '''
+    group_names = {}
+    for i,group in enumerate(child.vertex_groups):
+        if group.name in bones and bones[group.name].use_deform:
+            group_names[i] = group.name
+
+    if not all_verts:
+        return collect_weight_groups(child, group_names, all_verts)
+
+    key = weight_map_key(child)
+    signature = (len(child.data.vertices), tuple(sorted(group_names.items())))
+    cached = precompiled_maps.get(key)
+    if cached and cached[0] == signature:
+        return cached[1], cached[2]
+
+    updatelog.debug("get_weight_groups: precompile weight map of %s" % child.name)
+    groups, unweightedvertices = collect_weight_groups(child, group_names, all_verts)
+    precompiled_maps[key] = (signature, groups, unweightedvertices)
+    return groups, unweightedvertices
+
+def collect_weight_groups(child, group_names, all_verts):
+    W = util.get_weight_matrix(child)
+    gmask = np.zeros(len(W.group_names), dtype=bool)
+    gmask[[g for g in group_names if g < len(gmask)]] = True
+    entries = W.entry_mask(gmask)
+
+    if not all_verts:
+        selected = np.zeros(W.vcount, dtype=bool)
+        child.data.vertices.foreach_get('select', selected)
+        entries &= selected[W.rows]
+
+    valid, normalized = W.normalized(entries)
+    tot = W.row_sum(entries)
+    unweightedvertices = bool(np.any(tot[selected] == 0) if not all_verts else np.any(tot == 0))
+
+    groups = {}
+    selection = np.flatnonzero(valid)
+    selection = selection[np.argsort(W.groups[selection], kind='mergesort')]
+    gids, starts = np.unique(W.groups[selection], return_index=True)
+    for g, part in zip(gids.tolist(), np.split(selection, starts[1:])):
+        groups[group_names[g]] = (W.rows[part], normalized[part])
+
+    return groups, unweightedvertices
+
+def restrict_weight_groups(groups, dirty_bones):
+    '''
+    Reduce the weight groups to the vertices which are weighted
+    to at least one of the dirty bones.
+    Returns the reduced groups and the indices of the affected vertices
+    '''
+    dirty_verts = [np.asarray(indices) for name, (indices, weights) in groups.items() if name in dirty_bones]
+    if len(dirty_verts) == 0:
+        return {}, np.zeros(0, dtype=np.int32)
+
+    dirty_verts = np.unique(np.concatenate(dirty_verts))
+    reduced = {}
+    for name, (indices, weights) in groups.items():
+        indices = np.asarray(indices)
+        sel = np.in1d(indices, dirty_verts, assume_unique=True)
+        if sel.any():
+            reduced[name] = (indices[sel], np.asarray(weights)[sel])
+    return reduced, dirty_verts
+
+def get_bone_deform_data(arm, dbone, init):
+    '''
+    Return the rest location, the target location and the local scale
+    matrix of a deforming bone as used by the slider system
+    '''
+    BoneLoc0, BoneLoc, MScale = get_binding_data(arm, dbone, use_cache=True)
 
+    MatRot = Matrix()
+    if 'rot0' in dbone:# and dbone.name.startswith(("m","a")):
+        rx,ry,rz = dbone['rot0']
+        MatRot = Matrix.Rotation(rx,4,'X')*Matrix.Rotation(ry,4,'Y')*Matrix.Rotation(rz,4,'Z')
+        MScaleLocal = MatRot * MScale * MatRot.inverted()
     else:
-        updatelog.warning("update_custom_bones: Loaded precompiled map of child %s" % child.name)
-        pass
 
-    for name, weights in groups.values():
-        dbone = bones.get(name, None)
-        if not dbone or len(weights) == 0:
-            continue
+        MScaleLocal = MScale
 
-        BoneLoc0, BoneLoc, MScale = get_binding_data(arm, dbone, use_cache=True)
+    M = rig.bind_rotation_matrix(arm, dbone).to_4x4()
+    MScaleLocal = M * MScaleLocal * M.inverted()
 
-        MatRot = Matrix()
-        if 'rot0' in dbone:# and dbone.name.startswith(("m","a")):
-            rx,ry,rz = dbone['rot0']
-            MatRot = Matrix.Rotation(rx,4,'X')*Matrix.Rotation(ry,4,'Y')*Matrix.Rotation(rz,4,'Z')
-            MScaleLocal = MatRot * MScale * MatRot.inverted()
-        else:
+    if init:
 
-            MScaleLocal = MScale
+        BoneLoc0, BoneLoc = BoneLoc, BoneLoc0
+        MScaleLocal       = MScaleLocal.inverted()
 
-        M = rig.bind_rotation_matrix(arm, dbone).to_4x4()
-        MScaleLocal = M * MScaleLocal * M.inverted()
+    return BoneLoc0, BoneLoc, MScaleLocal
 
-        if init:
+def deform_custom_shape_loop(child, arm, bones, co, groups, init):
+    '''
+    Apply the bone deform to the shape co (per vertex reference implementation)
+    Returns the deformed shape as flat coordinate list
+    '''
+    MMeshWorld  = child.matrix_local
+    MMeshWorldI = MMeshWorld.inverted()
+
+    co   = list(co)
+    dco  = [0.0]*len(co)
+    mask = [0]*len(co)
+
+    for name, (indices, weights) in groups.items():
+        dbone = bones.get(name, None)
+        if not dbone or len(weights) == 0:
+            continue
 
-            BoneLoc0, BoneLoc = BoneLoc, BoneLoc0
-            MScaleLocal       = MScaleLocal.inverted()
+        BoneLoc0, BoneLoc, MScaleLocal = get_bone_deform_data(arm, dbone, init)
 
-        for vert,weight in weights:
+        for vert,weight in zip(indices, weights):
 
             offset        = 3*vert
 
             if offset+3 > len(co):
-                updatelog.error("update_custom_bones: shape too small: %s:%s has %d entries, but needs %d to solve offset %d" 
-                             % (child.name, from_shape, len(co), 3*len(child.data.vertices), offset) )
+                updatelog.error("update_custom_bones: shape too small: %s has %d entries, but needs %d to solve offset %d" 
+                             % (child.name, len(co), 3*len(child.data.vertices), offset) )
                 continue
 
             vertLocation  = Vector(co[offset:offset+3])  # in local space
@@ -1805,12 +2295,107 @@ def update_custom_bones(child, arm, init=False, adjust_shift=None, all_verts=Tru
             mask[offset+1] = 1
             mask[offset+2] = 1
 
-    updatelog.debug("update_custom_bones: updated %d Groups" % (len(groups)) )
-
     for ii in range(len(dco)):
         if mask[ii]:
             co[ii] += dco[ii]
 
+    return co
+
+def deform_custom_shape_batched(child, arm, bones, co, groups, init):
+    '''
+    Apply the bone deform to the shape co (vectorized implementation)
+    The mesh world matrix, the bone scale and the bone locations are
+    combined into one affine matrix per bone, which is then applied
+    to all weighted vertices of the bone at once.
+    Returns the deformed shape as flat coordinate list
+    '''
+    MMeshWorld  = child.matrix_local
+    MMeshWorldI = MMeshWorld.inverted()
+
+    verts = np.array(co, dtype=np.float64).reshape(-1,3)
+    vcount = len(verts)
+    dco   = np.zeros((vcount,3), dtype=np.float64)
+    mask  = np.zeros(vcount, dtype=bool)
+
+    for name, (indices, weights) in groups.items():
+        dbone = bones.get(name, None)
+        if not dbone or len(weights) == 0:
+            continue
+
+        indices = np.asarray(indices, dtype=np.int32)
+        weights = np.asarray(weights, dtype=np.float64)
+        valid = indices < vcount
+        if not valid.all():
+            updatelog.error("update_custom_bones: shape too small: %s has %d entries, but needs %d to solve offset %d" 
+                         % (child.name, 3*vcount, 3*len(child.data.vertices), 3*indices.max()) )
+            indices = indices[valid]
+            weights = weights[valid]
+
+        BoneLoc0, BoneLoc, MScaleLocal = get_bone_deform_data(arm, dbone, init)
+        A = MMeshWorldI * Matrix.Translation(BoneLoc) * MScaleLocal * Matrix.Translation(-BoneLoc0) * MMeshWorld
+        A = np.array(A, dtype=np.float64)
+
+        vloc = verts[indices]
+        L0   = vloc.dot(A[:3,:3].T) + A[:3,3] - vloc
+        dco[indices] += L0 * weights[:,None]
+        mask[indices] = True
+
+    verts[mask] += dco[mask]
+    return verts.ravel().tolist()
+
+def update_custom_bones(child, arm, init=False, adjust_shift=None, all_verts=True, dirty_bones=None):
+    util.progress_update(10, absolute=False)
+
+    #
+
+    #
+
+    if init:
+       from_shape = 'original'
+       to_shape   = 'neutral_shape'
+
+    else:
+       from_shape = 'neutral_shape'
+       to_shape   = 'bone_morph'
+
+    bones = util.get_modify_bones(arm)
+       
+    co, from_shape = get_shape_data(child, from_shape)
+    if co is None:
+        updatelog.warning("update_custom_bones: Mesh object %s has no mesh shape data (ignore)" % (child.name) )
+        return
+    if len(co)/3 < len(child.data.vertices):
+        updatelog.error("update_custom_bones: shape %s:%s of length %d < vertlen: %d"
+                       % (child.name,from_shape, len(co)/3, len(child.data.vertices)) )
+    updatelog.debug("update_custom_bones: use shape %s:%s of length %d"
+                       % (child.name,from_shape, len(co)/3) )
+    updatelog.debug("update_custom_bones: collect weight groups...")
+    groups, unweightedvertices = get_weight_groups(child, bones, all_verts)
+
+    morph = None
+    if dirty_bones is not None and not init and 'bone_morph' in child:
+        groups, dirty_verts = restrict_weight_groups(groups, dirty_bones)
+        if len(dirty_verts) == 0:
+            updatelog.debug("update_custom_bones: %s not affected by the change" % (child.name) )
+            return
+        morph, k = get_shape_data(child, 'bone_morph')
+        if morph is None or len(morph) != len(co):
+            updatelog.debug("update_custom_bones: no matching bone morph for %s, full update" % (child.name) )
+            return update_custom_bones(child, arm, init, adjust_shift, all_verts)
+
+    pref = util.getAddonPreferences()
+    if pref.use_vectorized_sliders:
+        co = deform_custom_shape_batched(child, arm, bones, co, groups, init)
+    else:
+        co = deform_custom_shape_loop(child, arm, bones, co, groups, init)
+
+    if morph is not None:
+        morph = np.array(morph, dtype=np.float64).reshape(-1,3)
+        morph[dirty_verts] = np.array(co, dtype=np.float64).reshape(-1,3)[dirty_verts]
+        co = morph.ravel().tolist()
+
+    updatelog.debug("update_custom_bones: updated %d Groups" % (len(groups)) )
+
     updatelog.debug("update_custom_bones: Set_shape_data for %s:%s" % (child.name, to_shape) )
     set_shape_data(child, to_shape, co)
 
@@ -1847,53 +2432,24 @@ def update_custom_bones(child, arm, init=False, adjust_shift=None, all_verts=Tru
     updatelog.debug("updated %d Groups" % (len(groups)) )
 
 def expandDrivers(armobj, targets):
-    
-    meshchanges = []
-    bonechanges = []
-    
-    try:
-        is_male_shape = armobj.ShapeDrivers.male_80
-    except:
-        is_male_shape = False
-
-    for target in targets: 
-
-        try:
-            Ds = armobj.ShapeDrivers.DRIVERS[target]
-        except:
-            Ds = []
-
-        for D in Ds:
-        
-            pid = D['pid']
-            
-            v100 = getShapeValue(armobj,pid)
-            if pid == 'male_80':
-                v = v100
-            else:
-                v = rescale(v100, 0, 100, D['value_min'], D['value_max'])
-            
-            for_gender = D['sex']
-            if (for_gender == 'male' and not is_male_shape) or (for_gender == 'female' and is_male_shape):
-                v = 0
-            
-            if D['type'] == 'mesh':
-
-                meshchanges.append((D, v, v100/100))
-                if len(D['bones'])>0:
-
-                    bonechanges.append((D, v, v100/100))
-            elif D['type'] == 'bones':
-
-                bonechanges.append((D, v, v100/100))
-            elif D['type'] == 'driven':
+    '''
+    Evaluate the precompiled driver graph for the current
+    values of targets. Returns the mesh changes and the bone changes
+    as lists of (Driver, value, percentage)
+    '''
+    graph = armobj.ShapeDrivers.DRIVER_GRAPH
+    values = OrderedDict()
+    for target in targets:
+        if graph.has_target(target):
+            values[target] = getShapeValue(armobj, target)
 
-                expandDrivenKeys(armobj, D, v, meshchanges, bonechanges)
-            else:
-                logging.error(D)
-                raise Exception(_("Unknown shape driver %s")%pid)
+    return graph.evaluate(values, is_male_shape(armobj))
 
-    return meshchanges, bonechanges
+def is_male_shape(armobj):
+    try:
+        return armobj.ShapeDrivers.male_80
+    except:
+        return False
 
 def restore_spine_fold_state(armobj):
     foldstate = armobj.get('spine_unfold', 'none')
@@ -1990,85 +2546,6 @@ def apply_sliders_to_rig(bones, D, v):
                 bone['scale']  = scale
                 bone['offset'] = offset
 
-def expandDrivenKeys(armobj, D, v, meshchanges, bonechanges):
-    '''
-    Expand from driver that controls other drivers
-    '''
-
-    #
-
-    is_male_shape = armobj.ShapeDrivers.male_80
-    
-    for DR in D['driven']:
-        dpid = DR['pid'] 
-
-        if dpid in [
-                    'eyeball_size_679',
-                    'eyeball_size_680',
-                    'eyeball_size_681',
-                    'eyeball_size_687',
-                    'eyeball_size_688',
-                    'eyeball_size_691',
-                    'eyeball_size_694',
-                    'eyeball_size_695',
-                    ]:
-
-            continue
-      
-        if dpid == 'muscular_torso_106' and \
-            ((is_male_shape and D['pid'] == 'torso_muscles_649') or \
-             (not is_male_shape and D['pid'] == 'torso_muscles_678')):
-
-            continue
-            
-        if v < DR['min1'] or v > DR['min2']:
-            vg = 0.0
-        elif v >= DR['max1'] and v <= DR['max2']:
-            vg = 1.0
-        elif v < DR['max1']:
-
-            try:
-                vg = (v - DR['min1'])/(DR['max1']-DR['min1'])
-            except ZeroDivisionError:
-                vg = 1.0
-        else:
-
-            try:
-                vg = 1.0 - (v - DR['max2'])/(DR['min2']-DR['max2'])
-            except ZeroDivisionError:
-                vg = 1.0
-       
-        try:
-            D2s = armobj.ShapeDrivers.DRIVERS[dpid]
-        except KeyError:
-            if dpid not in ["pants_length_shadow_915","pants_length_cloth_615","pants_length_cloth_1018","pants_length_cloth_1036","lower_clothes_shading_913","upper_clothes_shading_899"]:
-
-                logging.warn(_("Missing driver: %s"), dpid)
-            continue
-        
-        counter=0
-        for D2 in D2s:
-            counter +=1
-
-            v2 = rescale(vg, 0.0, 1.0, D2['value_min'], D2['value_max'] )
-           
-            is_for_gender = D2['sex']
-            
-            if (is_for_gender == 'male' and not is_male_shape) or (is_for_gender == 'female' and is_male_shape):
-                v2 = 0
-                
-            if D2['type'] == 'mesh':
-                meshchanges.append((D2, v2, vg))
-                if len(D2['bones'])>0:
-                    bonechanges.append((D2, v2, vg))
-
-            elif D2['type'] == 'bones':
-
-                bonechanges.append((D2, v2, vg))
-            else:
-                logging.error(D2)
-                raise Exception(_("Unknown shape driver %s")%D2['pid'])
-
 def setHands(obj, scene):
     arm = util.get_armature(obj)
     props = arm.RigProps
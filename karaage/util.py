@@ -38,6 +38,9 @@ import logging, traceback
 import bpy, sys, os, gettext
 from math import radians, sqrt, pi
 from mathutils import Vector, Matrix, Quaternion, Color
+from mathutils.kdtree import KDTree
+from mathutils.bvhtree import BVHTree
+import numpy as np
 import bmesh
 from bpy.app.handlers import persistent
 from bpy.props import *
@@ -929,6 +932,21 @@ def get_vertex_coordinates(ob):
    
     return coords
     
+def get_vertex_array(verts):
+    '''
+    Return the coordinates of a vertex collection as (n,3) array
+    '''
+    co = np.empty(3*len(verts), dtype=np.float32)
+    verts.foreach_get('co', co)
+    return co.reshape(-1,3).astype(np.float64)
+
+def transform_points(M, points):
+    '''
+    Apply the 4x4 matrix M to an (n,3) array of points
+    '''
+    M = np.array(M, dtype=np.float64)
+    return np.asarray(points, dtype=np.float64).dot(M[:3,:3].T) + M[:3,3]
+
 def get_weights(ob, vgroup):
     weights = []
     for index, vert in enumerate(ob.data.vertices):
@@ -1134,16 +1152,10 @@ def getMesh(context, obj, exportRendertypeSelection, apply_mesh_rotscale = True,
     return mesh_data_copy
 
 def get_uv_vert_count(me):
-    edge_count = len([e.use_seam for e in me.edges if e.use_seam])
-    return edge_count + len(me.vertices)
+    seams = np.empty(len(me.edges), dtype=bool)
+    me.edges.foreach_get('use_seam', seams)
+    return int(seams.sum()) + len(me.vertices)
     
-def get_nearest_vertex_normal(source_verts, target_vert):
-    for source_vert in source_verts:
-        dist = (target_vert.co - source_vert.co).magnitude
-        if dist < 0.001:
-            return source_vert.normal
-    return
-
 def get_boundary_verts(bmsrc, context, obj, exportRendertypeSelection="NONE", apply_mesh_rotscale = True):
     mesh_data_copy = getMesh(context, obj, exportRendertypeSelection, apply_mesh_rotscale)
     bmsrc.from_mesh(mesh_data_copy)
@@ -1170,47 +1182,68 @@ def get_boundary_verts(bmsrc, context, obj, exportRendertypeSelection="NONE", ap
     bpy.data.meshes.remove(mesh_data_copy)
     return bmsrc.verts
 
-def get_adjusted_vertex_normals(context, sources, exportRendertypeSelection, apply_mesh_rotscale):
-    bm_source  = bmesh.new()
-    bm_target  = bmesh.new()
-    
-    targets = sources.copy()
-    source_normals    = {}
-    
-    for obj in sources:
-        try:
-            bm_target.verts.ensure_lookup_table()
-            bm_source.verts.ensure_lookup_table()
-        except:
-            pass
-            
-        target_verts = get_boundary_verts(bm_target, context, obj, exportRendertypeSelection, apply_mesh_rotscale)
-        targets.remove(obj)
-        for otherobj in sources:
+class BoundaryVertexIndex:
+    '''
+    The boundary vertices of the evaluated mesh of a mesh object,
+    stored in a KD-tree for fast nearest vertex lookups
+    '''
+
+    def __init__(self, context, obj, exportRendertypeSelection="NONE", apply_mesh_rotscale = True):
+        mesh_data_copy = getMesh(context, obj, exportRendertypeSelection, apply_mesh_rotscale)
+        bm = bmesh.new()
+        bm.from_mesh(mesh_data_copy)
+
+        verts = [v for v in bm.verts if len(v.link_edges) == 0 or any(len(e.link_faces) < 2 for e in v.link_edges)]
+        self.name    = obj.name
+        self.indices = [v.index for v in verts]
+        self.cos     = [v.co.copy() for v in verts]
+        self.normals = [v.normal.copy() for v in verts]
+
+        bm.free()
+        bpy.data.meshes.remove(mesh_data_copy)
+
+        self.tree = KDTree(len(verts))
+        for i, co in enumerate(self.cos):
+            self.tree.insert(co, i)
+        self.tree.balance()
+
+    def find(self, co, radius):
+        '''
+        Return the position of the boundary vertex nearest to co
+        or None when no boundary vertex is closer than radius
+        '''
+        if len(self.cos) == 0:
+            return None
+        nco, i, dist = self.tree.find(co)
+        return i if i is not None and dist < radius else None
+
+def get_adjusted_vertex_normals(context, sources, exportRendertypeSelection, apply_mesh_rotscale, radius=0.001):
+    indexes = [BoundaryVertexIndex(context, obj, exportRendertypeSelection, apply_mesh_rotscale) for obj in sources]
+    source_normals = {}
+
+    for target in indexes:
+        target_normals = [n.copy() for n in target.normals]
+        for source in indexes:
         
-            if otherobj == obj:
+            if source is target:
                 continue
-                
-            source_verts = get_boundary_verts(bm_source, context, otherobj, exportRendertypeSelection, apply_mesh_rotscale)
-            if not obj.name in source_normals:
-                source_normals[obj.name]={}
-            normals = source_normals[obj.name]
+
+            if not target.name in source_normals:
+                source_normals[target.name]={}
+            normals = source_normals[target.name]
             fixcount = 0
-            for vert in target_verts:
-                near = get_nearest_vertex_normal(source_verts, vert)
-                if near:
-                    vert.normal = (vert.normal + near) * 0.5
-                    vert.normal.normalize()
-                    normals[vert.index] = vert.normal.copy()
+            for i, co in enumerate(target.cos):
+                j = source.find(co, radius)
+                if j is not None:
+                    normal = (target_normals[i] + source.normals[j]) * 0.5
+                    normal.normalize()
+                    target_normals[i] = normal
+                    normals[target.indices[i]] = normal.copy()
                     fixcount +=1
                     
             if fixcount > 0:
-                print("merged %d normals from %s with target %s" % (fixcount, otherobj.name, obj.name) )
-            bm_source.clear()
-        bm_target.clear()
-        
-    bm_source.free()        
-    bm_target.free()
+                print("merged %d normals from %s with target %s" % (fixcount, source.name, target.name) )
+
     return source_normals
         
 ABERRANT_PLURAL_MAP = {
@@ -1655,6 +1688,25 @@ class Bone:
         if all or end0       != None: self.end0      = end0
         if all or is_structure != None: self.is_structure = is_structure
 
+    def __getstate__(self):
+        state = {}
+        for key, val in self.__dict__.items():
+            if isinstance(val, (Vector, Matrix, Quaternion, Color)):
+                val = (type(val).__name__, [tuple(row) for row in val] if isinstance(val, Matrix) else tuple(val))
+                key = '__mathutils__' + key
+            state[key] = val
+        return state
+
+    def __setstate__(self, state):
+        types = {'Vector':Vector, 'Matrix':Matrix, 'Quaternion':Quaternion, 'Color':Color}
+        for key, val in state.items():
+            if key.startswith('__mathutils__'):
+                key = key[len('__mathutils__'):]
+                val = types[val[0]](val[1])
+            self.__dict__[key] = val
+        if not self.bonegroup in Bone.bonegroups:
+            Bone.bonegroups.append(self.bonegroup)
+
     def get_scale(self):
         if self.is_structure and self.parent:
             return self.parent.get_scale()
@@ -2645,6 +2697,213 @@ def ray_cast(ob, co, nor):
         status = index > -1
     return status, co, no, index
 
+class SpatialIndex:
+    '''
+    BVH tree over a mesh for batched closest point, ray cast and
+    range queries. All queries take and return (n,3) arrays in the
+    object space of the mesh (use to_local for world space points).
+    Polygon indices are -1 where a query found nothing.
+    '''
+
+    def __init__(self, cos, polygons, matrix_world):
+        self.cos = cos
+        self.polygons = polygons
+        self.signature = None
+        self.set_matrix_world(matrix_world)
+        self.bvh = BVHTree.FromPolygons(cos.tolist(), polygons)
+
+    @staticmethod
+    def from_object(scene, ob, apply_modifiers=True, settings='PREVIEW', cached=None):
+        '''
+        Index of the evaluated mesh of ob. When cached was built from
+        the same evaluated mesh (see signature) it is reused.
+        '''
+        me = ob.to_mesh(scene, apply_modifiers, settings)
+        try:
+            cos = get_vertex_array(me.vertices)
+            loop_verts = np.empty(len(me.loops), dtype=np.int32)
+            me.loops.foreach_get('vertex_index', loop_verts)
+            signature = (len(cos), len(me.polygons), hash(cos.tobytes()), hash(loop_verts.tobytes()))
+            if cached is not None and cached.signature == signature:
+                if cached.matrix_world != ob.matrix_world:
+                    cached.set_matrix_world(ob.matrix_world)
+                return cached
+            polygons = [tuple(p.vertices) for p in me.polygons]
+        finally:
+            bpy.data.meshes.remove(me)
+        index = SpatialIndex(cos, polygons, ob.matrix_world)
+        index.signature = signature
+        return index
+
+    def set_matrix_world(self, matrix_world):
+        self.matrix_world = matrix_world.copy()
+        self.MI = matrix_world.inverted()
+
+    def to_local(self, points):
+        return transform_points(self.MI, np.asarray(points, dtype=np.float64).reshape(-1,3))
+
+    @staticmethod
+    def results(count):
+        return (np.full((count,3), np.nan), np.full((count,3), np.nan),
+                np.full(count, -1, dtype=np.int64), np.full(count, np.inf))
+
+    def find_nearest(self, points, distance=None):
+        '''
+        Closest points on the mesh.
+        Returns (locations, normals, polygon indices, distances)
+        '''
+        points = np.asarray(points, dtype=np.float64).reshape(-1,3)
+        locations, normals, indices, distances = SpatialIndex.results(len(points))
+        find = self.bvh.find_nearest
+        for i, p in enumerate(points.tolist()):
+            loc, nor, index, dist = find(p) if distance is None else find(p, distance)
+            if index is not None:
+                locations[i] = loc
+                normals[i] = nor
+                indices[i] = index
+                distances[i] = dist
+        return locations, normals, indices, distances
+
+    def ray_cast(self, origins, directions, distance=None):
+        '''
+        First hits of the rays from origins into directions, optionally
+        limited by distance (a scalar or one value per ray).
+        Returns (locations, normals, polygon indices, distances)
+        '''
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1,3)
+        directions = np.broadcast_to(np.asarray(directions, dtype=np.float64), origins.shape)
+        limits = np.broadcast_to(np.asarray(sys.float_info.max if distance is None else distance, dtype=np.float64), len(origins))
+        locations, normals, indices, distances = SpatialIndex.results(len(origins))
+        cast = self.bvh.ray_cast
+        for i, (o, d, l) in enumerate(zip(origins.tolist(), directions.tolist(), limits.tolist())):
+            loc, nor, index, dist = cast(o, d, l)
+            if index is not None:
+                locations[i] = loc
+                normals[i] = nor
+                indices[i] = index
+                distances[i] = dist
+        return locations, normals, indices, distances
+
+    def find_range(self, points, radius):
+        '''
+        Polygons within radius of each point.
+        Returns a list with one array of polygon indices per point
+        '''
+        points = np.asarray(points, dtype=np.float64).reshape(-1,3)
+        find = self.bvh.find_nearest_range
+        return [np.array([hit[2] for hit in find(p, radius)], dtype=np.int64) for p in points.tolist()]
+
+SPATIAL_INDEXES = {} # object name -> SpatialIndex of the evaluated mesh
+
+def get_spatial_index(scene, ob):
+    '''
+    Return the SpatialIndex of the evaluated mesh of ob. The mesh is
+    evaluated on every call, but the index is only rebuilt when the
+    vertex coordinates or the polygons of the evaluated mesh changed.
+    '''
+    index = SpatialIndex.from_object(scene, ob, cached=SPATIAL_INDEXES.get(ob.name))
+    SPATIAL_INDEXES[ob.name] = index
+    return index
+
+class WeightMatrix:
+    '''
+    The vertex weights of a mesh object as sparse vertex x group matrix
+    in CSR layout: the weights of vertex i are weights[indptr[i]:indptr[i+1]]
+    for the vertex groups groups[indptr[i]:indptr[i+1]].
+    Per entry masks (see entry_mask) and the row_* functions turn
+    per vertex questions into NumPy operations.
+    The weights are read from me (e.g. an evaluated copy) if given.
+    '''
+
+    def __init__(self, obj, me=None):
+        verts = (obj.data if me is None else me).vertices
+        counts = np.zeros(len(verts), dtype=np.int32)
+        groups = []
+        weights = []
+        for i, v in enumerate(verts):
+            vgroups = v.groups
+            counts[i] = len(vgroups)
+            for g in vgroups:
+                groups.append(g.group)
+                weights.append(g.weight)
+
+        self.vcount = len(verts)
+        self.counts = counts
+        self.indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int32)
+        self.rows = np.repeat(np.arange(self.vcount, dtype=np.int32), counts)
+        self.groups = np.array(groups, dtype=np.int32)
+        self.weights = np.array(weights, dtype=np.float32)
+        self.group_names = [g.name for g in obj.vertex_groups]
+        self.signature = weight_matrix_signature(obj)
+
+    def entry_mask(self, group_mask):
+        '''
+        Expand a mask over the vertex groups to a mask over all entries.
+        Entries referring to non existing vertex groups are never set.
+        '''
+        group_mask = np.append(np.asarray(group_mask, dtype=bool), False)
+        return group_mask[np.minimum(self.groups, len(self.group_names))]
+
+    def group_mask(self, names):
+        names = set(names)
+        return np.array([name in names for name in self.group_names], dtype=bool)
+
+    def deform_mask(self, armature, bone_names=None):
+        '''
+        Mask of the vertex groups of deforming bones of armature
+        (optionally restricted to bone_names). All groups when armature is None.
+        '''
+        if armature is None:
+            return np.ones(len(self.group_names), dtype=bool)
+        bones = armature.data.bones
+        bone_names = None if bone_names is None else set(bone_names)
+        return np.array([name in bones and bones[name].use_deform and (bone_names is None or name in bone_names)
+                         for name in self.group_names], dtype=bool)
+
+    def row_count(self, entries):
+        return np.bincount(self.rows[entries], minlength=self.vcount)
+
+    def row_sum(self, entries):
+        return np.bincount(self.rows[entries], weights=self.weights[entries], minlength=self.vcount)
+
+    def normalized(self, entries):
+        '''
+        Return (entries with a positive row sum, weights of all entries
+        normalized to the row sums over entries)
+        '''
+        tot = self.row_sum(entries)
+        normalized = np.zeros(len(self.weights), dtype=np.float64)
+        valid = entries & (tot[self.rows] > 0)
+        normalized[valid] = self.weights[valid] / tot[self.rows[valid]]
+        return valid, normalized
+
+WEIGHT_MATRICES = {} # object name -> WeightMatrix
+
+def weight_matrix_signature(obj):
+    return (obj.data.as_pointer(), len(obj.data.vertices), tuple(g.name for g in obj.vertex_groups))
+
+def get_weight_matrix(obj):
+    '''
+    Return the WeightMatrix of obj. The matrix is cached until the vertex
+    groups or vertex count change, or invalidate_weight_matrix is called
+    (after weight edits, see shape.update_weight_maps_on_update)
+    '''
+    matrix = WEIGHT_MATRICES.get(obj.name)
+    if matrix is None or matrix.signature != weight_matrix_signature(obj):
+        matrix = WEIGHT_MATRICES[obj.name] = WeightMatrix(obj)
+    return matrix
+
+def invalidate_weight_matrix(obj=None):
+    if obj is None:
+        WEIGHT_MATRICES.clear()
+    else:
+        WEIGHT_MATRICES.pop(obj.name, None)
+
+@persistent
+def reset_object_caches(dummy):
+    SPATIAL_INDEXES.clear()
+    WEIGHT_MATRICES.clear()
+
 def get_center(context, ob):
 
     active = context.scene.objects.active    
@@ -33,7 +33,9 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import bpy, bmesh, sys
+from collections import OrderedDict
 from mathutils import Vector, Matrix
+import numpy as np
 import  xml.etree.ElementTree as et
 import xmlrpc.client
 from bpy_extras.io_utils import ExportHelper
@@ -748,97 +750,138 @@ def mirror_vgroup(context, armobj, obj, bone_name, mirror_name, use_topology):
     armobj.data.bones[mirror_name].select = original_select
     print("mirrored from %s -> %s"%(mirror_name,bone_name))
 
-def getWeights(target_ob, source_ob, point, submesh = False, restrictTo=None):
-
-    M = target_ob.matrix_world
-    p = M.inverted()*point
-
-    status, loc, face_normal, face_index = util.closest_point_on_mesh(target_ob, p)
-
-    target_me = target_ob.data
-    target_verts  = target_me.vertices
-
-    target_poly= target_me.polygons[face_index]
-    gdata = {}
-
-    if submesh:
-        dmin = (p-loc).length
-
-        vw = interpolation(target_ob, target_poly, loc)
-
-        for vidx, interpw in vw.items():
-
-            v = target_verts[vidx]
-
-            for grp in v.groups:
-                grp_index = grp.group
-                source_group = source_ob.vertex_groups[grp_index]
-                if not source_group:
-                    print ("Copy weights from %s.%s to %s failed" % (source_ob.name, grp.group, target_ob.name) )
-                else:
-                    gname = source_group.name
-                    if  restrictTo==None or gname in restrictTo:
-                        weight = grp.weight
-                        oldweight = gdata.get(gname, 0)
-                        gdata[gname] = oldweight + weight*interpw
-
-    else:
-
-        vtx = min(target_poly.vertices, key=lambda v: (p - target_verts[v].co).length)
-
-        v = target_verts[vtx]
-        dmin = (v.co-p).length
-
-        for grp in v.groups:
-            gname = source_ob.vertex_groups[grp.group].name
-            if  restrictTo==None or gname in restrictTo:
-                weight = grp.weight
-                gdata[gname] = weight
-
-    return dmin, gdata
-
-def interpolation(obj, polygon, loc):
+class WeightTransferSource:
+    '''
+    A baked weight source prepared for batched weight transfer.
+    The BVH tree, the vertex weights and the per polygon interpolation
+    data are created once and then reused for all target vertices.
+    '''
 
     SMALLEST_DISTANCE = 1e-5
     SMALLEST_WSUM     = 1e-8
 
-    D = 0
-    for v1idx in polygon.vertices:
-        v1 = obj.data.vertices[v1idx]
-        for v2idx in polygon.vertices:
-            v2 = obj.data.vertices[v2idx]
-            if v1idx!=v2idx:
-                d = (v1.co-v2.co).length
-                D = max(D,d)
-    sigma = D
-
-    on_vertex = None
-    weights = {}
-    N = 0
-    for vidx in polygon.vertices:
-        v = obj.data.vertices[vidx]
-        d = (loc-v.co).length
+    def __init__(self, target_ob, source_ob, restrictTo=None):
+        self.target_ob = target_ob
+        self.source_ob = source_ob
 
-        if d < SMALLEST_DISTANCE:
-            on_vertex = vidx
-            break
-        else:
-            w = exp(-(d/sigma)**2)
-            weights[vidx] = w
-            N += w
-
-    if on_vertex is None and N < SMALLEST_WSUM:
-        on_vertex = polygon.vertices[0]
+        me = target_ob.data
+        self.cos = util.get_vertex_array(me.vertices)
+        self.polygons = [tuple(p.vertices) for p in me.polygons]
+        self.index = util.SpatialIndex(self.cos, self.polygons, target_ob.matrix_world)
+        self.sigmas = {}
 
-    if on_vertex is None:
-        for vidx in weights:
-            weights[vidx] = weights[vidx]/N
-    else:
-        for vidx, w in weights.items():
-            weights[vidx] = 0.0
-        weights[on_vertex] = 1.0
-
-    return weights
+        group_names = [g.name for g in source_ob.vertex_groups]
+        self.vgroups = []
+        for v in me.vertices:
+            vg = {}
+            for grp in v.groups:
+                if grp.group < len(group_names):
+                    gname = group_names[grp.group]
+                    if restrictTo==None or gname in restrictTo:
+                        vg[gname] = grp.weight
+                else:
+                    print ("Copy weights from %s.%s to %s failed" % (source_ob.name, grp.group, target_ob.name) )
+            self.vgroups.append(vg)
+
+    def get_sigma(self, pidx):
+        sigma = self.sigmas.get(pidx)
+        if sigma is None:
+            pco = self.cos[list(self.polygons[pidx])]
+            sigma = np.sqrt(((pco[:,None,:] - pco[None,:,:])**2).sum(axis=2)).max()
+            self.sigmas[pidx] = sigma
+        return sigma
+
+    def interpolation(self, pidx, loc):
+        '''
+        Gaussian weights of the polygon vertices at location loc,
+        normalized to a sum of 1 (1 for a vertex at loc)
+        '''
+        vidxs = self.polygons[pidx]
+        dists = np.sqrt(((self.cos[list(vidxs)] - loc)**2).sum(axis=1))
+        hit = np.flatnonzero(dists < self.SMALLEST_DISTANCE)
+        if len(hit) > 0:
+            return {vidxs[hit[0]]:1.0}
+
+        w = np.exp(-(dists/self.get_sigma(pidx))**2)
+        N = w.sum()
+        if N < self.SMALLEST_WSUM:
+            return {vidxs[0]:1.0}
+
+        return dict(zip(vidxs, (w/N).tolist()))
+
+    def get_weights(self, points, submesh=False):
+        '''
+        Find the weights for an (n,3) array of points in world space
+        Returns a list of (distance, {group name: weight})
+        '''
+        points = self.index.to_local(points)
+        locs, normals, pidxs, dists = self.index.find_nearest(points)
+        result = []
+        for p, loc, pidx, dist in zip(points, locs, pidxs.tolist(), dists.tolist()):
+            if pidx == -1:
+                result.append((float('inf'), {}))
+                continue
+
+            gdata = {}
+            if submesh:
+                dmin = dist
+                for vidx, interpw in self.interpolation(pidx, loc).items():
+                    for gname, weight in self.vgroups[vidx].items():
+                        gdata[gname] = gdata.get(gname, 0) + weight*interpw
+            else:
+                vidxs = self.polygons[pidx]
+                dists = np.sqrt(((self.cos[list(vidxs)] - p)**2).sum(axis=1))
+                i = int(dists.argmin())
+                dmin = float(dists[i])
+                gdata = dict(self.vgroups[vidxs[i]])
+
+            result.append((dmin, gdata))
+        return result
+
+def get_transfer_weights(target, vertex_indices, sources, submesh):
+    '''
+    For each of the given target vertices return the weights of the
+    closest source as (distance, {group name: weight})
+    or None when there is no source
+    '''
+    cos = util.get_vertex_array(target.data.vertices)[vertex_indices]
+    points = util.transform_points(target.matrix_world, cos)
+    best = [None] * len(vertex_indices)
+    for source in sources:
+        for i, vs in enumerate(source.get_weights(points, submesh)):
+            if best[i] is None or vs[0] < best[i][0]:
+                best[i] = vs
+    return best
+
+def write_transfer_weights(target, vertex_indices, results, clearTargetWeights, restrictTo=None):
+    '''
+    Write the weights found by get_transfer_weights into the vertex
+    groups of target. Vertices with equal weights are added with one
+    call per vertex group.
+    Returns {group name: list of vertex indices} for all written groups
+    '''
+    writes = OrderedDict()
+    for vidx, vs in zip(vertex_indices, results):
+        if vs is None:
+            continue
+        for gn,w in vs[1].items():
+            if restrictTo is None or gn in restrictTo:
+                writes.setdefault(gn, OrderedDict()).setdefault(w, []).append(vidx)
+
+    written = {}
+    for gn, values in writes.items():
+        if clearTargetWeights and gn in target.vertex_groups:
+            target.vertex_groups.remove(target.vertex_groups[gn])
+        if gn not in target.vertex_groups:
+            target.vertex_groups.new(gn)
+
+        group = target.vertex_groups[gn]
+        indices = []
+        for w, vidxs in values.items():
+            group.add(vidxs, w, 'REPLACE')
+            indices.extend(vidxs)
+        written[gn] = indices
+    return written
 
 def copyBoneWeightsToSelectedBones(target, sources, selectedBoneNames, submeshInterpolation=True, allVerts=True, clearTargetWeights=True):
     context = bpy.context
@@ -867,37 +910,18 @@ def copyBoneWeightsToSelectedBones(target, sources, selectedBoneNames, submeshIn
 
     scene.update()
 
-    M=target.matrix_world
-
-    for vertex in target.data.vertices:
-        if allVerts or vertex.select:
-            vs = []
-            pt = M*vertex.co
-
-            for source in clones:
+    transfer_sources = [WeightTransferSource(clone, childobj, selectedBoneNames) for clone, childobj in clones]
+    vertex_indices = [v.index for v in target.data.vertices if allVerts or v.select]
+    results = get_transfer_weights(target, vertex_indices, transfer_sources, submeshInterpolation)
+    written = write_transfer_weights(target, vertex_indices, results, clearTargetWeights and allVerts, selectedBoneNames)
 
-                d, gdata = getWeights(source[0], source[1], pt, submeshInterpolation, selectedBoneNames)
-                vs.append((d,gdata))
-
-            vmin = min(vs, key=lambda v: v[0])
-
-            copied=[]
-            for gn,w in vmin[1].items():
-                if gn in selectedBoneNames:
-                    copied.append(gn)
-                    if clearTargetWeights and allVerts and gn in target.vertex_groups and gn not in clean_target_groups:
-                        target.vertex_groups.remove(target.vertex_groups[gn])
-
-                    if gn not in target.vertex_groups:
-                        target.vertex_groups.new(gn)
-                        clean_target_groups.append(gn)
-
-                    target.vertex_groups[gn].add([vertex.index], w, 'REPLACE')
-
-            if clearTargetWeights and not allVerts:
-                gnames = [gn for gn in selectedBoneNames if gn in target.vertex_groups and gn not in copied]
-                for gn in gnames:
-                    target.vertex_groups[gn].remove([vertex.index])
+    if clearTargetWeights and not allVerts:
+        for gn in selectedBoneNames:
+            if gn in target.vertex_groups:
+                copied = set(written.get(gn, []))
+                uncopied = [vidx for vidx in vertex_indices if vidx not in copied]
+                if uncopied:
+                    target.vertex_groups[gn].remove(uncopied)
 
     for childcopyobj, childobj in clones:
         scene.objects.unlink(childcopyobj)
@@ -1661,39 +1685,6 @@ def get_key_block_by_name(tgt, key_block_name, readonly=False):
         is_new = True
     return sk, is_new
 
-def get_closest_point_of_path(obj, p, p0, p1, stepcount=50):
-    loc = None
-    nor = None
-    i   = -1
-
-    path    = p1-p0
-
-    mindist = None
-    minloc  = None
-    mini    = -1
-
-    close_to_shape_dist = None
-    close_to_shape_loc  = None
-    close_to_shape_mini = -1
-
-    for f in range(stepcount+1):
-        probe = p0+(f/stepcount) * path
-        status, loc, nor, i = util.closest_point_on_mesh(obj, probe)
-        if i != -1:
-            dist    = (probe-loc).magnitude
-            cs_dist = (p-loc).magnitude
-            if mindist == None or dist < mindist:
-                mindist = dist
-                minloc  = probe
-                mini    = i
-
-            if close_to_shape_dist == None or cs_dist < close_to_shape_dist:
-                close_to_shape_dist = cs_dist
-                close_to_shape_loc  = probe
-                close_to_shape_mini = i
-
-    return minloc, mini, close_to_shape_loc, close_to_shape_mini
-
 def smooth_weights(context, obj, bm, from_group, to_group, count=1, factor=0.5, threshold=0.00001, all_verts=True, rendertype='RAW'):
     arm = obj.find_armature()
     OM = obj.matrix_world
@@ -1809,19 +1800,24 @@ def distribute_weights(context, obj, from_group, to_group, threshold=0.00001, al
     unsolved_verts = []
     pgroup = get_pgroup(obj, to_group.name, create=True)
 
-    for index, co in shape_cos.items():
-        v = start_mesh.vertices[index]
-        p  = Vector(shape_cos[index])
-        p0 = Vector(start_cos[index])
-        p1 = Vector(end_cos[index])
+    indices = list(shape_cos.keys())
+    P0 = np.array([start_cos[index] for index in indices], dtype=np.float64).reshape(-1,3)
+    P1 = np.array([end_cos[index] for index in indices], dtype=np.float64).reshape(-1,3)
+    L  = np.sqrt(((P1-P0)**2).sum(axis=1))
+    fitted = L > 0.001
 
-        l = (p1-p0).magnitude
-        if l > 0.001:
-            status, loc, nor, i = util.ray_cast(obj, p0, p1)
+    spatial_index = util.get_spatial_index(context.scene, obj)
+    locs, normals, faces, dists = spatial_index.ray_cast(P0[fitted], P1[fitted]-P0[fitted], L[fitted])
+    hits = np.zeros(len(indices), dtype=bool)
+    hits[np.flatnonzero(fitted)[faces > -1]] = True
+    fractions = np.zeros(len(indices))
+    fractions[hits] = dists[faces > -1] / L[hits]
+
+    for index, l, is_fitted, is_hit, fraction in zip(indices, L.tolist(), fitted.tolist(), hits.tolist(), fractions.tolist()):
+        v = start_mesh.vertices[index]
 
-            if i > -1:
-                f = (loc-p0).magnitude
-                fraction = f/l
+        if is_fitted:
+            if is_hit:
                 fw, tw = distribute_weight(v, from_group, to_group, fraction, threshold, pgroup=pgroup, dbg="3")
 
             else: